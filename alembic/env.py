@@ -7,6 +7,8 @@ from alembic import context
 
 from settings import Settings
 from src.db.connection import Base
+from src.authentication.models import User  # noqa: F401
+from src.blog.models import Post, Comment  # noqa: F401
 
 settings = Settings()
 
@@ -29,6 +31,22 @@ config.set_main_option(
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+
+def include_name(name, type_, parent_names) -> bool:
+    """
+    leaves the full text search of the posts out of autogenerate, it is created by its migration
+    but is not part of the metadata: the posts_fts tables on sqlite, and on postgresql the
+    search_vector column and its index
+    """
+    if type_ == "table":
+        return not name.startswith("posts_fts")
+    if type_ == "column" and parent_names.get("table_name") == "posts":
+        return name != "search_vector"
+    if type_ == "index":
+        return name != "ix_posts_search_vector"
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -53,6 +71,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_name=include_name,
     )
 
     with context.begin_transaction():
@@ -66,6 +85,12 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    # a connection handed over by the caller (e.g. the tests) is used as is
+    connection = config.attributes.get("connection", None)
+    if connection is not None:
+        run_migrations_on(connection)
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
@@ -73,12 +98,16 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata
-        )
+        run_migrations_on(connection)
 
-        with context.begin_transaction():
-            context.run_migrations()
+
+def run_migrations_on(connection) -> None:
+    context.configure(
+        connection=connection, target_metadata=target_metadata, include_name=include_name
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
 
 
 if context.is_offline_mode():
@@ -0,0 +1,67 @@
+"""Add posts full text search
+
+Revision ID: 9c2f4e1a7b3d
+Revises: 6d536766f442
+Create Date: 2026-10-18 10:12:41.503127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c2f4e1a7b3d'
+down_revision: Union[str, None] = '6d536766f442'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        # the generated column is computed for the existing rows when it is added
+        op.execute("""
+            ALTER TABLE posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(body, '')), 'B')
+            ) STORED
+        """)
+        op.create_index(
+            "ix_posts_search_vector", "posts", ["search_vector"], postgresql_using="gin"
+        )
+    elif dialect == "sqlite":
+        op.execute(
+            "CREATE VIRTUAL TABLE posts_fts USING fts5(title, body, content='posts', content_rowid='id')"
+        )
+        op.execute("""
+            CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN
+                INSERT INTO posts_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN
+                INSERT INTO posts_fts(posts_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER posts_fts_update AFTER UPDATE OF title, body ON posts BEGIN
+                INSERT INTO posts_fts(posts_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+                INSERT INTO posts_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+            END
+        """)
+        # indexes the existing posts
+        op.execute("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        op.drop_index("ix_posts_search_vector", table_name="posts")
+        op.drop_column("posts", "search_vector")
+    elif dialect == "sqlite":
+        op.execute("DROP TRIGGER posts_fts_update")
+        op.execute("DROP TRIGGER posts_fts_delete")
+        op.execute("DROP TRIGGER posts_fts_insert")
+        op.execute("DROP TABLE posts_fts")
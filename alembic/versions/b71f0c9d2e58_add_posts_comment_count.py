@@ -0,0 +1,31 @@
+"""Add posts comment count
+
+Revision ID: b71f0c9d2e58
+Revises: 3e8b5d0c6a41
+Create Date: 2026-10-18 14:21:43.518207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b71f0c9d2e58'
+down_revision: Union[str, None] = '3e8b5d0c6a41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    # backfill the counter of the existing posts, from then on the app keeps it up to date
+    op.execute(
+        "UPDATE posts SET comment_count = (SELECT count(*) FROM comments WHERE comments.post_id = posts.id)"
+    )
+
+
+def downgrade() -> None:
+    # not in batch mode: recreating the table on sqlite would drop the full text search triggers
+    op.drop_column('posts', 'comment_count')
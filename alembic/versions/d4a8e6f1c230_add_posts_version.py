@@ -0,0 +1,27 @@
+"""Add posts version
+
+Revision ID: d4a8e6f1c230
+Revises: b71f0c9d2e58
+Create Date: 2026-10-18 16:47:09.731650
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a8e6f1c230'
+down_revision: Union[str, None] = 'b71f0c9d2e58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    # not in batch mode: recreating the table on sqlite would drop the full text search triggers
+    op.drop_column('posts', 'version')
@@ -1,25 +1,32 @@
 import uvicorn
 from fastapi import FastAPI, responses
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from prometheus_client import make_asgi_app
 
 from settings import Settings
-from src.requests_limit import lifespan
-from src.db.connection import engine, Base
+from src.metrics import MetricsMiddleware, metrics_registry
+from src.profiling import ProfilingMiddleware
+from src.requests_limit import RateLimitHeadersMiddleware, lifespan
 from src.authentication.routers import auth_router
 from src.blog.routers import blog_router
 
 
 settings = Settings()
 
-app = FastAPI(title="Blogs API", version="0.0.1", lifespan=lifespan)
+app = FastAPI(title="Blogs API", version="0.0.1", lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.ALLOWED_HOSTS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Link", "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy"],
 )
-Base.metadata.create_all(engine)
+app.add_middleware(RateLimitHeadersMiddleware)
+app.add_middleware(ProfilingMiddleware)
+# added last so it wraps the other middlewares and measures the whole request
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/")
@@ -28,6 +35,7 @@ async def redirect_to_documentation():
 
 app.include_router(auth_router)
 app.include_router(blog_router)
+app.mount("/metrics", make_asgi_app(registry=metrics_registry()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,45 @@
+"""
+Compares benchmark results with a baseline saved by an earlier run of benchmarks.suite.
+
+Latencies (``*_ms``, ``*_us``) regress when they grow, throughputs (``*_per_second``) when
+they drop, by more than {tolerance} of the baseline. Errors regress as soon as there are more.
+Other numbers, e.g. the request counts, describe the run and are not compared.
+"""
+from typing import Dict, Iterator, List, Tuple
+
+
+LOWER_IS_BETTER = ("_ms", "_us")
+HIGHER_IS_BETTER = ("_per_second",)
+
+
+def flatten(results: dict, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    """ the numbers of nested results, keyed by their dotted path, e.g. endpoints.get_post.p99_ms """
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, prefix=f"{path}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[Dict]:
+    """ the metrics of {results} that regressed from {baseline} """
+    regressions = []
+    baseline_metrics = dict(flatten(baseline))
+    for path, value in flatten(results):
+        expected = baseline_metrics.get(path)
+        if expected is None:
+            continue
+        name = path.rsplit(".", 1)[-1]
+        if name.endswith(LOWER_IS_BETTER):
+            regressed = value > expected * (1 + tolerance)
+        elif name.endswith(HIGHER_IS_BETTER):
+            regressed = value < expected * (1 - tolerance)
+        elif name == "errors":
+            regressed = value > expected
+        else:
+            continue
+        if regressed:
+            change = (value - expected) / expected if expected else float("inf")
+            regressions.append({"metric": path, "baseline": expected, "value": value, "change": round(change, 3)})
+    return regressions
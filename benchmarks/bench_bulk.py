@@ -0,0 +1,83 @@
+"""
+Rows per second inserted through POST /posts and POST /comments/{post_id}
+one item per request, against POST /posts/bulk and POST /comments/{post_id}/bulk.
+
+The app runs in process against a sqlite file, authenticated as a seeded user
+with the rate limiter disabled. ``--db-latency-ms`` adds a sleep to every
+statement executed by the driver, emulating the round trip to a database server.
+
+Usage:
+    python -m benchmarks.bench_bulk --rows 5000 --batch-size 1000 --db-latency-ms 1
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import SYNC_DATABASE_URL, bench_client
+from sqlalchemy import create_engine, insert
+
+from app import app
+from src.authentication.models import User
+from src.authentication.oauth2 import get_current_user
+from src.authentication.schemas import UserViewSchema
+from src.db.connection import Base
+
+
+def seed():
+    engine = create_engine(SYNC_DATABASE_URL)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{
+            "name": "bench", "username": "bench", "email": "bench@example.com",
+            "password": "not-a-hash", "is_active": True,
+        }])
+    engine.dispose()
+    user = UserViewSchema(id=1, name="bench", username="bench", email="bench@example.com", is_active=True)
+    app.dependency_overrides[get_current_user] = lambda: user
+
+
+async def insert_rows(client, url: str, items: list, batch_size: int) -> float:
+    """ posts the items one per request, or {batch_size} per request to a bulk url """
+    start = time.perf_counter()
+    if url.endswith("/bulk"):
+        for offset in range(0, len(items), batch_size):
+            response = await client.post(url, json=items[offset:offset + batch_size])
+            assert response.status_code == 200, response.text
+    else:
+        for item in items:
+            response = await client.post(url, json=item)
+            assert response.status_code == 201, response.text
+    return round(len(items) / (time.perf_counter() - start), 1)
+
+
+async def run(args) -> dict:
+    posts = [{"title": f"title {i}", "body": f"body {i}"} for i in range(args.rows)]
+    comments = [{"body": f"comment {i}"} for i in range(args.rows)]
+    async with bench_client(db_latency_ms=args.db_latency_ms) as client:
+        return {
+            "rows": args.rows,
+            "batch_size": args.batch_size,
+            "db_latency_ms": args.db_latency_ms,
+            "posts_single_rows_per_second": await insert_rows(client, "/posts", posts, args.batch_size),
+            "posts_bulk_rows_per_second": await insert_rows(client, "/posts/bulk", posts, args.batch_size),
+            "comments_single_rows_per_second": await insert_rows(client, "/comments/1", comments, args.batch_size),
+            "comments_bulk_rows_per_second": await insert_rows(
+                client, "/comments/1/bulk", comments, args.batch_size
+            ),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--db-latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    seed()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Load test of the main endpoints, served in process by concurrent clients.
+
+The database is seeded with the given volumes (see benchmarks.seed), then every endpoint
+is driven on its own by {concurrency} clients until {requests} requests were sent:
+
+- list_posts: GET /posts, a page of {limit} complete posts
+- get_post: GET /posts/{post_id}, a random post
+- list_comments: GET /comments/{post_id}, the comments of a random post, with an access token
+- access_token: POST /auth/access-token, a random user logging in, bound by the bcrypt cost factor,
+  so it only sends {token_requests} requests; lower BCRYPT_ROUNDS to send more
+
+The response cache is bypassed unless ``--response-cache`` is given, so the requests reach the database.
+The posts and users requested are drawn from a generator seeded with ``--random-seed``,
+so two runs send the same requests.
+
+Usage:
+    python -m benchmarks.bench_load --users 100 --posts 1000 --comments-per-post 5 --reply-depth 2 \\
+        --concurrency 20 --requests 1000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Awaitable, Callable
+
+import httpx
+from benchmarks.common import app, bench_client, summarize
+from benchmarks.seed import PASSWORD, Seeded, add_arguments, seed_from_arguments
+
+from src.blog.cache import get_response_cache
+
+
+async def drive(send: Callable[[], Awaitable[httpx.Response]], requests: int, concurrency: int) -> dict:
+    """ sends {requests} requests with {concurrency} clients, and summarizes their latencies """
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await send()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        **summarize(latencies),
+    }
+
+
+async def get_access_token(client: httpx.AsyncClient, email: str) -> str:
+    response = await client.post("/auth/access-token", data={"username": email, "password": PASSWORD})
+    assert response.status_code == 201, response.text
+    return response.json()["access_token"]
+
+
+async def run(args, seeded: Seeded) -> dict:
+    rng = random.Random(args.random_seed)
+    if not args.response_cache:
+        app.dependency_overrides[get_response_cache] = lambda: None
+
+    results = {}
+    async with bench_client(db_latency_ms=args.db_latency_ms) as client:
+        token = await get_access_token(client, Seeded.email(0))
+        headers = {"Authorization": f"Bearer {token}"}
+        endpoints = {
+            "list_posts": lambda: client.get("/posts", params={"limit": args.limit}),
+            "get_post": lambda: client.get(f"/posts/{rng.randint(1, seeded.posts)}"),
+            "list_comments": lambda: client.get(f"/comments/{rng.randint(1, seeded.posts)}", headers=headers),
+        }
+        for name, send in endpoints.items():
+            results[name] = await drive(send, args.requests, args.concurrency)
+        results["access_token"] = await drive(
+            lambda: client.post("/auth/access-token", data={
+                "username": Seeded.email(rng.randrange(seeded.users)), "password": PASSWORD
+            }),
+            args.token_requests, args.concurrency,
+        )
+    app.dependency_overrides.pop(get_response_cache, None)
+    return results
+
+
+def add_load_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--token-requests", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--db-latency-ms", type=float, default=0)
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--response-cache", action="store_true")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    add_load_arguments(parser)
+    args = parser.parse_args()
+
+    seeded = seed_from_arguments(args)
+    print(json.dumps({
+        "seed": vars(seeded), "concurrency": args.concurrency, "endpoints": asyncio.run(run(args, seeded)),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
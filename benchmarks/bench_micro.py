@@ -0,0 +1,79 @@
+"""
+Microbenchmarks of the code every request runs, apart from the network and the event loop.
+
+- verify_access_token: decodes and checks the signature of an access token
+- serialize_posts: dumps a page of {limit} complete posts to JSON with the prebuilt TypeAdapter
+- hydrate_posts: loads the same page as Post models, with their comments and creators,
+  in a session of its own, so it includes the queries, building the objects and the identity map
+
+The database is seeded as for the load test, see benchmarks.seed.
+Each result is the median time of {repeat} rounds of {number} calls.
+
+Usage:
+    python -m benchmarks.bench_micro --posts 100 --comments-per-post 5 --limit 20 --number 200 --repeat 5
+"""
+import argparse
+import json
+import statistics
+import timeit
+from datetime import timedelta
+
+from benchmarks.common import SYNC_DATABASE_URL
+from benchmarks.seed import Seeded, add_arguments, seed_from_arguments
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from src.authentication.token import create_access_token, token_verifier
+from src.blog.controllers import complete_post_options, list_adapters
+from src.blog.models import Post
+from src.blog.schemas import CompletePostSchema
+
+
+def measure(call, number: int, repeat: int) -> dict:
+    seconds = statistics.median(timeit.repeat(call, number=number, repeat=repeat)) / number
+    return {
+        "calls": number * repeat,
+        "median_us": round(seconds * 1_000_000, 2),
+        "ops_per_second": round(1 / seconds, 1),
+    }
+
+
+def run(args) -> dict:
+    token = create_access_token(data={"sub": Seeded.email(0)}, expires_delta=timedelta(minutes=30))
+    adapter = list_adapters[CompletePostSchema]
+    engine = create_engine(SYNC_DATABASE_URL)
+
+    def load_models():
+        with Session(engine) as db:
+            return db.scalars(
+                select(Post).options(*complete_post_options).order_by(Post.id).limit(args.limit)
+            ).all()
+
+    posts = adapter.validate_python(load_models())
+    results = {
+        "verify_access_token": measure(lambda: token_verifier.verify(token), args.number, args.repeat),
+        "serialize_posts": measure(lambda: adapter.dump_json(posts), args.number, args.repeat),
+        "hydrate_posts": measure(load_models, args.number, args.repeat),
+    }
+    engine.dispose()
+    return results
+
+
+def add_micro_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    add_micro_arguments(parser)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    seeded = seed_from_arguments(args)
+    print(json.dumps({"seed": vars(seeded), "microbenchmarks": run(args)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Throughput of concurrent GET /posts requests served in process.
+
+The app runs against a seeded sqlite file with the rate limiter disabled.
+``--db-latency-ms`` adds a sleep to every statement executed by the driver,
+emulating the network round trip to a real database server: a driver that
+runs on the event loop thread stalls every in-flight request while it waits.
+
+Usage:
+    python -m benchmarks.bench_posts_throughput --posts 100 --concurrency 50 --requests 2000 --db-latency-ms 2
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import SYNC_DATABASE_URL, bench_client, summarize
+from sqlalchemy import create_engine, insert
+
+from src.authentication.models import User
+from src.blog.models import Post, Comment
+from src.db.connection import Base
+
+
+def seed(posts: int, comments_per_post: int):
+    engine = create_engine(SYNC_DATABASE_URL)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{
+            "name": "bench", "username": "bench", "email": "bench@example.com",
+            "password": "not-a-hash", "is_active": True,
+        }])
+        conn.execute(insert(Post), [
+            {"title": f"title {i}", "body": f"body {i}", "user_id": 1} for i in range(posts)
+        ])
+        conn.execute(insert(Comment), [
+            {"body": f"comment {i}", "user_id": 1, "post_id": post_id}
+            for post_id in range(1, posts + 1) for i in range(comments_per_post)
+        ])
+    engine.dispose()
+
+
+async def run(args) -> dict:
+    latencies = []
+    remaining = args.requests
+    async with bench_client(db_latency_ms=args.db_latency_ms) as client:
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                response = await client.get("/posts", params={"limit": args.limit})
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": args.concurrency,
+        "db_latency_ms": args.db_latency_ms,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        **summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=100)
+    parser.add_argument("--comments-per-post", type=int, default=2)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--db-latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    seed(posts=args.posts, comments_per_post=args.comments_per_post)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
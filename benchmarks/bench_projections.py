@@ -0,0 +1,102 @@
+"""
+CPU time and memory of listing every active user, loading models vs selecting the rendered columns.
+
+- models: select(User) builds a User per row, tracked by the session identity map,
+  password hash included, then validates the models into UserViewSchema.
+- columns: select(*USER_VIEW_COLUMNS) returns plain rows that are validated straight into
+  UserViewSchema, as GET /auth/users does.
+
+Both dump the users to JSON bytes. Memory is the peak traced by tracemalloc during one more request.
+
+Usage:
+    python -m benchmarks.bench_projections --users 100000 --iterations 5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+from typing import List
+
+from benchmarks.common import ASYNC_DATABASE_URL, SYNC_DATABASE_URL, summarize
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.authentication.models import User, USER_VIEW_COLUMNS
+from src.authentication.schemas import UserViewSchema
+from src.db.connection import Base
+
+
+users_adapter = TypeAdapter(List[UserViewSchema])
+
+
+def seed(users: int):
+    engine = create_engine(SYNC_DATABASE_URL)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{
+            "name": f"user {i}", "username": f"user{i}", "email": f"user{i}@example.com",
+            # as long as a bcrypt hash
+            "password": "$2b$12$" + "x" * 53, "is_active": True,
+        } for i in range(users)])
+    engine.dispose()
+
+
+async def list_models(db) -> bytes:
+    users = (await db.scalars(select(User).where(User.is_active))).all()
+    return users_adapter.dump_json(users_adapter.validate_python(users))
+
+
+async def list_columns(db) -> bytes:
+    users = (await db.execute(select(*USER_VIEW_COLUMNS).where(User.is_active))).mappings().all()
+    return users_adapter.dump_json(users_adapter.validate_python(users))
+
+
+async def measure(session_maker, list_users, iterations: int) -> dict:
+    cpu_times, latencies = [], []
+    for _ in range(iterations):
+        start, cpu_start = time.perf_counter(), time.process_time()
+        async with session_maker() as db:
+            await list_users(db)
+        latencies.append(time.perf_counter() - start)
+        cpu_times.append(time.process_time() - cpu_start)
+    # tracing slows every allocation down, so memory is measured on a request of its own
+    tracemalloc.start()
+    async with session_maker() as db:
+        await list_users(db)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "cpu_ms": round(statistics.median(cpu_times) * 1000, 1),
+        "peak_memory_mb": round(peak / 1024 / 1024, 1),
+        **summarize(latencies),
+    }
+
+
+async def run(args) -> dict:
+    engine = create_async_engine(ASYNC_DATABASE_URL)
+    session_maker = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    async with session_maker() as db:
+        assert await list_models(db) == await list_columns(db)
+    results = {
+        "models": await measure(session_maker, list_models, args.iterations),
+        "columns": await measure(session_maker, list_columns, args.iterations),
+    }
+    await engine.dispose()
+    return {"users": args.users, **results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    seed(users=args.users)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Overhead of the rate limiter backends, per checked request.
+
+Every backend checks the same number of requests spread over a set of clients,
+sent by {concurrency} concurrent requests, with a limit high enough to let them all through.
+Then the "rejected" runs check requests of clients that are over their limit, e.g. a client
+retrying after a 429. The redis and hybrid backends use the redis server of REDIS_URL.
+
+Usage:
+    python -m benchmarks.bench_rate_limiter --requests 20000 --clients 100 --concurrency 50 --sync-interval-ms 500
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import summarize
+import redis.asyncio as redis
+
+from src.requests_limit import HybridRateLimiter, MemoryRateLimiter, RedisRateLimiter, settings
+
+
+async def measure(limiter, args, client: str, limit: int, allowed: bool) -> dict:
+    latencies = []
+    requests = iter(range(args.requests))
+
+    async def worker():
+        for index in requests:
+            start = time.perf_counter()
+            result = await limiter.hit(f"{client}:{index % args.clients}", limit=limit, window_ms=60000)
+            latencies.append(time.perf_counter() - start)
+            assert result.allowed == allowed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests_per_second": round(args.requests / elapsed, 1),
+        **summarize(latencies),
+    }
+
+
+async def run(args) -> dict:
+    redis_conn = redis.from_url(settings.REDIS_URL)
+    prefix = f"bench-{time.time_ns()}"
+    limiters = {
+        "memory": MemoryRateLimiter(maxsize=args.clients),
+        "redis": RedisRateLimiter(
+            redis_conn=redis_conn, prefix=prefix, maxsize=args.clients, batch_size=args.batch_size
+        ),
+        "hybrid": HybridRateLimiter(
+            redis_conn=redis_conn, prefix=prefix, maxsize=args.clients, sync_interval_ms=args.sync_interval_ms,
+            batch_size=args.batch_size,
+        ),
+    }
+    for limiter in (limiters["redis"], limiters["hybrid"]):
+        await limiter.load_script()
+    results = {}
+    for name, limiter in limiters.items():
+        results[name] = await measure(limiter, args, client="allowed", limit=args.requests, allowed=True)
+        # one request per client spends its quota, the others are rejected
+        for index in range(args.clients):
+            await limiter.hit(f"rejected:{index}", limit=1, window_ms=60000)
+        results[f"{name}_rejected"] = await measure(limiter, args, client="rejected", limit=1, allowed=False)
+    await redis_conn.close()
+    return {"requests": args.requests, "clients": args.clients, "concurrency": args.concurrency, "backends": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sync-interval-ms", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
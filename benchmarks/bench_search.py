@@ -0,0 +1,88 @@
+"""
+Latency of searching posts: the full text search ("q") against the exact match
+filter on the title ("title"), over a table of synthetic posts.
+
+Posts are made of random words from a fixed vocabulary, so every searched word
+matches a similar share of the table.
+
+Usage:
+    python -m benchmarks.bench_search --posts 1000000 --queries 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from benchmarks.common import SYNC_DATABASE_URL, bench_client, summarize
+from sqlalchemy import create_engine, insert
+
+from src.authentication.models import User
+from src.blog.models import Post
+from src.db.connection import Base
+
+BATCH_SIZE = 10_000
+
+
+def make_vocabulary(size: int, rng: random.Random):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choices(letters, k=rng.randint(4, 10))) for _ in range(size)]
+
+
+def seed(posts: int, vocabulary, rng: random.Random):
+    engine = create_engine(SYNC_DATABASE_URL)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{
+            "name": "bench", "username": "bench", "email": "bench@example.com",
+            "password": "not-a-hash", "is_active": True,
+        }])
+        for start in range(0, posts, BATCH_SIZE):
+            conn.execute(insert(Post), [{
+                "title": " ".join(rng.choices(vocabulary, k=6)),
+                "body": " ".join(rng.choices(vocabulary, k=60)),
+                "user_id": 1,
+            } for _ in range(min(BATCH_SIZE, posts - start))])
+    with engine.connect() as conn:
+        titles = [row.title for row in conn.execute(Post.__table__.select().limit(1000))]
+    engine.dispose()
+    return titles
+
+
+async def measure(client, params_list) -> dict:
+    latencies = []
+    for params in params_list:
+        start = time.perf_counter()
+        response = await client.get("/posts", params=params)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.text
+    return summarize(latencies)
+
+
+async def run(args, titles, vocabulary, rng: random.Random) -> dict:
+    title_filters = [{"title": rng.choice(titles)} for _ in range(args.queries)]
+    searches = [{"q": " ".join(rng.sample(vocabulary, k=2))} for _ in range(args.queries)]
+    async with bench_client() as client:
+        return {
+            "posts": args.posts,
+            "exact_title_filter": await measure(client, title_filters),
+            "full_text_search": await measure(client, searches),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=1_000_000)
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    titles = seed(posts=args.posts, vocabulary=vocabulary, rng=rng)
+    print(json.dumps(asyncio.run(run(args, titles, vocabulary, rng)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
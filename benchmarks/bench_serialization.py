@@ -0,0 +1,77 @@
+"""
+Latency of rendering a page of posts with their comments, the way the handlers used to and the way they do now.
+
+- before: the handler builds a TypeAdapter and validates the ORM objects, then FastAPI
+  validates the models again for response_model and encodes them with the stdlib json module.
+- after: the handler validates the ORM objects with an adapter built at import and dumps
+  the models straight to JSON bytes.
+
+Both render the same page, loaded once from a seeded sqlite file, so only the serialization is measured.
+
+Usage:
+    python -m benchmarks.bench_serialization --posts 100 --comments-per-post 5 --iterations 300
+"""
+import argparse
+import json
+import time
+from typing import List
+
+from benchmarks.common import SYNC_DATABASE_URL, summarize
+from benchmarks.bench_posts_throughput import seed
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from src.blog.controllers import complete_post_options, list_adapters
+from src.blog.models import Post
+from src.blog.schemas import CompletePostSchema
+
+
+def render_before(posts: List[Post]) -> bytes:
+    items = TypeAdapter(List[CompletePostSchema]).validate_python(posts)
+    response_model = TypeAdapter(List[CompletePostSchema])
+    content = jsonable_encoder(response_model.validate_python(items, from_attributes=True))
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def render_after(posts: List[Post]) -> bytes:
+    adapter = list_adapters[CompletePostSchema]
+    return adapter.dump_json(adapter.validate_python(posts))
+
+
+def measure(render, posts: List[Post], iterations: int) -> dict:
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        render(posts)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def run(args) -> dict:
+    engine = create_engine(SYNC_DATABASE_URL)
+    with Session(engine) as db:
+        posts = db.scalars(select(Post).options(*complete_post_options).order_by(Post.id).limit(args.posts)).all()
+        assert json.loads(render_before(posts)) == json.loads(render_after(posts))
+        results = {
+            "before": measure(render_before, posts, args.iterations),
+            "after": measure(render_after, posts, args.iterations),
+        }
+    engine.dispose()
+    return {"posts": args.posts, "comments_per_post": args.comments_per_post, **results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=100)
+    parser.add_argument("--comments-per-post", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=300)
+    args = parser.parse_args()
+
+    seed(posts=args.posts, comments_per_post=args.comments_per_post)
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
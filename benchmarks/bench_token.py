@@ -0,0 +1,77 @@
+"""
+Access token verifications per second on one core, for each supported algorithm.
+
+- generic: jwt.decode with the key as configured, a secret or a PEM public key, parsed on
+  every call, the way verify_access_token used to decode the tokens through python-jose
+- verifier: TokenVerifier, with the key parsed once and the claims checked before the signature
+- verifier_expired: TokenVerifier rejecting an expired token, which costs no crypto
+
+Usage:
+    python -m benchmarks.bench_token --number 2000 --repeat 5
+"""
+import argparse
+import json
+import time
+import timeit
+
+import jwt
+import benchmarks.common  # noqa: F401, points the app settings to the benchmark environment
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from fastapi import HTTPException
+
+from src.authentication.token import TokenVerifier
+
+
+def verifications_per_second(call, number: int, repeat: int) -> float:
+    return round(number / min(timeit.repeat(call, number=number, repeat=repeat)), 1)
+
+
+def rejected(verifier: TokenVerifier, token: str):
+    try:
+        verifier.verify(token)
+    except HTTPException:
+        return
+    raise AssertionError("the token was accepted")
+
+
+def run(args) -> dict:
+    private_keys = {
+        "HS256": "benchmark-secret-of-at-least-32-bytes",
+        "RS256": rsa.generate_private_key(public_exponent=65537, key_size=2048),
+        "EdDSA": ed25519.Ed25519PrivateKey.generate(),
+    }
+    claims = {"sub": "user0@example.com"}
+    results = {}
+    for algorithm, private_key in private_keys.items():
+        if isinstance(private_key, str):
+            public_key = private_key
+        else:
+            public_key = private_key.public_key().public_bytes(
+                serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+            )
+        token = jwt.encode({**claims, "exp": int(time.time()) + 3600}, private_key, algorithm=algorithm)
+        expired = jwt.encode({**claims, "exp": int(time.time()) - 1}, private_key, algorithm=algorithm)
+        verifier = TokenVerifier(algorithm=algorithm, key=public_key)
+        assert verifier.verify(token).email == jwt.decode(token, public_key, algorithms=[algorithm])["sub"]
+        results[algorithm] = {
+            "generic": verifications_per_second(
+                lambda: jwt.decode(token, public_key, algorithms=[algorithm]), args.number, args.repeat
+            ),
+            "verifier": verifications_per_second(lambda: verifier.verify(token), args.number, args.repeat),
+            "verifier_expired": verifications_per_second(lambda: rejected(verifier, expired), args.number, args.repeat),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(json.dumps({"verifications_per_second": run(args)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Helpers shared by the benchmarks.
+
+Importing this module points the app settings to a temporary sqlite file, so it
+must be imported before anything from the app.
+"""
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from math import ceil
+from typing import List
+
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DATABASE_PATH}")
+os.environ.setdefault("ALLOWED_HOSTS", '["*"]')
+os.environ.setdefault("DEBUG", "False")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379")
+
+import httpx  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker  # noqa: E402
+from sqlalchemy.util import await_only  # noqa: E402
+
+from app import app  # noqa: E402
+from src.db.connection import get_async_db, get_async_read_db  # noqa: E402
+from src.requests_limit import RateLimit  # noqa: E402
+
+SYNC_DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+
+
+def add_latency(engine, seconds: float):
+    """ sleeps for the given seconds inside the driver every time a statement runs """
+    def trace(_):
+        time.sleep(seconds)
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, _):
+        driver_connection = getattr(dbapi_connection, "driver_connection", dbapi_connection)
+        result = driver_connection.set_trace_callback(trace)
+        if asyncio.iscoroutine(result):
+            await_only(result)
+
+
+def disable_rate_limits():
+    for route in app.routes:
+        for dependency in getattr(route, "dependencies", []):
+            if isinstance(dependency.dependency, RateLimit):
+                app.dependency_overrides[dependency.dependency] = lambda: None
+
+
+@asynccontextmanager
+async def bench_client(db_latency_ms: float = 0):
+    """
+    an http client calling the app in process, with the rate limits disabled
+    and the database sessions bound to the benchmark database
+    """
+    async_engine = create_async_engine(ASYNC_DATABASE_URL)
+    if db_latency_ms:
+        add_latency(async_engine.sync_engine, db_latency_ms / 1000)
+    session_maker = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+    async def get_bench_db():
+        async with session_maker() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = get_bench_db
+    app.dependency_overrides[get_async_read_db] = get_bench_db
+    disable_rate_limits()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        yield client
+    await async_engine.dispose()
+
+
+def percentile(latencies: List[float], fraction: float) -> float:
+    """ nearest rank percentile of sorted {latencies}: the smallest one at or above {fraction} of them """
+    return latencies[ceil(len(latencies) * fraction) - 1]
+
+
+def summarize(latencies: List[float]) -> dict:
+    """ latency percentiles in milliseconds """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.9) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
@@ -0,0 +1,79 @@
+"""
+Fills the benchmark database with users, posts and comment threads.
+
+Every user has the same password, hashed once, so they can all get an access token.
+Each post gets {comments_per_post} comments, and each of them a chain of
+{reply_depth} nested responses. Posts and comments are spread over the users in turns.
+The benchmarks take the volumes from the command line, see add_arguments.
+"""
+import argparse
+from dataclasses import dataclass
+
+from benchmarks.common import SYNC_DATABASE_URL
+from sqlalchemy import create_engine, insert
+
+from src.authentication.hashing import pwd_context
+from src.authentication.models import User
+from src.blog.models import Post, Comment
+from src.db.connection import Base
+
+
+PASSWORD = "benchmark-password"
+
+
+@dataclass
+class Seeded:
+    users: int
+    posts: int
+    comments: int
+
+    @staticmethod
+    def email(index: int) -> str:
+        return f"user{index}@example.com"
+
+
+def seed(users: int = 10, posts: int = 100, comments_per_post: int = 2, reply_depth: int = 0,
+         password: str = PASSWORD) -> Seeded:
+    engine = create_engine(SYNC_DATABASE_URL)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    hashed_password = pwd_context.hash(password)
+    comments = []
+    # ids are given explicitly, so the responses can point to their parent without a round trip
+    for post_id in range(1, posts + 1):
+        for i in range(comments_per_post):
+            parent_id = None
+            for depth in range(reply_depth + 1):
+                comment_id = len(comments) + 1
+                comments.append({
+                    "id": comment_id, "body": f"comment {i} at depth {depth}", "post_id": post_id,
+                    "user_id": comment_id % users + 1, "parent_id": parent_id,
+                })
+                parent_id = comment_id
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{
+            "name": f"user {i}", "username": f"user{i}", "email": Seeded.email(i),
+            "password": hashed_password, "is_active": True,
+        } for i in range(users)])
+        conn.execute(insert(Post), [{
+            "title": f"title {i}", "body": f"body {i}", "user_id": i % users + 1,
+            "comment_count": comments_per_post * (reply_depth + 1),
+        } for i in range(posts)])
+        if comments:
+            conn.execute(insert(Comment), comments)
+    engine.dispose()
+    return Seeded(users=users, posts=posts, comments=len(comments))
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--posts", type=int, default=100)
+    parser.add_argument("--comments-per-post", type=int, default=2)
+    parser.add_argument("--reply-depth", type=int, default=1)
+
+
+def seed_from_arguments(args) -> Seeded:
+    return seed(
+        users=args.users, posts=args.posts, comments_per_post=args.comments_per_post, reply_depth=args.reply_depth
+    )
+
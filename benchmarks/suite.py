@@ -0,0 +1,63 @@
+"""
+Runs the load test and the microbenchmarks on one seeded database, and compares the results
+with a baseline to catch performance regressions.
+
+The results are printed as JSON, along with the settings of the run. With ``--baseline``,
+the regressions found by benchmarks.baseline are printed too, and the exit code is 1 when there
+are any, so the suite can gate a CI job. A baseline is only comparable to a run with the same
+settings on the same kind of machine: save one with ``--save-baseline`` where the suite runs.
+
+Usage:
+    python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from benchmarks import bench_load, bench_micro
+from benchmarks.baseline import compare
+from benchmarks.seed import add_arguments, seed_from_arguments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    bench_load.add_load_arguments(parser)
+    bench_micro.add_micro_arguments(parser)
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--save-baseline", help="saves the results to this file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative change allowed, 0.25 for 25%%")
+    args = parser.parse_args()
+
+    settings = {
+        name: value for name, value in vars(args).items()
+        if name not in ("baseline", "save_baseline", "tolerance")
+    }
+    seeded = seed_from_arguments(args)
+    results = {
+        "settings": settings,
+        "endpoints": asyncio.run(bench_load.run(args, seeded)),
+        "microbenchmarks": bench_micro.run(args),
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+            baseline_file.write("\n")
+
+    if not args.baseline:
+        print(json.dumps(results, indent=2))
+        return
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get("settings") != settings:
+        sys.exit(f"the baseline was run with other settings: {baseline.get('settings')}")
+    regressions = compare(results, baseline, tolerance=args.tolerance)
+    print(json.dumps({**results, "regressions": regressions}, indent=2))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 
 from environs import Env
 from pydantic_settings import BaseSettings
@@ -15,4 +15,78 @@ class Settings(BaseSettings):
     SECRET_KEY: str = env.str("SECRET_KEY")
     ALGORITHM: str = env.str("ALGORITHM")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = env.int("ACCESS_TOKEN_EXPIRE_MINUTES")
+    # PEM private key signing the access tokens when ALGORITHM is asymmetric, e.g. RS256 or EdDSA
+    JWT_PRIVATE_KEY_FILE: str = env.str("JWT_PRIVATE_KEY_FILE", "")
+    # kid header of the tokens signed by the app, changed along with the key when it is rotated
+    JWT_KEY_ID: str = env.str("JWT_KEY_ID", "")
+    # JWKS of the other keys accepted, looked up by kid, e.g. the previous keys during a rotation
+    JWT_JWKS_URL: str = env.str("JWT_JWKS_URL", "")
+    # seconds the JWKS is kept before it is fetched again
+    JWT_JWKS_TTL: float = env.float("JWT_JWKS_TTL", 300)
+    # minimum seconds between the fetches of the JWKS caused by tokens with an unknown kid
+    JWT_JWKS_REFRESH_INTERVAL: float = env.float("JWT_JWKS_REFRESH_INTERVAL", 30)
+    JWT_JWKS_TIMEOUT: float = env.float("JWT_JWKS_TIMEOUT", 5)
     REDIS_URL: str = env.str("REDIS_URL")
+    # connections to redis shared by everything in a worker, a command waits for one when they are all in use
+    REDIS_MAX_CONNECTIONS: int = env.int("REDIS_MAX_CONNECTIONS", 50)
+    # seconds a command waits for a connection before failing
+    REDIS_POOL_TIMEOUT: float = env.float("REDIS_POOL_TIMEOUT", 5)
+    REDIS_SOCKET_TIMEOUT: float = env.float("REDIS_SOCKET_TIMEOUT", 5)
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = env.float("REDIS_SOCKET_CONNECT_TIMEOUT", 5)
+    # seconds a connection may stay idle before it is checked with a PING, 0 to never check
+    REDIS_HEALTH_CHECK_INTERVAL: int = env.int("REDIS_HEALTH_CHECK_INTERVAL", 30)
+    BCRYPT_ROUNDS: int = env.int("BCRYPT_ROUNDS", 12)
+    PASSWORD_HASHING_WORKERS: int = env.int("PASSWORD_HASHING_WORKERS", 4)
+    TOKEN_CACHE_SIZE: int = env.int("TOKEN_CACHE_SIZE", 10000)
+    TOKEN_CACHE_TTL: int = env.int("TOKEN_CACHE_TTL", 300)
+    # "memory" (per worker), "redis" (shared by the workers) or "none"
+    USER_CACHE_BACKEND: str = env.str("USER_CACHE_BACKEND", "memory")
+    USER_CACHE_SIZE: int = env.int("USER_CACHE_SIZE", 10000)
+    USER_CACHE_TTL: int = env.int("USER_CACHE_TTL", 10)
+    # "memory" (per worker), "redis" (shared by the workers) or "none"
+    RESPONSE_CACHE_BACKEND: str = env.str("RESPONSE_CACHE_BACKEND", "memory")
+    RESPONSE_CACHE_SIZE: int = env.int("RESPONSE_CACHE_SIZE", 1000)
+    RESPONSE_CACHE_TTL: int = env.int("RESPONSE_CACHE_TTL", 60)
+    # how long clients may reuse a response without revalidating it, 0 to always revalidate
+    RESPONSE_CACHE_MAX_AGE: int = env.int("RESPONSE_CACHE_MAX_AGE", 0)
+    DB_POOL_SIZE: int = env.int("DB_POOL_SIZE", 5)
+    DB_MAX_OVERFLOW: int = env.int("DB_MAX_OVERFLOW", 10)
+    # seconds a request waits for a connection before failing
+    DB_POOL_TIMEOUT: float = env.float("DB_POOL_TIMEOUT", 30)
+    # seconds after which a connection is replaced, -1 to keep it open
+    DB_POOL_RECYCLE: int = env.int("DB_POOL_RECYCLE", 1800)
+    DB_POOL_PRE_PING: bool = env.bool("DB_POOL_PRE_PING", True)
+    # connect through PgBouncer in transaction mode: no app side pool and no prepared statements
+    DB_PGBOUNCER: bool = env.bool("DB_PGBOUNCER", False)
+    # rows fetched from the database at a time by the export endpoints
+    EXPORT_BATCH_SIZE: int = env.int("EXPORT_BATCH_SIZE", 1000)
+    # maximum number of items of a bulk request, the add_posts_bulk and add_comments_bulk
+    # rate limits must allow at least as many items per window
+    BULK_MAX_ITEMS: int = env.int("BULK_MAX_ITEMS", 1000)
+    # "redis" (sliding window shared by the workers), "memory" (token bucket per worker),
+    # "hybrid" (counted by each worker and synced to redis) or "none"
+    RATE_LIMIT_BACKEND: str = env.str("RATE_LIMIT_BACKEND", "redis")
+    # per route limits overriding src.constants, by limit name, e.g. {"list_posts": {"TIMES": 100, "SECONDS": 60}}
+    RATE_LIMITS: Dict[str, Dict[str, int]] = env.json("RATE_LIMITS", "{}")
+    RATE_LIMIT_CACHE_SIZE: int = env.int("RATE_LIMIT_CACHE_SIZE", 100000)
+    RATE_LIMIT_SYNC_INTERVAL_MS: int = env.int("RATE_LIMIT_SYNC_INTERVAL_MS", 500)
+    # maximum number of rate limit checks of concurrent requests sent to redis in one pipeline
+    RATE_LIMIT_BATCH_SIZE: int = env.int("RATE_LIMIT_BATCH_SIZE", 100)
+    # read replicas the read only endpoints are sent to, in turns, e.g. postgresql+psycopg2://...@replica:5432/db
+    # the pages of GET /posts read there are not put in the response cache, which is filled from the primary
+    READ_DATABASE_URLS: List[str] = env.list("READ_DATABASE_URLS", [])
+    # seconds between the health checks of each replica
+    READ_REPLICA_CHECK_INTERVAL: float = env.float("READ_REPLICA_CHECK_INTERVAL", 5)
+    # seconds a health check of a replica may take before the replica is skipped
+    READ_REPLICA_CHECK_TIMEOUT: float = env.float("READ_REPLICA_CHECK_TIMEOUT", 1)
+    # seconds a client reads from the primary after a write, 0 to always read from the replicas
+    READ_YOUR_WRITES_SECONDS: float = env.float("READ_YOUR_WRITES_SECONDS", 5)
+    # "memory" (per worker) or "redis" (shared by the workers)
+    READ_YOUR_WRITES_BACKEND: str = env.str("READ_YOUR_WRITES_BACKEND", "memory")
+    READ_YOUR_WRITES_CACHE_SIZE: int = env.int("READ_YOUR_WRITES_CACHE_SIZE", 100000)
+    # profile every request, otherwise only the ones with a signed X-Profile header, see src.profiling
+    PROFILING_ENABLED: bool = env.bool("PROFILING_ENABLED", False)
+    # profiled requests faster than this are not saved
+    PROFILING_THRESHOLD_MS: float = env.float("PROFILING_THRESHOLD_MS", 500)
+    PROFILING_INTERVAL_MS: float = env.float("PROFILING_INTERVAL_MS", 1)
+    PROFILING_DIR: str = env.str("PROFILING_DIR", "profiles")
@@ -0,0 +1,67 @@
+import time
+from hashlib import sha256
+from typing import Union
+
+from fastapi import Request
+
+from settings import Settings
+from src.cache import TTLCache, MemoryCacheBackend, RedisCacheBackend, CacheBackend
+from src.authentication.schemas import TokenData, UserViewSchema
+from src.authentication.token import verify_access_token
+from src.redis_client import get_redis
+
+
+settings = Settings()
+
+# verified tokens, keyed by their hash so the cache does not hold usable credentials
+token_cache = TTLCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
+
+memory_user_cache = MemoryCacheBackend(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+
+async def verify_cached_access_token(token: str) -> TokenData:
+    """
+    same as verify_access_token, but a token is only decoded the first time it is seen.
+    Cached claims expire with the token.
+    """
+    key = sha256(token.encode()).digest()
+    token_data = token_cache.get(key)
+    if token_data is None:
+        token_data = await verify_access_token(token=token)
+        ttl = settings.TOKEN_CACHE_TTL
+        if token_data.expires_at is not None:
+            ttl = min(ttl, token_data.expires_at - time.time())
+        token_cache.set(key, token_data, ttl=ttl)
+    return token_data
+
+
+def get_user_cache(request: Request) -> Union[CacheBackend, None]:
+    """
+    cache of the users records (UserViewSchema) keyed by email,
+    selected by the USER_CACHE_BACKEND setting
+    """
+    if settings.USER_CACHE_BACKEND == "redis":
+        return RedisCacheBackend(redis=get_redis(request), prefix="user:", ttl=settings.USER_CACHE_TTL)
+    if settings.USER_CACHE_BACKEND == "memory":
+        return memory_user_cache
+    return None
+
+
+async def get_cached_user(
+        user_cache: Union[CacheBackend, None],
+        email: str) -> Union[UserViewSchema, None]:
+    if user_cache is None:
+        return None
+    data = await user_cache.get(email)
+    return UserViewSchema.model_validate_json(data) if data else None
+
+
+async def cache_user(user_cache: Union[CacheBackend, None], user: UserViewSchema):
+    if user_cache is not None:
+        await user_cache.set(user.email, user.model_dump_json().encode())
+
+
+async def invalidate_user(user_cache: Union[CacheBackend, None], *emails: str):
+    """ must be called every time a user record changes """
+    if user_cache is not None:
+        await user_cache.delete(*emails)
@@ -2,8 +2,10 @@ from typing import List, cast, Union
 from datetime import datetime, timedelta
 
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi import APIRouter, Depends, status, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Response, status, HTTPException
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 from src.authentication.schemas import (
@@ -16,28 +18,33 @@ from src.authentication.schemas import (
     TokenVerifySchema,
     TokenVerifyResponseSchema,
 )
-from src.authentication.models import User
+from src.authentication.models import User, USER_VIEW_COLUMNS
+from src.authentication.hashing import hash_password, verify_password
 from src.authentication.token import create_access_token, verify_access_token
-from src.authentication.oauth2 import get_current_user
-from src.db.connection import get_db
+from src.authentication.oauth2 import get_current_user, get_current_db_user
+from src.authentication.cache import get_user_cache, invalidate_user
+from src.cache import CacheBackend
+from src.db.connection import get_async_db, get_async_read_db
 from settings import Settings
 
 
 router = APIRouter()
 settings = Settings()
 
+users_adapter = TypeAdapter(List[UserViewSchema])
+
 
 @router.post("/users", response_model=UserViewSchema, status_code=status.HTTP_201_CREATED)
-async def add_user(user: UserAddSchema, db: Session = Depends(get_db)):
+async def add_user(user: UserAddSchema, db: AsyncSession = Depends(get_async_db)):
     """
     Add a new user to the database.
     """
     try:
         new_user = User(**user.dict())
-        new_user.set_password(password=user.password)
+        new_user.password = await hash_password(user.password)
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
     except IntegrityError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -47,23 +54,29 @@ async def add_user(user: UserAddSchema, db: Session = Depends(get_db)):
 
 
 @router.get("/users", response_model=List[UserViewSchema], status_code=status.HTTP_200_OK)
-def list_users(user: UserViewSchema = Depends(get_current_user), db: Session = Depends(get_db)):
+async def list_users(
+        user: UserViewSchema = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_read_db)):
     """
     Retrieve all active users saved.
     """
-    users = db.query(User).filter(cast("ColumnElement[bool]", User.is_active)).all()
-    return users
+    users = (await db.execute(
+        select(*USER_VIEW_COLUMNS).where(cast("ColumnElement[bool]", User.is_active))
+    )).mappings().all()
+    return Response(
+        content=users_adapter.dump_json(users_adapter.validate_python(users)), media_type="application/json"
+    )
 
 
 @router.get("/users/{user_id}", response_model=UserViewSchema, status_code=status.HTTP_200_OK)
-def get_user(
+async def get_user(
         user_id: int,
         user: UserViewSchema = Depends(get_current_user),
-        db: Session = Depends(get_db)):
+        db: AsyncSession = Depends(get_async_read_db)):
     """
     Retrieve a specific user with the given {user_id}.
     """
-    user = db.query(User).filter(cast("ColumnElement[bool]", User.id == user_id)).first()
+    user = await db.scalar(select(User).where(cast("ColumnElement[bool]", User.id == user_id)))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -73,16 +86,19 @@ def get_user(
 
 
 @router.put("/users", response_model=UserUpdateSchema, status_code=status.HTTP_200_OK)
-def update_user(
+async def update_user(
         data: UserUpdateSchema,
-        user: UserViewSchema = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        user: User = Depends(get_current_db_user),
+        user_cache: Union[CacheBackend, None] = Depends(get_user_cache),
+        db: AsyncSession = Depends(get_async_db)
 ):
+    old_email = user.email
     user.name = data.name
     user.email = data.email
     user.username = data.username
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    await invalidate_user(user_cache, old_email, user.email)
     return UserUpdateSchema(
         name=user.name,
         email=user.email,
@@ -91,46 +107,56 @@ def update_user(
 
 
 @router.delete("/users", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user(user: UserViewSchema = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_user(
+        user: User = Depends(get_current_db_user),
+        user_cache: Union[CacheBackend, None] = Depends(get_user_cache),
+        db: AsyncSession = Depends(get_async_db)):
     """
     Delete the current user.
     """
     # Actually, this only deactivates the user
     user.is_active = False
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    await invalidate_user(user_cache, user.email)
     return True
 
 
 @router.patch("/users/change-password", response_model=MessageSchema, status_code=status.HTTP_200_OK)
-def change_password(
+async def change_password(
         data: ChangePasswordSchema,
-        user: UserViewSchema = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        user: User = Depends(get_current_db_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    if user.check_password(data.old_password):
-        user.set_password(password=data.new_password)
-        db.commit()
+    valid, _ = await verify_password(data.old_password, user.password)
+    if valid:
+        user.password = await hash_password(data.new_password)
+        await db.commit()
         return MessageSchema(message="Password changed successfully")
     return MessageSchema(message="Your old password is not correct")
 
 
 @router.post("/access-token", response_model=Token, status_code=status.HTTP_201_CREATED)
-def get_access_token(user: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    db_user: Union[User, None] = db.query(User).filter(
+async def get_access_token(user: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    db_user: Union[User, None] = await db.scalar(select(User).where(
         cast("ColumnElement[bool]", User.email == user.username)
-    ).first()
+    ))
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"User not found with this email: {user.username}, please create an account first"
         )
 
-    if not db_user.check_password(user.password):
+    valid, new_hash = await verify_password(user.password, db_user.password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
+    if new_hash:
+        # the hash was made with an outdated cost factor
+        db_user.password = new_hash
+        await db.commit()
     expires_delta = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     token_expires = (datetime.now() + expires_delta).strftime("%Y-%m-%dT%H:%M:%S")
     access_token = create_access_token(
@@ -142,7 +168,7 @@ def get_access_token(user: OAuth2PasswordRequestForm = Depends(), db: Session =
 @router.post("/verify-token", response_model=TokenVerifyResponseSchema, status_code=status.HTTP_201_CREATED)
 async def verify_token(data: TokenVerifySchema):
     try:
-        verify_access_token(token=data.token)
+        await verify_access_token(token=data.token)
         return TokenVerifyResponseSchema(valid=True)
     except HTTPException as e:
         print(e)
@@ -0,0 +1,42 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Union
+
+from passlib.context import CryptContext
+
+from settings import Settings
+
+
+settings = Settings()
+
+# hashes made with any other cost factor are flagged as outdated, so they are
+# replaced the next time their owners log in
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
+
+# bcrypt releases the GIL while hashing, so a few threads hash in parallel
+# without blocking the event loop, and bound the CPU spent on logins at once
+executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASHING_WORKERS,
+    thread_name_prefix="password-hashing",
+)
+
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> Tuple[bool, Union[str, None]]:
+    """
+    checks the password against its hash
+    :return: whether the password is valid, and a new hash to replace the current one
+    when it was made with an outdated cost factor
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, pwd_context.verify_and_update, password, hashed_password)
@@ -1,8 +1,8 @@
-from passlib.context import CryptContext
 from sqlalchemy import Column, Integer, String, Boolean
 from sqlalchemy.orm import relationship
 
 from src.db.connection import Base
+from src.authentication.hashing import pwd_context
 
 
 class User(Base):
@@ -12,7 +12,7 @@ class User(Base):
     username = Column(String(50), unique=True, nullable=False)
     email = Column(String(150), unique=True, nullable=False)
     password = Column(String(100), nullable=False)
-    is_active = Column(Boolean, default=True, nullable=False)
+    is_active = Column(Boolean, default=True, nullable=False, index=True)
     posts = relationship("Post", back_populates="creator")
     comments = relationship("Comment", back_populates="creator")
 
@@ -20,10 +20,14 @@ class User(Base):
         return f'f<User {self.username}>'
 
     def set_password(self, password):
-        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        """ hashes the password on the calling thread, use hashing.hash_password from async code """
         hashed_pwd = pwd_context.hash(password)
         self.password = hashed_pwd
 
     def check_password(self, password: str):
-        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        """ checks the password on the calling thread, use hashing.verify_password from async code """
         return pwd_context.verify(password, self.password)
+
+
+# the columns rendered by UserViewSchema, for the queries that do not need the password hash
+USER_VIEW_COLUMNS = (User.id, User.name, User.username, User.email, User.is_active)
@@ -1,26 +1,87 @@
-from typing import Annotated, cast, Type
+from typing import Annotated, cast, Union
 
-from fastapi import Depends
+from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from settings import Settings
-from src.authentication.token import verify_access_token
-from src.authentication.models import User
-from src.db.connection import get_db
+from src.authentication.cache import (
+    verify_cached_access_token, get_user_cache, get_cached_user, cache_user,
+)
+from src.authentication.models import User, USER_VIEW_COLUMNS
+from src.authentication.schemas import TokenData, UserViewSchema
+from src.cache import CacheBackend
+from src.db.connection import get_async_db
 
 
 settings = Settings()
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"auth/access-token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"auth/access-token", auto_error=False)
+
+
+def user_not_found_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+async def get_token_data(
+    token: Annotated[Union[str, None], Depends(optional_oauth2_scheme)]
+) -> Union[TokenData, None]:
+    """
+    The claims of the request's bearer token, None when it has no valid one.
+    FastAPI solves a dependency once per request, so the rate limits and
+    get_current_user share a single verification of the token.
+    """
+    if token is None:
+        return None
+    try:
+        return await verify_cached_access_token(token=token)
+    except HTTPException:
+        return None
 
 
 async def get_current_user(
-    token: Annotated[str, Depends(oauth2_scheme)],
-    db: Session = Depends(get_db)
-) -> Type[User]:
-    verification = verify_access_token(token=token)
-    email = verification.email
-    user = db.query(User).filter(cast("ColumnElement[bool]", User.email == email)).first()
+    token: Annotated[str, Depends(oauth2_scheme)],  # requires the token, get_token_data verifies it
+    verification: Annotated[Union[TokenData, None], Depends(get_token_data)],
+    user_cache: Union[CacheBackend, None] = Depends(get_user_cache),
+    db: AsyncSession = Depends(get_async_db)
+) -> UserViewSchema:
+    """
+    The authenticated user's record. It usually comes from the users cache,
+    so use get_current_db_user instead when the user itself must be changed.
+    """
+    if verification is None:
+        raise user_not_found_exception()
+    user = await get_cached_user(user_cache=user_cache, email=verification.email)
+    if user is None:
+        db_user = (await db.execute(
+            select(*USER_VIEW_COLUMNS).where(cast("ColumnElement[bool]", User.email == verification.email))
+        )).mappings().first()
+        # gives the connection back to the pool, so the request does not hold it until it ends
+        # while the handler, e.g. on get_async_read_db, checks out another one
+        await db.rollback()
+        if db_user is None:
+            raise user_not_found_exception()
+        user = UserViewSchema.model_validate(db_user)
+        await cache_user(user_cache=user_cache, user=user)
+    return user
+
+
+async def get_current_db_user(
+    token: Annotated[str, Depends(oauth2_scheme)],  # requires the token, get_token_data verifies it
+    verification: Annotated[Union[TokenData, None], Depends(get_token_data)],
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """ The authenticated user, always loaded from the database """
+    if verification is None:
+        raise user_not_found_exception()
+    user = await db.scalar(select(User).where(cast("ColumnElement[bool]", User.email == verification.email)))
+    if user is None:
+        raise user_not_found_exception()
     return user
@@ -63,6 +63,7 @@ class TokenVerifySchema(BaseModel):
 
 class TokenData(BaseModel):
     email: Union[str, None] = None
+    expires_at: Union[int, None] = None
 
 
 class TokenVerifyResponseSchema(BaseModel):
@@ -1,8 +1,15 @@
+import asyncio
+import time
 from datetime import datetime, timezone, timedelta
-from typing import Union
+from typing import Any, Dict, Union
 
-from jose import jwt, JWTError
+import jwt
+import orjson
 from fastapi import HTTPException, status
+from jwt import PyJWK, PyJWKClient
+from jwt.algorithms import get_default_algorithms
+from jwt.exceptions import PyJWKClientError, PyJWKSetError
+from jwt.utils import base64url_decode
 from src.authentication.schemas import TokenData
 
 from settings import Settings
@@ -10,6 +17,158 @@ from settings import Settings
 settings = Settings()
 
 
+def credentials_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+class JWKSCache:
+    """
+    Keys of the JWKS at {url}, parsed once and looked up by kid. The JWKS is fetched again
+    after {ttl} seconds, or when a token has an unknown kid, but then at most every
+    {refresh_interval} seconds, so tokens with made up kids cannot make the app hammer it.
+    A fetch runs in a thread for up to {timeout} seconds, concurrent refreshes wait for it
+    instead of fetching again, and the keys known so far are kept when it fails.
+    """
+    def __init__(self, url: str, ttl: float, refresh_interval: float, timeout: float):
+        self.client = PyJWKClient(url, cache_jwk_set=False, cache_keys=False, timeout=timeout)
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.keys: Dict[str, PyJWK] = {}
+        self.fetched_at = float("-inf")
+        self.fetches = 0
+        self.lock = asyncio.Lock()
+
+    def get(self, kid: str) -> Union[PyJWK, None]:
+        """ the key of {kid} among the keys fetched so far, it never fetches the JWKS """
+        return self.keys.get(kid)
+
+    def stale(self, kid: str) -> bool:
+        age = time.monotonic() - self.fetched_at
+        return age >= self.ttl or (kid not in self.keys and age >= self.refresh_interval)
+
+    async def refresh(self):
+        fetches = self.fetches
+        async with self.lock:
+            if self.fetches != fetches:
+                # fetched while this refresh waited for the lock
+                return
+            self.fetched_at = time.monotonic()
+            try:
+                jwk_set = await asyncio.to_thread(self.client.get_jwk_set)
+            except (PyJWKClientError, PyJWKSetError):
+                return
+            finally:
+                self.fetches += 1
+            self.keys = {jwk.key_id: jwk for jwk in jwk_set.keys if jwk.key_id}
+
+
+class TokenVerifier:
+    """
+    Verifies access tokens signed with the {algorithm}, and no other. The keys are parsed once:
+    {key}, the key of the app, for the tokens of kid {key_id} or without a kid, and the keys
+    of {jwks} for the other kids.
+    The claims are read before the signature is checked, so malformed, expired or not yet valid
+    tokens, tokens without a subject and tokens of another algorithm cost no crypto.
+    """
+    def __init__(self, algorithm: str, key: Any, key_id: Union[str, None] = None,
+                 jwks: Union[JWKSCache, None] = None):
+        self.algorithm_name = algorithm
+        self.algorithm = get_default_algorithms()[algorithm]
+        self.key = None if key is None else self.algorithm.prepare_key(key)
+        self.key_id = key_id or None
+        self.jwks = jwks
+
+    async def fetch_keys(self, token: str):
+        """ refreshes the JWKS when it is stale for the kid of {token}, so verify can find its key """
+        if self.jwks is None or token.count(".") != 2:
+            return
+        try:
+            header = orjson.loads(base64url_decode(token.partition(".")[0]))
+        except ValueError:
+            return
+        kid = header.get("kid") if isinstance(header, dict) else None
+        if isinstance(kid, str) and kid != self.key_id and self.jwks.stale(kid):
+            await self.jwks.refresh()
+
+    def verify(self, token: str) -> TokenData:
+        """ verifies {token} with the keys known so far, call fetch_keys first for the kids of the JWKS """
+        if token.count(".") != 2:
+            raise credentials_exception()
+        signing_input, _, signature = token.rpartition(".")
+        header_segment, _, payload_segment = signing_input.partition(".")
+        try:
+            header = orjson.loads(base64url_decode(header_segment))
+            payload = orjson.loads(base64url_decode(payload_segment))
+            signature = base64url_decode(signature)
+        except ValueError:
+            raise credentials_exception()
+        if not isinstance(header, dict) or not isinstance(payload, dict):
+            raise credentials_exception()
+        if header.get("alg") != self.algorithm_name:
+            raise credentials_exception()
+
+        now = time.time()
+        expires_at, not_before, email = payload.get("exp"), payload.get("nbf", 0), payload.get("sub")
+        if not isinstance(expires_at, int) or isinstance(expires_at, bool) or expires_at <= now:
+            raise credentials_exception()
+        if not isinstance(not_before, (int, float)) or not_before > now:
+            raise credentials_exception()
+        if not isinstance(email, str):
+            raise credentials_exception()
+
+        key = self.key_for(header.get("kid"))
+        if key is None or not self.algorithm.verify(signing_input.encode(), key, signature):
+            raise credentials_exception()
+        return TokenData(email=email, expires_at=expires_at)
+
+    def key_for(self, kid: Union[str, None]) -> Any:
+        if kid is None or kid == self.key_id:
+            return self.key
+        if self.jwks is None or not isinstance(kid, str):
+            return None
+        jwk = self.jwks.get(kid)
+        if jwk is None or jwk.algorithm_name != self.algorithm_name:
+            return None
+        return jwk.key
+
+
+def load_signing_key() -> Any:
+    """
+    the key signing the access tokens: the SECRET_KEY for HMAC algorithms,
+    otherwise the private key of JWT_PRIVATE_KEY_FILE, None when it is not set
+    """
+    if settings.ALGORITHM.startswith("HS"):
+        return settings.SECRET_KEY
+    if not settings.JWT_PRIVATE_KEY_FILE:
+        # the app only verifies tokens signed elsewhere, with the keys of JWT_JWKS_URL
+        return None
+    with open(settings.JWT_PRIVATE_KEY_FILE, "rb") as key_file:
+        return get_default_algorithms()[settings.ALGORITHM].prepare_key(key_file.read())
+
+
+def load_token_verifier() -> TokenVerifier:
+    verification_key = signing_key
+    if signing_key is not None and not settings.ALGORITHM.startswith("HS"):
+        verification_key = signing_key.public_key()
+    jwks = None
+    if settings.JWT_JWKS_URL:
+        jwks = JWKSCache(
+            url=settings.JWT_JWKS_URL,
+            ttl=settings.JWT_JWKS_TTL,
+            refresh_interval=settings.JWT_JWKS_REFRESH_INTERVAL,
+            timeout=settings.JWT_JWKS_TIMEOUT,
+        )
+    return TokenVerifier(algorithm=settings.ALGORITHM, key=verification_key, key_id=settings.JWT_KEY_ID, jwks=jwks)
+
+
+signing_key = load_signing_key()
+token_verifier = load_token_verifier()
+
+
 def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -17,23 +176,13 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    headers = {"kid": settings.JWT_KEY_ID} if settings.JWT_KEY_ID else None
     encoded_jwt = jwt.encode(
-        claims=to_encode, key=settings.SECRET_KEY, algorithm=settings.ALGORITHM
+        payload=to_encode, key=signing_key, algorithm=settings.ALGORITHM, headers=headers
     )
     return encoded_jwt
 
 
-def verify_access_token(token: str) -> TokenData:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        return TokenData(email=email)
-    except JWTError:
-        raise credentials_exception
+async def verify_access_token(token: str) -> TokenData:
+    await token_verifier.fetch_keys(token)
+    return token_verifier.verify(token)
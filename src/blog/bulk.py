@@ -0,0 +1,41 @@
+from typing import Any, Dict, List, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.blog.schemas import BulkItemResultSchema
+
+
+def format_errors(error: ValidationError) -> str:
+    """ e.g. "title: Field required; body: Input should be a valid string" """
+    return "; ".join(
+        "{}: {}".format(".".join(str(part) for part in item["loc"]) or "item", item["msg"])
+        for item in error.errors()
+    )
+
+
+def validate_batch(
+        schema: Type[BaseModel], items: List[Any]
+) -> Tuple[List[BulkItemResultSchema], Dict[int, BaseModel]]:
+    """
+    validates every item of a bulk request on its own, so an invalid item does not reject the others
+    :return: the result of every item, with the errors of the invalid ones, and the valid items by index
+    """
+    results = [BulkItemResultSchema(index=index) for index in range(len(items))]
+    valid = {}
+    for index, item in enumerate(items):
+        try:
+            valid[index] = schema.model_validate(item)
+        except ValidationError as error:
+            results[index].error = format_errors(error)
+    return results, valid
+
+
+async def insert_returning_ids(db: AsyncSession, model, rows: List[Dict]) -> List[int]:
+    """
+    inserts the rows with multi-row INSERT ... RETURNING statements,
+    :return: the ids of the new rows, in the order of {rows}
+    """
+    statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+    return list((await db.scalars(statement, rows)).all())
@@ -0,0 +1,44 @@
+from typing import Union
+
+from fastapi import Request
+
+from settings import Settings
+from src.cache import ResponseCache, MemoryCacheBackend, RedisCacheBackend
+from src.redis_client import get_redis
+
+
+settings = Settings()
+
+# tag of every page of GET /posts
+POSTS_TAG = "posts"
+
+memory_response_cache = ResponseCache(
+    backend=MemoryCacheBackend(maxsize=settings.RESPONSE_CACHE_SIZE, ttl=settings.RESPONSE_CACHE_TTL),
+    ttl=settings.RESPONSE_CACHE_TTL,
+)
+
+if settings.RESPONSE_CACHE_MAX_AGE:
+    CACHE_CONTROL = f"public, max-age={settings.RESPONSE_CACHE_MAX_AGE}"
+else:
+    CACHE_CONTROL = "no-cache"
+
+
+def post_tag(post_id: int) -> str:
+    """ tag of GET /posts/{post_id} """
+    return f"post:{post_id}"
+
+
+def get_response_cache(request: Request) -> Union[ResponseCache, None]:
+    """ cache of the public posts responses, selected by the RESPONSE_CACHE_BACKEND setting """
+    if settings.RESPONSE_CACHE_BACKEND == "redis":
+        backend = RedisCacheBackend(redis=get_redis(request), prefix="cache:", ttl=settings.RESPONSE_CACHE_TTL)
+        return ResponseCache(backend=backend, ttl=settings.RESPONSE_CACHE_TTL)
+    if settings.RESPONSE_CACHE_BACKEND == "memory":
+        return memory_response_cache
+    return None
+
+
+async def invalidate_post(response_cache: Union[ResponseCache, None], *post_ids: int):
+    """ must be called every time posts or their comments change """
+    if response_cache is not None:
+        await response_cache.invalidate(POSTS_TAG, *(post_tag(post_id) for post_id in post_ids))
@@ -1,192 +1,619 @@
-from typing import cast, List
+from collections import Counter
+from typing import cast, Any, List, Union
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session, query
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from pydantic import TypeAdapter
 
-from src.db.connection import get_db
+from settings import Settings
+from src.db.connection import get_async_db, get_async_read_db, get_async_sessionmaker
+from src.db.loaders import loader_options
 from src.blog.schemas import (
-    PostSchema, CompletePostSchema, CommentSchema, CommentViewSchema,
+    PostSchema, PostSummarySchema, CompletePostSchema, CommentSchema, CommentViewSchema, CommentTreeSchema,
+    CommentExportSchema, CommentBulkSchema, PageSchema, BulkResultSchema, BulkDeleteSchema,
 )
 from src.blog.models import Post, Comment
-from src.blog.utils import PostsQueryParams, CommentsQueryParams
-from src.constants import REQUESTS_LIMIT_GET_POSTS
+from src.blog.search import search_posts
+from src.blog.utils import (
+    PostsQueryParams, PostsView, CommentsQueryParams, CommentTreeQueryParams, get_page, page_headers, page_content,
+    decode_cursor, json_response,
+)
+from src.blog.tree import get_comment_tree
+from src.blog.bulk import validate_batch, insert_returning_ids
+from src.blog.export import posts_export_statement, comments_export_statement, comment_from_row, stream_ndjson
+from src.blog.projections import posts_statement, post_from_row, add_comments
+from src.blog.cache import CACHE_CONTROL, POSTS_TAG, post_tag, get_response_cache, invalidate_post
+from src.cache import CachedResponse, ResponseCache, make_cache_key, parse_if_match
+from src.constants import (
+    REQUESTS_LIMIT_GET_POSTS, REQUESTS_LIMIT_GET_POSTS_AUTHENTICATED, REQUESTS_LIMIT_EXPORT, REQUESTS_LIMIT_ADD_POST,
+    REQUESTS_LIMIT_ADD_COMMENT, REQUESTS_LIMIT_ADD_POSTS_BULK, REQUESTS_LIMIT_ADD_COMMENTS_BULK,
+)
+from src.requests_limit import RateLimit
 from src.authentication.oauth2 import get_current_user
 from src.authentication.schemas import UserViewSchema
 
 
+settings = Settings()
+
 posts_router = APIRouter()
 
+complete_post_options = loader_options(Post, CompletePostSchema)
+returning_post_options = loader_options(Post, CompletePostSchema, joined=False)
+comment_view_options = loader_options(Comment, CommentViewSchema)
+
+# building an adapter compiles its schema, so they are built once instead of on every request
+complete_post_adapter = TypeAdapter(CompletePostSchema)
+post_summary_adapter = TypeAdapter(PostSummarySchema)
+comment_view_adapter = TypeAdapter(CommentViewSchema)
+comment_export_adapter = TypeAdapter(CommentExportSchema)
+# lists of items, and the pages of them, by the schema of the items
+list_adapters = {
+    schema: TypeAdapter(List[schema])
+    for schema in (CompletePostSchema, PostSummarySchema, CommentViewSchema, CommentTreeSchema)
+}
+page_adapters = {schema: TypeAdapter(Union[List[schema], PageSchema[schema]]) for schema in list_adapters}
+
 
 @posts_router.get(
     "",
-    response_model=List[CompletePostSchema],
-    dependencies=[Depends(RateLimiter(
-        times=REQUESTS_LIMIT_GET_POSTS["TIMES"],
-        seconds=REQUESTS_LIMIT_GET_POSTS["SECONDS"],
-    ))]
+    response_model=Union[
+        List[CompletePostSchema], PageSchema[CompletePostSchema], List[PostSummarySchema], PageSchema[PostSummarySchema]
+    ],
+    dependencies=[Depends(RateLimit("list_posts", REQUESTS_LIMIT_GET_POSTS, REQUESTS_LIMIT_GET_POSTS_AUTHENTICATED))]
 )
 async def list_posts(
-        db: Session = Depends(get_db),
+        request: Request,
+        db: AsyncSession = Depends(get_async_read_db),
+        response_cache: Union[ResponseCache, None] = Depends(get_response_cache),
         query_params: PostsQueryParams = Depends(PostsQueryParams)):
     """
     <strong>Returns a paginated list of saved posts ordered by id descending.</strong>\n
     The default length of the list is 20, but you can customize it throughout the param "limit".\n
-    You can also search for expressions in the title and in the body of a <strong>Post</strong>.
+    Pages can be selected by their number ("page") or by the cursor ("after") of the previous page,
+    which is sent in the "Link" header, or in the body when "envelope" is true.\n
+    Use "q" to search for words in the title and in the body of the <strong>Posts</strong>.
+    Search results are ordered by relevance and selected by page number.
+    Set "view" to "summary" to get the number of comments of each post instead of the comments themselves.
+    Responses carry an ETag, send it back in "If-None-Match" to get a 304 while the page is unchanged.
     """
-    posts = db.query(Post).order_by(Post.id.desc())
+    if response_cache is not None:
+        cache_key = await response_cache.versioned_key(
+            make_cache_key("posts", **vars(query_params)), tags=[POSTS_TAG]
+        )
+        cached_response = await response_cache.get(cache_key)
+        if cached_response is not None:
+            return cached_response.to_response(request, cache_control=CACHE_CONTROL)
+
+    posts = posts_statement()
+    if query_params.q:
+        posts = search_posts(statement=posts, terms=query_params.q, dialect_name=db.get_bind().dialect.name)
     if query_params.title:
-        posts = posts.filter(
+        posts = posts.where(
             cast("ColumnElement[bool]", Post.title == query_params.title)
         )
     if query_params.body:
-        posts = posts.filter(
+        posts = posts.where(
             cast("ColumnElement[bool]", Post.body == query_params.body)
         )
-    if query_params.limit:
-        posts.limit(query_params.limit)
+    posts, next_cursor = await get_page(
+        db=db,
+        statement=posts,
+        id_column=Post.id,
+        query_params=query_params,
+        descending=True,
+        keyset=not query_params.q,
+        scalars=False,
+    )
+    posts = [post_from_row(row) for row in posts]
+    if query_params.view == PostsView.summary:
+        schema = PostSummarySchema
+    else:
+        schema = CompletePostSchema
+        posts = await add_comments(db=db, posts=posts)
+    items = list_adapters[schema].validate_python(posts)
+    content = page_content(schema=schema, items=items, next_cursor=next_cursor, query_params=query_params)
+    cached_response = CachedResponse.build(
+        body=page_adapters[schema].dump_json(content), headers=page_headers(request=request, next_cursor=next_cursor)
+    )
+    if response_cache is not None and not db.info.get("replica"):
+        await response_cache.set(cache_key, cached_response)
+    return cached_response.to_response(request, cache_control=CACHE_CONTROL)
+
 
-    if query_params.page:
-        posts = posts.offset((query_params.page - 1) * query_params.limit)
-    adapter = TypeAdapter(List[CompletePostSchema])
-    return adapter.validate_python(posts)
+# declared before /{post_id}, which would take "export" as a post id
+@posts_router.get(
+    "/export",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    dependencies=[Depends(RateLimit("export_posts", REQUESTS_LIMIT_EXPORT))]
+)
+async def export_posts(session_factory: async_sessionmaker = Depends(get_async_sessionmaker)):
+    """
+    <strong>Streams every saved post, ordered by id, as newline delimited JSON.</strong>\n
+    Each line is a post in the summary format of GET /posts.
+    """
+    content = stream_ndjson(
+        session_factory=session_factory,
+        statement=posts_export_statement(),
+        adapter=post_summary_adapter,
+        from_row=post_from_row,
+    )
+    return StreamingResponse(content, media_type="application/x-ndjson")
 
 
 @posts_router.get(
     "/{post_id}",
     response_model=CompletePostSchema,
-    dependencies=[Depends(RateLimiter(
-        times=REQUESTS_LIMIT_GET_POSTS["TIMES"],
-        seconds=REQUESTS_LIMIT_GET_POSTS["SECONDS"],
-    ))]
+    dependencies=[Depends(RateLimit("get_post", REQUESTS_LIMIT_GET_POSTS, REQUESTS_LIMIT_GET_POSTS_AUTHENTICATED))]
 )
 async def get_post(
         post_id: int,
-        db: Session = Depends(get_db)):
+        request: Request,
+        db: AsyncSession = Depends(get_async_read_db),
+        response_cache: Union[ResponseCache, None] = Depends(get_response_cache)):
     """ Get a saved post by post_id """
-    post = db.query(Post).filter(
-        cast("ColumnElement[bool]", Post.id == post_id)
-    ).first()
+    if response_cache is not None:
+        cache_key = await response_cache.versioned_key(f"posts/{post_id}", tags=[post_tag(post_id)])
+        cached_response = await response_cache.get(cache_key)
+        if cached_response is not None:
+            return cached_response.to_response(request, cache_control=CACHE_CONTROL)
+
+    post = await get_complete_post(db=db, post_id=post_id)
     if not post:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Post not found"
         )
-    adapter = TypeAdapter(CompletePostSchema)
-    return adapter.validate_python(post)
+    cached_response = CachedResponse.build(
+        body=complete_post_adapter.dump_json(complete_post_adapter.validate_python(post)), version=post.version
+    )
+    if response_cache is not None and not db.info.get("replica"):
+        await response_cache.set(cache_key, cached_response)
+    return cached_response.to_response(request, cache_control=CACHE_CONTROL)
 
 
-@posts_router.post("", response_model=CompletePostSchema, status_code=status.HTTP_201_CREATED)
+@posts_router.post(
+    "",
+    response_model=CompletePostSchema,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(RateLimit("add_post", REQUESTS_LIMIT_ADD_POST, per_path=False))]
+)
 async def add_post(
         post: PostSchema,
         user: UserViewSchema = Depends(get_current_user),
-        db: Session = Depends(get_db)):
+        db: AsyncSession = Depends(get_async_db),
+        response_cache: Union[ResponseCache, None] = Depends(get_response_cache)):
     """ Adds a new post into the database. """
     new_post = Post(**post.model_dump())
-    new_post.creator = user
+    new_post.user_id = user.id
     db.add(new_post)
-    db.commit()
-    db.refresh(new_post)
-    adapter = TypeAdapter(CompletePostSchema)
-    return adapter.validate_python(new_post)
+    await db.commit()
+    await invalidate_post(response_cache, new_post.id)
+    new_post = await get_complete_post(db=db, post_id=new_post.id)
+    return post_response(post=new_post, status_code=status.HTTP_201_CREATED)
+
 
+async def get_complete_post(db: AsyncSession, post_id: int) -> Post:
+    """ Loads a post along with the relationships rendered by CompletePostSchema """
+    return await db.scalar(
+        select(Post)
+        .options(*complete_post_options)
+        .where(cast("ColumnElement[bool]", Post.id == post_id))
+        .execution_options(populate_existing=True)
+    )
 
-async def get_post_from_user(db: Session, post_id: int, user: UserViewSchema) -> query.Query:
-    posts = db.query(Post).filter(cast("ColumnElement[bool]", Post.id == post_id))
-    if posts.count() == 0:
+
+def post_response(post: Post, status_code: int) -> Response:
+    """ renders a post written by the request, along with the ETag GET /posts/{post_id} returns for it """
+    written = CachedResponse.build(
+        body=complete_post_adapter.dump_json(complete_post_adapter.validate_python(post)), version=post.version
+    )
+    return Response(
+        content=written.body, media_type="application/json", status_code=status_code, headers={"ETag": written.etag}
+    )
+
+
+async def raise_post_write_error(db: AsyncSession, post_id: int, user: UserViewSchema):
+    """
+    tells why a conditional write of a post matched no row, the writes only pay for it when they miss
+    """
+    owner_id = await db.scalar(select(Post.user_id).where(cast("ColumnElement[bool]", Post.id == post_id)))
+    if owner_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Post not found"
         )
-    posts = posts.filter(Post.creator == user)
-    if posts.count() == 0:
+    if owner_id != user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f"You cannot edit someone else's post"
         )
-    return posts
+    raise HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail=f"The post has been modified, get it again before writing"
+    )
+
+
+def post_write_conditions(post_id: int, user: UserViewSchema, if_match: Union[str, None]) -> List:
+    """ the post must exist, belong to the user and, when If-Match is sent, be in one of its versions """
+    conditions = [
+        cast("ColumnElement[bool]", Post.id == post_id),
+        cast("ColumnElement[bool]", Post.user_id == user.id),
+    ]
+    versions = parse_if_match(if_match)
+    if versions is not None:
+        conditions.append(Post.version.in_(versions))
+    return conditions
 
 
 @posts_router.put("/{post_id}", response_model=CompletePostSchema, status_code=status.HTTP_200_OK)
 async def update_post(
         post_id: int,
         post: PostSchema,
+        if_match: Union[str, None] = Header(default=None),
         user: UserViewSchema = Depends(get_current_user),
-        db: Session = Depends(get_db)):
-    """ Updates a post """
-    posts = await get_post_from_user(db=db, post_id=post_id, user=user)
-    posts.update(post.model_dump())
-    db.commit()
-    adapter = TypeAdapter(CompletePostSchema)
-    return adapter.validate_python(posts.first())
+        db: AsyncSession = Depends(get_async_db),
+        response_cache: Union[ResponseCache, None] = Depends(get_response_cache)):
+    """
+    Updates a post.\n
+    Send the ETag of the post in the If-Match header to update it only if no one else did meanwhile,
+    a 412 is returned otherwise.
+    """
+    updated_post = await db.scalar(
+        update(Post)
+        .where(*post_write_conditions(post_id=post_id, user=user, if_match=if_match))
+        .values(**post.model_dump(), version=Post.version + 1)
+        .returning(Post)
+        .options(*returning_post_options)
+        .execution_options(populate_existing=True)
+    )
+    if updated_post is None:
+        await raise_post_write_error(db=db, post_id=post_id, user=user)
+    await db.commit()
+    await invalidate_post(response_cache, post_id)
+    return post_response(post=updated_post, status_code=status.HTTP_200_OK)
 
 
 @posts_router.delete("/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_post(
         post_id: int,
+        if_match: Union[str, None] = Header(default=None),
         user: UserViewSchema = Depends(get_current_user),
-        db: Session = Depends(get_db)):
-    """ Deletes a post from the database. """
-    post = await get_post_from_user(db=db, post_id=post_id, user=user)
-    post.delete()
-    db.commit()
+        db: AsyncSession = Depends(get_async_db),
+        response_cache: Union[ResponseCache, None] = Depends(get_response_cache)):
+    """
+    Deletes a post from the database.\n
+    Send the ETag of the post in the If-Match header to delete it only if no one changed it meanwhile.
+    """
+    deleted_id = await db.scalar(
+        delete(Post).where(*post_write_conditions(post_id=post_id, user=user, if_match=if_match)).returning(Post.id)
+    )
+    if deleted_id is None:
+        await raise_post_write_error(db=db, post_id=post_id, user=user)
+    await db.commit()
+    await invalidate_post(response_cache, post_id)
     return {"msg": "Post Deleted"}
 
 
+@posts_router.post(
+    "/bulk",
+    response_model=BulkResultSchema,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(RateLimit("add_posts_bulk", REQUESTS_LIMIT_ADD_POSTS_BULK, per_path=False, per_item=True))]
+)
+async def add_posts_bulk(
+        items: List[Any] = Body(max_length=settings.BULK_MAX_ITEMS),
+        user: UserViewSchema = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db),
+        response_cache: Union[ResponseCache, None] = Depends(get_response_cache)):
+    """
+    Adds a list of posts into the database, in a single transaction.\n
+    Every item is validated on its own: the result of each one holds either the id of the new post
+    or the reason it was not saved. At most BULK_MAX_ITEMS posts are accepted per request,
+    and the rate limit counts the posts rather than the requests.
+    """
+    results, posts = validate_batch(PostSchema, items)
+    if posts:
+        ids = await insert_returning_ids(
+            db, Post, [{**post.model_dump(), "user_id": user.id} for post in posts.values()]
+        )
+        await db.commit()
+        for index, post_id in zip(posts, ids):
+            results[index].id = post_id
+        await invalidate_post(response_cache, *ids)
+    return BulkResultSchema(items=results)
+
+
+@posts_router.post("/bulk/delete", response_model=BulkResultSchema, status_code=status.HTTP_200_OK)
+async def delete_posts_bulk(
+        body: BulkDeleteSchema,
+        user: UserViewSchema = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db),
+        response_cache: Union[ResponseCache, None] = Depends(get_response_cache)):
+    """
+    Deletes a list of posts of the authenticated user along with their comments, in a single transaction.\n
+    The result of each id tells whether the post was deleted, not found or written by someone else.
+    """
+    # the comments hold a foreign key to their post, they must go first
+    owned = select(Post.id).where(Post.id.in_(body.ids), cast("ColumnElement[bool]", Post.user_id == user.id))
+    await db.execute(delete(Comment).where(Comment.post_id.in_(owned)))
+    deleted = set((await db.scalars(
+        delete(Post)
+        .where(Post.id.in_(body.ids), cast("ColumnElement[bool]", Post.user_id == user.id))
+        .returning(Post.id)
+    )).all())
+    missing = set(body.ids) - deleted
+    others = set((await db.scalars(select(Post.id).where(Post.id.in_(missing)))).all()) if missing else set()
+    await db.commit()
+    await invalidate_post(response_cache, *deleted)
+    results = BulkResultSchema(items=[{"index": index, "id": post_id} for index, post_id in enumerate(body.ids)])
+    for result in results.items:
+        if result.id in others:
+            result.error = "You cannot delete someone else's post"
+        elif result.id not in deleted:
+            result.error = "Post not found"
+    return results
+
+
 comments_router = APIRouter()
 
 
-@comments_router.post("/{post_id}", response_model=CommentViewSchema, status_code=status.HTTP_201_CREATED)
+@comments_router.post(
+    "/{post_id}",
+    response_model=CommentViewSchema,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(RateLimit("add_comment", REQUESTS_LIMIT_ADD_COMMENT, per_path=False))]
+)
 async def add_comment(
         post_id: int,
         comment: CommentSchema,
         user: UserViewSchema = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db),
+        response_cache: Union[ResponseCache, None] = Depends(get_response_cache)
 ):
     """ Add a comment to the specified post. """
+    # the counter is incremented in the same transaction, locking the post until the comment is saved
+    result = await db.execute(
+        update(Post)
+        .where(cast("ColumnElement[bool]", Post.id == post_id))
+        .values(comment_count=Post.comment_count + 1)
+    )
+    if result.rowcount == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Post not found"
+        )
     new_comment = Comment(**comment.model_dump())
     new_comment.user_id = user.id
     new_comment.post_id = post_id
     db.add(new_comment)
-    db.commit()
-    db.refresh(new_comment)
-    adapter = TypeAdapter(CommentViewSchema)
-    return adapter.validate_python(new_comment)
+    await db.commit()
+    await invalidate_post(response_cache, post_id)
+    new_comment = await db.scalar(
+        select(Comment)
+        .options(*comment_view_options)
+        .where(cast("ColumnElement", Comment.id == new_comment.id))
+        .execution_options(populate_existing=True)
+    )
+    return json_response(
+        comment_view_adapter, comment_view_adapter.validate_python(new_comment), status_code=status.HTTP_201_CREATED
+    )
+
+
+@comments_router.post(
+    "/{post_id}/bulk",
+    response_model=BulkResultSchema,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(
+        RateLimit("add_comments_bulk", REQUESTS_LIMIT_ADD_COMMENTS_BULK, per_path=False, per_item=True)
+    )]
+)
+async def add_comments_bulk(
+        post_id: int,
+        items: List[Any] = Body(max_length=settings.BULK_MAX_ITEMS),
+        user: UserViewSchema = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db),
+        response_cache: Union[ResponseCache, None] = Depends(get_response_cache)
+):
+    """
+    Adds a list of comments to the specified post, in a single transaction.\n
+    A comment may respond to an existing comment of the post through "parent_id".
+    Every item is validated on its own: the result of each one holds either the id of the new comment
+    or the reason it was not saved. At most BULK_MAX_ITEMS comments are accepted per request,
+    and the rate limit counts the comments rather than the requests.
+    """
+    results, comments = validate_batch(CommentBulkSchema, items)
+    parent_ids = {comment.parent_id for comment in comments.values() if comment.parent_id is not None}
+    if parent_ids:
+        parents = set((await db.scalars(
+            select(Comment.id).where(
+                cast("ColumnElement[bool]", Comment.post_id == post_id), Comment.id.in_(parent_ids)
+            )
+        )).all())
+        for index, comment in list(comments.items()):
+            if comment.parent_id is not None and comment.parent_id not in parents:
+                results[index].error = "Parent comment not found"
+                del comments[index]
+
+    result = await db.execute(
+        update(Post)
+        .where(cast("ColumnElement[bool]", Post.id == post_id))
+        .values(comment_count=Post.comment_count + len(comments))
+    )
+    if result.rowcount == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Post not found"
+        )
+    if comments:
+        ids = await insert_returning_ids(
+            db, Comment, [
+                {**comment.model_dump(), "user_id": user.id, "post_id": post_id} for comment in comments.values()
+            ]
+        )
+        for index, comment_id in zip(comments, ids):
+            results[index].id = comment_id
+    await db.commit()
+    await invalidate_post(response_cache, post_id)
+    return BulkResultSchema(items=results)
+
+
+@comments_router.post("/bulk/delete", response_model=BulkResultSchema, status_code=status.HTTP_200_OK)
+async def delete_comments_bulk(
+        body: BulkDeleteSchema,
+        user: UserViewSchema = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db),
+        response_cache: Union[ResponseCache, None] = Depends(get_response_cache)
+):
+    """
+    Deletes a list of comments of the authenticated user, in a single transaction.\n
+    The result of each id tells whether the comment was deleted, not found or written by someone else.
+    """
+    rows = (await db.execute(
+        delete(Comment)
+        .where(Comment.id.in_(body.ids), cast("ColumnElement[bool]", Comment.user_id == user.id))
+        .returning(Comment.id, Comment.post_id)
+    )).all()
+    for post_id, deleted_comments in Counter(row.post_id for row in rows).items():
+        await db.execute(
+            update(Post)
+            .where(cast("ColumnElement[bool]", Post.id == post_id))
+            .values(comment_count=Post.comment_count - deleted_comments)
+        )
+    deleted = {row.id for row in rows}
+    missing = set(body.ids) - deleted
+    others = set((await db.scalars(select(Comment.id).where(Comment.id.in_(missing)))).all()) if missing else set()
+    await db.commit()
+    await invalidate_post(response_cache, *{row.post_id for row in rows})
+    results = BulkResultSchema(
+        items=[{"index": index, "id": comment_id} for index, comment_id in enumerate(body.ids)]
+    )
+    for result in results.items:
+        if result.id in others:
+            result.error = "You cannot delete someone else's comment"
+        elif result.id not in deleted:
+            result.error = "Comment not found"
+    return results
 
 
-@comments_router.get("/{post_id}", response_model=List[CommentViewSchema], status_code=status.HTTP_200_OK)
+@comments_router.get(
+    "/{post_id}",
+    response_model=Union[List[CommentViewSchema], PageSchema[CommentViewSchema]],
+    status_code=status.HTTP_200_OK
+)
 async def list_comments(
         post_id: int,
+        request: Request,
         query_params: CommentsQueryParams = Depends(CommentsQueryParams),
         user: UserViewSchema = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_read_db)
+):
+    """ Returns a paginated list of comments for a specific post, ordered by id. """
+    comments = select(Comment).options(*comment_view_options).where(
+        cast("ColumnElement", Comment.post_id == post_id)
+    )
+    comments, next_cursor = await get_page(
+        db=db, statement=comments, id_column=Comment.id, query_params=query_params
+    )
+    content = page_content(
+        schema=CommentViewSchema,
+        items=list_adapters[CommentViewSchema].validate_python(comments),
+        next_cursor=next_cursor,
+        query_params=query_params,
+    )
+    return json_response(
+        page_adapters[CommentViewSchema], content, headers=page_headers(request=request, next_cursor=next_cursor)
+    )
+
+
+@comments_router.get(
+    "/{post_id}/tree",
+    response_model=Union[List[CommentTreeSchema], PageSchema[CommentTreeSchema]],
+    status_code=status.HTTP_200_OK
+)
+async def get_comments_tree(
+        post_id: int,
+        request: Request,
+        query_params: CommentTreeQueryParams = Depends(CommentTreeQueryParams),
+        user: UserViewSchema = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_read_db)
 ):
-    """ Returns all comments for a specific post. """
-    comments = db.query(Comment).filter(cast("ColumnElement", Comment.post_id == post_id))
-    if query_params.limit and query_params.limit:
-        comments.limit(query_params.limit)
-        comments.offset((query_params.page - 1) * query_params.limit)
-    comments = comments.all()
-    adapter = TypeAdapter(List[CommentViewSchema])
-    return adapter.validate_python(comments)
+    """
+    Returns the thread of comments of a specific post, each comment along with its responses.\n
+    Up to "limit" comments are returned on each level of the thread, down to "max_depth" levels.
+    The "response_count" of a comment tells how many responses it has, rendered or not.
+    The next top level comments are selected by the cursor ("after") of the previous page.\n
+    Set "parent_id" to a comment's id to get the thread of its responses instead, and "after" to
+    its "responses_next_cursor" to skip the responses already rendered under it. Responses below
+    "max_depth" are counted only, they are reached the same way, from their parent.
+    """
+    comments, next_cursor = await get_comment_tree(
+        db=db,
+        post_id=post_id,
+        parent_id=query_params.parent_id,
+        after=decode_cursor(query_params.after) if query_params.after else None,
+        limit=query_params.limit,
+        max_depth=query_params.max_depth,
+    )
+    content = page_content(
+        schema=CommentTreeSchema,
+        items=list_adapters[CommentTreeSchema].validate_python(comments),
+        next_cursor=next_cursor,
+        query_params=query_params,
+    )
+    return json_response(
+        page_adapters[CommentTreeSchema], content, headers=page_headers(request=request, next_cursor=next_cursor)
+    )
+
+
+@comments_router.get(
+    "/{post_id}/export",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    dependencies=[Depends(RateLimit("export_comments", REQUESTS_LIMIT_EXPORT))]
+)
+async def export_comments(
+        post_id: int,
+        user: UserViewSchema = Depends(get_current_user),
+        session_factory: async_sessionmaker = Depends(get_async_sessionmaker)
+):
+    """
+    Streams every comment of a specific post, ordered by id, as newline delimited JSON.
+    Responses are exported as well, along with the id of the comment they respond to.
+    """
+    content = stream_ndjson(
+        session_factory=session_factory,
+        statement=comments_export_statement(post_id),
+        adapter=comment_export_adapter,
+        from_row=comment_from_row,
+    )
+    return StreamingResponse(content, media_type="application/x-ndjson")
 
 
 @comments_router.delete("/{comment_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_comment(
         comment_id: int,
         user: UserViewSchema = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db),
+        response_cache: Union[ResponseCache, None] = Depends(get_response_cache)
 ):
     """
     Deletes a comment with the provided <comment_id> from the database.
     """
-    comment = db.query(Comment).filter(cast("ColumnElement", Comment.id == comment_id))
-    if comment.first() is None:
+    comment = await db.scalar(select(Comment).where(cast("ColumnElement", Comment.id == comment_id)))
+    if comment is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Comment not found"
         )
-    comment.delete()
-    db.commit()
+    result = await db.execute(delete(Comment).where(cast("ColumnElement", Comment.id == comment_id)))
+    await db.execute(
+        update(Post)
+        .where(cast("ColumnElement[bool]", Post.id == comment.post_id))
+        .values(comment_count=Post.comment_count - result.rowcount)
+    )
+    await db.commit()
+    await invalidate_post(response_cache, comment.post_id)
     return {"msg": "Comment Deleted"}
@@ -0,0 +1,48 @@
+from typing import AsyncIterator, Callable, Dict
+
+from pydantic import TypeAdapter
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from settings import Settings
+from src.authentication.models import User
+from src.blog.models import Post, Comment
+from src.blog.projections import posts_statement
+from src.blog.utils import CREATOR_COLUMNS, creator_from_row
+
+
+settings = Settings()
+
+
+def posts_export_statement() -> Select:
+    return posts_statement().order_by(Post.id)
+
+
+def comments_export_statement(post_id: int) -> Select:
+    return (
+        select(Comment.id, Comment.parent_id, Comment.body, *CREATOR_COLUMNS)
+        .join(User, Comment.user_id == User.id)
+        .where(Comment.post_id == post_id)
+        .order_by(Comment.id)
+    )
+
+
+def comment_from_row(row) -> Dict:
+    return {"id": row.id, "parent_id": row.parent_id, "body": row.body, "creator": creator_from_row(row)}
+
+
+async def stream_ndjson(
+        session_factory: async_sessionmaker,
+        statement: Select,
+        adapter: TypeAdapter,
+        from_row: Callable) -> AsyncIterator[bytes]:
+    """
+    streams the rows of {statement} as newline delimited json, one chunk per batch of rows.
+    The rows are fetched through a server side cursor, EXPORT_BATCH_SIZE at a time, so memory
+    does not grow with the table. The response outlives the request dependencies, therefore the
+    stream opens its own session instead of using get_async_db.
+    """
+    async with session_factory() as db:
+        result = await db.stream(statement.execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            yield b"".join(adapter.dump_json(adapter.validate_python(from_row(row))) + b"\n" for row in rows)
@@ -1,6 +1,6 @@
 from typing import cast
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, DDL, Index, event
 from sqlalchemy.orm import relationship
 
 from src.db.connection import Base
@@ -11,7 +11,11 @@ class Post(Base):
     id = Column(Integer, primary_key=True)
     title = Column(String(150), nullable=False)
     body = Column(Text(), nullable=False)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    # number of comments of the post, responses included, updated along with every comment added or deleted
+    comment_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # incremented by every update of the title or body, guards concurrent writes through If-Match
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     creator = relationship("User", back_populates="posts")
     comments = relationship("Comment", back_populates="post")
 
@@ -21,11 +25,13 @@ class Post(Base):
 
 class Comment(Base):
     __tablename__ = 'comments'
+    # the comments of a post are listed by id, and this index also serves the lookups by post_id
+    __table_args__ = (Index("ix_comments_post_id_id", "post_id", "id"),)
     id = Column(Integer, primary_key=True)
     body = Column(Text(), nullable=False)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     post_id = Column(Integer, ForeignKey('posts.id'), nullable=False)
-    parent_id = Column(Integer, ForeignKey('comments.id'), nullable=True)
+    parent_id = Column(Integer, ForeignKey('comments.id'), nullable=True, index=True)
 
     creator = relationship("User", back_populates="comments")
     post = relationship("Post", back_populates="comments")
@@ -34,3 +40,43 @@ class Comment(Base):
 
     def __repr__(self):
         return f'f<Comment {self.id}>'
+
+
+# Full text search index of the posts, queried by src.blog.search.
+# On postgres it is a generated tsvector column with a GIN index, on sqlite an external
+# content FTS5 table kept in sync by triggers. The alembic migration
+# 9c2f4e1a7b3d_add_posts_full_text_search creates the same objects on existing databases.
+POSTGRES_SEARCH_DDL = [
+    """
+    ALTER TABLE posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(body, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX ix_posts_search_vector ON posts USING GIN (search_vector)",
+]
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE posts_fts USING fts5(title, body, content='posts', content_rowid='id')",
+    """
+    CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER posts_fts_update AFTER UPDATE OF title, body ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO posts_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+]
+
+for statement in POSTGRES_SEARCH_DDL:
+    event.listen(Post.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+for statement in SQLITE_SEARCH_DDL:
+    event.listen(Post.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Post.__table__, "before_drop", DDL("DROP TABLE IF EXISTS posts_fts").execute_if(dialect="sqlite"))
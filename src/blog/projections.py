@@ -0,0 +1,57 @@
+from typing import Dict, List
+
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.authentication.models import User
+from src.blog.models import Post, Comment
+from src.blog.utils import CREATOR_COLUMNS, creator_from_row
+
+
+def posts_statement() -> Select:
+    """
+    selects the columns of PostSummarySchema, each post along with its creator. The rows are
+    plain tuples: no model is built nor tracked by the session, and the other columns
+    of the creator, e.g. the password hash, are not read.
+    """
+    return (
+        select(Post.id, Post.title, Post.body, Post.comment_count, *CREATOR_COLUMNS)
+        .join(User, Post.user_id == User.id)
+    )
+
+
+def post_from_row(row) -> Dict:
+    return {
+        "id": row.id,
+        "title": row.title,
+        "body": row.body,
+        "comment_count": row.comment_count,
+        "creator": creator_from_row(row),
+    }
+
+
+async def add_comments(db: AsyncSession, posts: List[Dict]) -> List[Dict]:
+    """
+    adds the comments rendered by CompletePostSchema to the posts of post_from_row, ordered by id,
+    each one with its creator and the bodies of its responses. Responses are comments of the same
+    post, so a single query selects them all.
+    """
+    posts_by_id = {post["id"]: post for post in posts}
+    for post in posts:
+        post["comments"] = []
+    if not posts:
+        return posts
+    rows = (await db.execute(
+        select(Comment.id, Comment.post_id, Comment.parent_id, Comment.body, *CREATOR_COLUMNS)
+        .join(User, Comment.user_id == User.id)
+        .where(Comment.post_id.in_(posts_by_id))
+        .order_by(Comment.id)
+    )).all()
+    comments: Dict[int, Dict] = {}
+    for row in rows:
+        comments[row.id] = {"id": row.id, "body": row.body, "creator": creator_from_row(row), "responses": []}
+        posts_by_id[row.post_id]["comments"].append(comments[row.id])
+    for row in rows:
+        if row.parent_id in comments:
+            comments[row.parent_id]["responses"].append({"body": row.body})
+    return posts
@@ -1,10 +1,16 @@
-from typing import List, Union
+from typing import Generic, List, TypeVar, Union
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
+from settings import Settings
 from src.authentication.schemas import UserViewSchema
 
 
+settings = Settings()
+
+T = TypeVar("T")
+
+
 class PostSchema(BaseModel):
     title: str
     body: str
@@ -18,15 +24,59 @@ class CommentSchema(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class CommentBulkSchema(CommentSchema):
+    parent_id: Union[int, None] = None
+
+
 class CommentViewSchema(CommentSchema):
     id: int
     responses: Union[List[CommentSchema], None]
     creator: UserViewSchema
 
 
-class CompletePostSchema(PostSchema):
+class CommentExportSchema(CommentSchema):
+    id: int
+    parent_id: Union[int, None]
+    creator: UserViewSchema
+
+
+class CommentTreeSchema(CommentSchema):
     id: int
     creator: UserViewSchema
+    # responses beyond the limit or the max depth of the tree are counted but not rendered
+    response_count: int
+    responses: List["CommentTreeSchema"]
+    # cursor of the responses after the rendered ones, to be sent along with the parent_id of this comment
+    responses_next_cursor: Union[str, None] = None
+
+
+class PostSummarySchema(PostSchema):
+    id: int
+    creator: UserViewSchema
+    comment_count: int
+
+
+class CompletePostSchema(PostSummarySchema):
     comments: List[CommentViewSchema]
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class PageSchema(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Union[str, None]
+
+
+class BulkItemResultSchema(BaseModel):
+    # position of the item in the request
+    index: int
+    id: Union[int, None] = None
+    error: Union[str, None] = None
+
+
+class BulkResultSchema(BaseModel):
+    items: List[BulkItemResultSchema]
+
+
+class BulkDeleteSchema(BaseModel):
+    ids: List[int] = Field(max_length=settings.BULK_MAX_ITEMS)
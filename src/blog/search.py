@@ -0,0 +1,36 @@
+from sqlalchemy import Select, column, func, literal_column, table, text
+
+from src.blog.models import Post
+
+
+posts_fts = table("posts_fts", column("rowid"))
+
+
+def to_fts5_query(terms: str) -> str:
+    """
+    quotes every term of the user input, so FTS5 operators and syntax
+    characters are matched literally. All the terms must be present.
+    """
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in terms.split())
+
+
+def search_posts(statement: Select, terms: str, dialect_name: str) -> Select:
+    """
+    filters the posts of the statement by the full text search {terms}, ordered by rank.
+    Titles weigh more than bodies on the ranking.
+    """
+    if dialect_name == "postgresql":
+        search_vector = literal_column("posts.search_vector")
+        query = func.websearch_to_tsquery(literal_column("'english'::regconfig"), terms)
+        return statement.where(search_vector.op("@@")(query)).order_by(
+            func.ts_rank(search_vector, query).desc()
+        )
+    if dialect_name == "sqlite":
+        return statement.join(posts_fts, posts_fts.c.rowid == Post.id).where(
+            text("posts_fts MATCH :terms").bindparams(terms=to_fts5_query(terms))
+        ).order_by(
+            func.bm25(literal_column("posts_fts"), 10.0, 1.0)
+        )
+    # no search index on other databases, fall back to a case insensitive scan
+    pattern = f"%{terms}%"
+    return statement.where(Post.title.ilike(pattern) | Post.body.ilike(pattern))
@@ -0,0 +1,96 @@
+from typing import Dict, List, Tuple, Union
+
+from sqlalchemy import Integer, Select, func, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from src.authentication.models import User
+from src.blog.models import Comment
+from src.blog.utils import CREATOR_COLUMNS, creator_from_row, encode_cursor
+
+
+def comment_tree_statement(
+        post_id: int, parent_id: Union[int, None], after: Union[int, None], limit: int, max_depth: int
+) -> Select:
+    """
+    selects the thread of a post in a single recursive query: up to {limit} responses of the
+    comment {parent_id}, or top level comments when it is None, after the id {after}, and up to
+    {limit} responses of each of them, {max_depth} levels deep.
+    The responses of a comment are ranked by id before descending the tree, so the recursion
+    only visits the comments it returns.
+    """
+    ranked = select(
+        Comment.id,
+        Comment.parent_id,
+        func.row_number().over(partition_by=Comment.parent_id, order_by=Comment.id).label("position"),
+        func.count().over(partition_by=Comment.parent_id).label("siblings"),
+    ).where(Comment.post_id == post_id).cte("ranked")
+
+    if parent_id is None:
+        roots = select(ranked.c.id).where(ranked.c.parent_id.is_(None))
+    else:
+        roots = select(ranked.c.id).where(ranked.c.parent_id == parent_id)
+    if after is not None:
+        roots = roots.where(ranked.c.id > after)
+    roots = roots.order_by(ranked.c.id).limit(limit)
+    tree = select(
+        ranked.c.id, ranked.c.position, ranked.c.siblings, literal_column("1", Integer).label("depth")
+    ).where(ranked.c.id.in_(roots)).cte("tree", recursive=True)
+    tree = tree.union_all(
+        select(ranked.c.id, ranked.c.position, ranked.c.siblings, tree.c.depth + 1)
+        .join(tree, ranked.c.parent_id == tree.c.id)
+        .where(tree.c.depth < max_depth, ranked.c.position <= limit)
+    )
+
+    responses = aliased(Comment)
+    response_count = select(func.count(responses.id)).where(responses.parent_id == Comment.id).scalar_subquery()
+    return (
+        select(
+            Comment.id, Comment.parent_id, Comment.body, tree.c.depth, tree.c.position, tree.c.siblings,
+            response_count.label("response_count"), *CREATOR_COLUMNS,
+        )
+        .join(tree, Comment.id == tree.c.id)
+        .join(User, Comment.user_id == User.id)
+        .order_by(Comment.id)
+    )
+
+
+def build_comment_tree(rows) -> Tuple[List[Dict], Union[str, None]]:
+    """
+    nests the rows of comment_tree_statement in a single pass, each comment under its parent.
+    The rows are ordered by id, so the responses of every comment keep that order, and the
+    last response rendered under a comment gives the cursor of its next responses, if any.
+    :return: the top level comments and the cursor of the next page of them, None on the last one
+    """
+    nodes: Dict[int, Dict] = {}
+    roots: List[Dict] = []
+    next_cursor = None
+    for row in rows:
+        nodes[row.id] = {
+            "id": row.id,
+            "body": row.body,
+            "creator": creator_from_row(row),
+            "response_count": row.response_count,
+            "responses": [],
+            "responses_next_cursor": None,
+        }
+        if row.depth == 1:
+            roots.append(nodes[row.id])
+            next_cursor = encode_cursor(row.id) if row.position < row.siblings else None
+    for row in rows:
+        if row.depth > 1:
+            parent = nodes[row.parent_id]
+            parent["responses"].append(nodes[row.id])
+            parent["responses_next_cursor"] = encode_cursor(row.id) if row.position < row.siblings else None
+    return roots, next_cursor
+
+
+async def get_comment_tree(
+        db: AsyncSession, post_id: int, parent_id: Union[int, None], after: Union[int, None], limit: int,
+        max_depth: int
+) -> Tuple[List[Dict], Union[str, None]]:
+    statement = comment_tree_statement(
+        post_id=post_id, parent_id=parent_id, after=after, limit=limit, max_depth=max_depth
+    )
+    rows = (await db.execute(statement)).all()
+    return build_comment_tree(rows)
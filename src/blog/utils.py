@@ -1,6 +1,16 @@
-from fastapi import Query
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Any, Dict, List, Tuple, Type, Union
+
+from fastapi import HTTPException, Query, Request, Response, status
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
 from enum import Enum
 
+from src.authentication.models import User
+from src.blog.schemas import PageSchema
+
 
 class LimitOptions(int, Enum):
     ten = 10
@@ -9,26 +19,87 @@ class LimitOptions(int, Enum):
     hundred = 100
 
 
+class PostsView(str, Enum):
+    complete = "complete"
+    summary = "summary"
+
+
+CURSOR_PREFIX = "id:"
+# ids are BIGINT at most, a larger id in a cursor would overflow the query parameter
+CURSOR_ID_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+def encode_cursor(last_id: int) -> str:
+    """ builds the opaque cursor pointing right after the row with the given id """
+    return urlsafe_b64encode(f"{CURSOR_PREFIX}{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """ returns the id a cursor built by encode_cursor points to """
+    try:
+        value = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        if value.startswith(CURSOR_PREFIX):
+            last_id = int(value[len(CURSOR_PREFIX):])
+            if last_id in CURSOR_ID_RANGE:
+                return last_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        pass
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid cursor"
+    )
+
+
+# columns of the creator of a post or comment, for the queries that select rows instead of models
+CREATOR_COLUMNS = (User.id.label("user_id"), User.name, User.username, User.email, User.is_active)
+
+
+def creator_from_row(row) -> Dict:
+    """ the UserViewSchema fields of a row selected along with CREATOR_COLUMNS """
+    return {
+        "id": row.user_id,
+        "name": row.name,
+        "username": row.username,
+        "email": row.email,
+        "is_active": row.is_active,
+    }
+
+
 class PaginationQueryParams:
-    """ Inherit from this class everytime you need pagination query params """
+    """
+    Inherit from this class everytime you need pagination query params.
+    A page is selected either by its number or by the cursor ("after") returned with
+    the previous page. Cursors seek straight to the next rows through the primary key,
+    so deep pages cost the same as the first one.
+    """
     def __init__(
             self,
             limit: LimitOptions = Query(default=LimitOptions.twenty, le=100),
-            page: int = 1
+            page: int = Query(default=1, ge=1),
+            after: Union[str, None] = None,
+            envelope: bool = False,
     ):
         self.limit = limit
         self.page = page
+        self.after = after
+        self.envelope = envelope
 
 
 class PostsQueryParams(PaginationQueryParams):
     def __init__(
             self,
-            title: str = None,
-            body: str = None,
+            q: str = None,
+            view: PostsView = PostsView.complete,
+            title: str = Query(default=None, deprecated=True),
+            body: str = Query(default=None, deprecated=True),
             limit: LimitOptions = Query(default=LimitOptions.twenty, le=100),
-            page: int = 1
+            page: int = Query(default=1, ge=1),
+            after: Union[str, None] = None,
+            envelope: bool = False,
     ):
-        super().__init__(limit=limit, page=page)
+        super().__init__(limit=limit, page=page, after=after, envelope=envelope)
+        self.q = q.strip() if q else None
+        self.view = view
         self.title = title
         self.body = body
 
@@ -37,6 +108,100 @@ class CommentsQueryParams(PaginationQueryParams):
     def __init__(
             self,
             limit: LimitOptions = Query(default=LimitOptions.twenty, le=100),
-            page: int = 1
+            page: int = Query(default=1, ge=1),
+            after: Union[str, None] = None,
+            envelope: bool = False,
     ):
-        super().__init__(limit=limit, page=page)
+        super().__init__(limit=limit, page=page, after=after, envelope=envelope)
+
+
+class CommentTreeQueryParams(PaginationQueryParams):
+    """
+    The limit applies to every level of the tree: the number of top level comments
+    and the number of responses rendered for each comment.
+    With parent_id, the tree starts at the responses of that comment instead of the top level
+    comments, so the responses past the limit or the max depth can be reached too.
+    The first level of the tree is paginated by cursor only.
+    """
+    def __init__(
+            self,
+            max_depth: int = Query(default=5, ge=1, le=50),
+            limit: LimitOptions = Query(default=LimitOptions.twenty, le=100),
+            parent_id: Union[int, None] = None,
+            after: Union[str, None] = None,
+            envelope: bool = False,
+    ):
+        super().__init__(limit=limit, page=1, after=after, envelope=envelope)
+        self.max_depth = max_depth
+        self.parent_id = parent_id
+
+
+async def get_page(
+        db: AsyncSession,
+        statement: Select,
+        id_column,
+        query_params: PaginationQueryParams,
+        descending: bool = False,
+        keyset: bool = True,
+        scalars: bool = True) -> Tuple[List, Union[str, None]]:
+    """
+    orders the statement by {id_column} and fetches the page selected by {query_params}.
+    Statements already ordered by something else (e.g. search rank) must pass keyset=False:
+    {id_column} only breaks ties and pages are selected by number.
+    Statements selecting columns instead of a model must pass scalars=False to get whole rows.
+    :return: the rows of the page and the cursor of the next page, None on the last one
+    """
+    if not keyset and query_params.after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor pagination is not available for this listing, use page instead"
+        )
+    if descending:
+        statement = statement.order_by(id_column.desc())
+    else:
+        statement = statement.order_by(id_column)
+    if query_params.after:
+        last_id = decode_cursor(query_params.after)
+        statement = statement.where(id_column < last_id if descending else id_column > last_id)
+    else:
+        statement = statement.offset((query_params.page - 1) * query_params.limit)
+    # one extra row tells whether there is a next page
+    result = await db.execute(statement.limit(query_params.limit + 1))
+    rows = (result.scalars() if scalars else result).all()
+    if len(rows) > query_params.limit:
+        rows = rows[:query_params.limit]
+        return rows, encode_cursor(rows[-1].id) if keyset else None
+    return rows, None
+
+
+def page_headers(request: Request, next_cursor: Union[str, None]) -> Dict[str, str]:
+    """ links the next page, when there is one """
+    if not next_cursor:
+        return {}
+    next_url = request.url.remove_query_params("page").include_query_params(after=next_cursor)
+    return {"Link": f'<{next_url.path}?{next_url.query}>; rel="next"'}
+
+
+def page_content(
+        schema: Type[BaseModel],
+        items: List,
+        next_cursor: Union[str, None],
+        query_params: PaginationQueryParams):
+    """ the items, wrapped in a PageSchema of {schema} when the client asked for an envelope """
+    if query_params.envelope:
+        return PageSchema[schema](items=items, next_cursor=next_cursor)
+    return items
+
+
+def json_response(
+        adapter: TypeAdapter,
+        content: Any,
+        status_code: int = status.HTTP_200_OK,
+        headers: Union[Dict[str, str], None] = None) -> Response:
+    """
+    dumps {content}, already validated by {adapter}, straight to JSON bytes. FastAPI does not
+    validate nor encode again a Response returned by a handler, as it does for response_model
+    """
+    return Response(
+        content=adapter.dump_json(content), media_type="application/json", status_code=status_code, headers=headers
+    )
@@ -0,0 +1,194 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import Enum
+from hashlib import sha1
+from typing import Any, Dict, Hashable, List, Set, Union
+from urllib.parse import urlencode
+from uuid import uuid4
+
+import orjson
+from fastapi import Request, Response, status
+from redis.asyncio import Redis
+
+
+class TTLCache:
+    """
+    In process LRU cache whose entries expire after a time to live.
+    Once full, setting a new key evicts the least recently used one.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Union[float, None] = None):
+        """ stores the value for {ttl} seconds, or the cache default when it is None """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, *keys: Hashable):
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class MemoryCacheBackend:
+    """ async interface of a TTLCache, interchangeable with RedisCacheBackend """
+    def __init__(self, maxsize: int, ttl: float):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Union[bytes, None]:
+        return self.cache.get(key)
+
+    async def get_many(self, keys: List[str]) -> List[Union[bytes, None]]:
+        return [self.cache.get(key) for key in keys]
+
+    async def set(self, key: str, value: bytes, ttl: Union[float, None] = None):
+        self.cache.set(key, value, ttl=ttl)
+
+    async def delete(self, *keys: str):
+        self.cache.delete(*keys)
+
+
+class RedisCacheBackend:
+    """ cache shared by every worker, stored in redis under {prefix}{key} """
+    def __init__(self, redis: Redis, prefix: str, ttl: float):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Union[bytes, None]:
+        return await self.redis.get(self.prefix + key)
+
+    async def get_many(self, keys: List[str]) -> List[Union[bytes, None]]:
+        if not keys:
+            return []
+        return await self.redis.mget([self.prefix + key for key in keys])
+
+    async def set(self, key: str, value: bytes, ttl: Union[float, None] = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl > 0:
+            await self.redis.set(self.prefix + key, value, px=int(ttl * 1000))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.redis.delete(*(self.prefix + key for key in keys))
+
+
+CacheBackend = Union[MemoryCacheBackend, RedisCacheBackend]
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    headers: Dict[str, str]
+    etag: str
+
+    @classmethod
+    def build(
+            cls,
+            body: bytes,
+            headers: Union[Dict[str, str], None] = None,
+            version: Union[int, None] = None) -> "CachedResponse":
+        """
+        the ETag is the hash of the body, prefixed by the {version} of the resource when it has one,
+        e.g. "3-5f0c...". Writes compare the version sent back in If-Match, see parse_if_match.
+        """
+        digest = sha1(body).hexdigest()
+        etag = f'"{version}-{digest}"' if version is not None else f'"{digest}"'
+        return cls(body=body, headers=headers or {}, etag=etag)
+
+    def dumps(self) -> bytes:
+        return orjson.dumps({"body": self.body.decode(), "headers": self.headers, "etag": self.etag})
+
+    @classmethod
+    def loads(cls, data: bytes) -> "CachedResponse":
+        data = orjson.loads(data)
+        return cls(body=data["body"].encode(), headers=data["headers"], etag=data["etag"])
+
+    def to_response(self, request: Request, cache_control: str) -> Response:
+        """ the cached json response, or a 304 when the client already has it """
+        headers = {**self.headers, "ETag": self.etag, "Cache-Control": cache_control}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+            if "*" in etags or self.etag in etags:
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+def parse_if_match(if_match: Union[str, None]) -> Union[Set[int], None]:
+    """
+    the resource versions of the ETags listed in an If-Match header, None when any version matches.
+    Weak and unversioned ETags never match, so they are left out.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    versions = set()
+    for etag in if_match.split(","):
+        version, _, _ = etag.strip().removeprefix('"').partition("-")
+        if version.isdigit():
+            versions.add(int(version))
+    return versions
+
+
+def make_cache_key(name: str, **params) -> str:
+    """ a key that does not depend on the order of the params """
+    params = {
+        key: value.value if isinstance(value, Enum) else value
+        for key, value in sorted(params.items()) if value is not None
+    }
+    return f"{name}?{urlencode(params)}"
+
+
+class ResponseCache:
+    """
+    Caches serialized responses tagged by the resources they render.
+    Each tag has a random version, which is part of the keys of the entries
+    cached with it. Invalidating a tag drops its version, so the entries made
+    with it are never read again and expire on their own.
+    """
+    def __init__(self, backend: CacheBackend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+
+    async def versioned_key(self, key: str, tags: List[str]) -> str:
+        tag_keys = [f"tag:{tag}" for tag in tags]
+        versions = await self.backend.get_many(tag_keys)
+        for index, version in enumerate(versions):
+            if version is None:
+                versions[index] = version = uuid4().hex.encode()
+                await self.backend.set(tag_keys[index], version, ttl=self.ttl)
+        return f"response:{key}:" + ".".join(version.decode() for version in versions)
+
+    async def get(self, versioned_key: str) -> Union[CachedResponse, None]:
+        data = await self.backend.get(versioned_key)
+        return CachedResponse.loads(data) if data else None
+
+    async def set(self, versioned_key: str, response: CachedResponse):
+        await self.backend.set(versioned_key, response.dumps(), ttl=self.ttl)
+
+    async def invalidate(self, *tags: str):
+        await self.backend.delete(*(f"tag:{tag}" for tag in tags))
@@ -3,4 +3,33 @@ REQUESTS_LIMIT_GET_POSTS = {
     "SECONDS": 10,
 }
 
+REQUESTS_LIMIT_GET_POSTS_AUTHENTICATED = {
+    "TIMES": 20,
+    "SECONDS": 10,
+}
+
+REQUESTS_LIMIT_EXPORT = {
+    "TIMES": 2,
+    "SECONDS": 60,
+}
+
+REQUESTS_LIMIT_ADD_POST = {
+    "TIMES": 20,
+    "SECONDS": 60,
+}
 
+REQUESTS_LIMIT_ADD_COMMENT = {
+    "TIMES": 30,
+    "SECONDS": 60,
+}
+
+# bulk routes count items, not requests: a full batch of BULK_MAX_ITEMS must fit in the window
+REQUESTS_LIMIT_ADD_POSTS_BULK = {
+    "TIMES": 10000,
+    "SECONDS": 60,
+}
+
+REQUESTS_LIMIT_ADD_COMMENTS_BULK = {
+    "TIMES": 10000,
+    "SECONDS": 60,
+}
@@ -1,27 +1,85 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from fastapi import Request
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
 
 from settings import Settings
+from src.db.pool import TimedAsyncQueuePool, instrument_pool, pool_options
+from src.metrics import instrument_queries
+from src.db.replicas import ReplicaSet, WriteTrackingSession, remember_write, wrote_recently
 
 
 settings = Settings()
 
-engine = create_engine(
-    url=settings.DATABASE_URL,
+# async drivers used for each backend when the configured url points to a sync one
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_url(url: str) -> URL:
+    """
+    converts a database url to its async driver equivalent,
+    e.g. postgresql+psycopg2://... becomes postgresql+asyncpg://...
+    """
+    url = make_url(url)
+    drivername = ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)
+    return url.set(drivername=drivername)
+
+
+async_engine = create_async_engine(
+    url=get_async_url(settings.DATABASE_URL),
     echo=settings.DEBUG,
+    **pool_options(get_async_url(settings.DATABASE_URL), "async", TimedAsyncQueuePool),
+)
+instrument_pool(async_engine.sync_engine, "async")
+instrument_queries(async_engine.sync_engine, "async")
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False, sync_session_class=WriteTrackingSession
 )
 
-Session = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+read_replicas = ReplicaSet(
+    urls=[get_async_url(url) for url in settings.READ_DATABASE_URLS],
+    check_interval=settings.READ_REPLICA_CHECK_INTERVAL,
+    check_timeout=settings.READ_REPLICA_CHECK_TIMEOUT,
+)
 
 Base = declarative_base()
 
 
-def get_db() -> Session:
+async def get_async_db(request: Request) -> AsyncSession:
     """
-    initialize a db session instance and close it at the end
+    initialize an async db session instance and close it at the end.
+    Clients that write through it read from the primary for a while, see get_async_read_db
     """
-    db = Session()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+        if db.info.get("wrote"):
+            await remember_write(request)
+
+
+async def get_async_read_db(request: Request) -> AsyncSession:
+    """
+    async db session for the handlers that only read: on a read replica when READ_DATABASE_URLS
+    is set, on the primary when no replica is healthy or the client wrote in the last
+    READ_YOUR_WRITES_SECONDS, so it does not miss its own writes on a lagging replica.
+    Sessions on a replica have info["replica"] set: what they read may miss the latest writes,
+    so it must not be cached under a version that was bumped by those writes
+    """
+    replica = None
+    if len(read_replicas) and not await wrote_recently(request):
+        replica = await read_replicas.choose()
+    session_factory = AsyncSessionLocal if replica is None else replica.sessionmaker
+    async with session_factory() as db:
+        db.info["replica"] = replica is not None
+        yield db
+
+
+def get_async_sessionmaker() -> async_sessionmaker:
+    """
+    the factory of async db sessions, for responses that must open a session of their own,
+    e.g. streams that are still reading after the request dependencies are closed
+    """
+    return AsyncSessionLocal
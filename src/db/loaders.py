@@ -0,0 +1,49 @@
+from functools import lru_cache
+from typing import Tuple, Type, Union, get_args
+
+from pydantic import BaseModel
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, selectinload, raiseload
+from sqlalchemy.orm.interfaces import LoaderOption
+
+
+def get_nested_schema(annotation) -> Union[Type[BaseModel], None]:
+    """
+    returns the pydantic model wrapped by a field annotation,
+    e.g. List[CommentViewSchema] or Union[List[CommentSchema], None]
+    """
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in get_args(annotation):
+        schema = get_nested_schema(arg)
+        if schema is not None:
+            return schema
+    return None
+
+
+@lru_cache
+def loader_options(model, schema: Type[BaseModel], joined: bool = True) -> Tuple[LoaderOption, ...]:
+    """
+    builds the loader options needed to render {schema} from {model} instances.
+    Every relationship the schema renders is eager loaded, recursively, so a query
+    costs a fixed number of statements no matter how many rows it returns:
+    many-to-one relationships are joined in the same statement and collections are
+    loaded with one extra SELECT ... IN per level. Any other relationship raises
+    instead of silently emitting a lazy load.
+    Rows returned by UPDATE ... RETURNING cannot be joined, for them {joined} must be False
+    and the many-to-one relationships of {model} are loaded with a SELECT ... IN as well.
+    """
+    relationships = inspect(model).relationships
+    options = []
+    for name, field in schema.model_fields.items():
+        if name not in relationships:
+            continue
+        relationship = relationships[name]
+        attribute = getattr(model, name)
+        loader = selectinload(attribute) if relationship.uselist or not joined else joinedload(attribute)
+        nested_schema = get_nested_schema(field.annotation)
+        if nested_schema is not None:
+            loader = loader.options(*loader_options(relationship.mapper.class_, nested_schema))
+        options.append(loader)
+    options.append(raiseload("*"))
+    return tuple(options)
@@ -0,0 +1,119 @@
+import time
+from typing import Any, Dict, Type
+from uuid import uuid4
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import Engine, event, exc
+from sqlalchemy.engine import URL
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, Pool, QueuePool
+
+from settings import Settings
+from src.metrics import multiprocess_mode
+
+
+settings = Settings()
+
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a connection from the pool", ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that gave up after waiting DB_POOL_TIMEOUT seconds", ["pool"]
+)
+POOL_INVALIDATIONS = Counter(
+    "db_pool_invalidations_total", "Connections invalidated, e.g. dropped by the server or failing the pre-ping",
+    ["pool"]
+)
+POOL_SIZE = Gauge(
+    "db_pool_size", "Maximum number of persistent connections of the pool", ["pool"], multiprocess_mode="livesum"
+)
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently in use", ["pool"], multiprocess_mode="livesum")
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "Connections open beyond the pool size", ["pool"], multiprocess_mode="livesum"
+)
+
+
+class TimedCheckoutMixin:
+    """ measures how long each checkout waits for a connection to be available """
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.labels(pool=self.logging_name).inc()
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.labels(pool=self.logging_name).observe(time.perf_counter() - started_at)
+
+
+class TimedQueuePool(TimedCheckoutMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pgbouncer_connect_args(url: URL) -> Dict[str, Any]:
+    """
+    PgBouncer in transaction mode may run each transaction on a different server
+    connection, so asyncpg must not cache prepared statements nor reuse their names.
+    psycopg2 does not use server side prepared statements.
+    """
+    if url.get_driver_name() != "asyncpg":
+        return {}
+    return {
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+    }
+
+
+def pool_options(url: URL, name: str, pool_class: Type[Pool]) -> Dict[str, Any]:
+    """
+    the create_engine arguments of the connection pool of {url}, named {name} on the metrics
+    """
+    if settings.DB_PGBOUNCER:
+        # PgBouncer pools the connections, each checkout opens a new client connection to it
+        return {"poolclass": NullPool, "connect_args": pgbouncer_connect_args(url)}
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # every connection to an in memory database sees a different database, keep the default single one
+        return {}
+    return {
+        "poolclass": pool_class,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_logging_name": name,
+    }
+
+
+def instrument_pool(engine: Engine, name: str):
+    """
+    exports the state of the pool of {engine}. The gauges read the pool when scraped,
+    so they follow the new pool when the engine is disposed. In multiprocess mode they
+    are set on every checkout and checkin instead.
+    """
+    def invalidate(dbapi_connection, connection_record, exception):
+        POOL_INVALIDATIONS.labels(pool=name).inc()
+
+    event.listen(engine, "invalidate", invalidate)
+    event.listen(engine, "soft_invalidate", invalidate)
+    if not isinstance(engine.pool, QueuePool):
+        return
+    if multiprocess_mode():
+        # see multiprocess_mode
+        def update(*args):
+            POOL_SIZE.labels(pool=name).set(engine.pool.size())
+            POOL_CHECKED_OUT.labels(pool=name).set(engine.pool.checkedout())
+            POOL_OVERFLOW.labels(pool=name).set(max(engine.pool.overflow(), 0))
+
+        event.listen(engine, "checkout", update)
+        event.listen(engine, "checkin", update)
+        update()
+        return
+    POOL_SIZE.labels(pool=name).set_function(lambda: engine.pool.size())
+    POOL_CHECKED_OUT.labels(pool=name).set_function(lambda: engine.pool.checkedout())
+    POOL_OVERFLOW.labels(pool=name).set_function(lambda: max(engine.pool.overflow(), 0))
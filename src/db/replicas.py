@@ -0,0 +1,131 @@
+import asyncio
+import time
+from hashlib import sha256
+from typing import List, Union
+
+from fastapi import Request
+from sqlalchemy import event, exc, text
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session as OrmSession
+
+from settings import Settings
+from src.cache import CacheBackend, MemoryCacheBackend, RedisCacheBackend
+from src.db.pool import TimedAsyncQueuePool, instrument_pool, pool_options
+from src.metrics import instrument_queries
+from src.redis_client import get_redis
+
+
+settings = Settings()
+
+memory_recent_writes = MemoryCacheBackend(
+    maxsize=settings.READ_YOUR_WRITES_CACHE_SIZE, ttl=settings.READ_YOUR_WRITES_SECONDS
+)
+
+
+class WriteTrackingSession(OrmSession):
+    """ session that sets info["wrote"] once it sends a change to the database """
+
+
+@event.listens_for(WriteTrackingSession, "after_flush")
+def track_flush(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(WriteTrackingSession, "do_orm_execute")
+def track_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+class Replica:
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.sessionmaker = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        self.healthy = True
+        self.checked_at = float("-inf")
+
+
+class ReplicaSet:
+    """
+    Read replicas taken in turns. A replica is checked with a SELECT 1 when it is chosen
+    and its last check is older than {check_interval} seconds, and it is skipped until
+    its next check once it fails one, or takes longer than {check_timeout} seconds.
+    The requests arriving while a replica is checked use the result of its previous check.
+    """
+    def __init__(self, urls: List[URL], check_interval: float, check_timeout: float):
+        self.replicas = []
+        for index, url in enumerate(urls):
+            name = f"replica{index}"
+            engine = create_async_engine(
+                url=url, echo=settings.DEBUG, **pool_options(url, name, TimedAsyncQueuePool)
+            )
+            instrument_pool(engine.sync_engine, name)
+            instrument_queries(engine.sync_engine, name)
+            self.replicas.append(Replica(engine))
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.next_index = 0
+
+    def __len__(self):
+        return len(self.replicas)
+
+    async def check(self, replica: Replica) -> bool:
+        # set first, so the concurrent requests do not start checks of their own
+        replica.checked_at = time.monotonic()
+        try:
+            await asyncio.wait_for(self.select_1(replica), timeout=self.check_timeout)
+            replica.healthy = True
+        except (exc.SQLAlchemyError, OSError, asyncio.TimeoutError):
+            replica.healthy = False
+        return replica.healthy
+
+    @staticmethod
+    async def select_1(replica: Replica):
+        async with replica.engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    async def choose(self) -> Union[Replica, None]:
+        """ the next healthy replica, None when none of them is """
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self.next_index % len(self.replicas)]
+            self.next_index += 1
+            if time.monotonic() - replica.checked_at >= self.check_interval:
+                await self.check(replica)
+            if replica.healthy:
+                return replica
+        return None
+
+
+def client_key(request: Request) -> str:
+    """
+    tells the clients apart without verifying their token: the hash of the
+    Authorization header when they send one, otherwise their address
+    """
+    authorization = request.headers.get("Authorization")
+    if authorization:
+        return "token:" + sha256(authorization.encode()).hexdigest()
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return "ip:" + forwarded.split(",")[0]
+    return "ip:" + request.client.host
+
+
+def get_recent_writes(request: Request) -> CacheBackend:
+    """
+    the clients that wrote to the primary in the last READ_YOUR_WRITES_SECONDS,
+    selected by the READ_YOUR_WRITES_BACKEND setting
+    """
+    if settings.READ_YOUR_WRITES_BACKEND == "redis":
+        return RedisCacheBackend(
+            redis=get_redis(request), prefix="recent-write:", ttl=settings.READ_YOUR_WRITES_SECONDS
+        )
+    return memory_recent_writes
+
+
+async def remember_write(request: Request):
+    await get_recent_writes(request).set(client_key(request), b"1")
+
+
+async def wrote_recently(request: Request) -> bool:
+    return await get_recent_writes(request).get(client_key(request)) is not None
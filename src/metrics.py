@@ -0,0 +1,144 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import List, Tuple, Union
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, multiprocess
+from sqlalchemy import Engine, event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Requests served, by route and status code", ["method", "route", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to serve a request, until the last byte of the response is sent",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5, 10),
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being served", ["method"], multiprocess_mode="livesum"
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Size of the response bodies", ["method", "route"],
+    buckets=(100, 1000, 10_000, 100_000, 1_000_000, 10_000_000),
+)
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "Database queries executed to serve a request", ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+HTTP_REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds", "Time spent on database queries to serve a request", ["method", "route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Time to execute a database query", ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total", "Requests rejected with a 429 by a rate limit", ["limit", "tier"]
+)
+
+
+class QueryStats:
+    """
+    database queries of the request being served, and each statement
+    with its duration when {statements} is a list, see src.profiling
+    """
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Union[List[Tuple[str, float]], None] = None
+
+
+# the context of a request is copied to the threads and greenlets running its queries,
+# so they all add to the same stats
+request_query_stats: ContextVar[Union[QueryStats, None]] = ContextVar("request_query_stats", default=None)
+
+
+def multiprocess_mode() -> bool:
+    """
+    the workers share their metrics through files when PROMETHEUS_MULTIPROC_DIR is set.
+    A worker cannot read the state of the others when scraped then, so the gauges of a state,
+    e.g. the connection pools, are written by each worker as the state changes instead of read
+    with set_function
+    """
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+
+def metrics_registry() -> CollectorRegistry:
+    """ the registry exported on /metrics, adding up the metrics of every worker in multiprocess mode """
+    if not multiprocess_mode():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def mark_process_dead():
+    """ drops the live gauges of the worker, called when it shuts down """
+    if multiprocess_mode():
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def instrument_queries(engine: Engine, name: str):
+    """ times every query executed by {engine}, and adds it to the stats of the current request """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_started_at"].pop()
+        DB_QUERY_DURATION.labels(engine=name).observe(seconds)
+        stats = request_query_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += seconds
+            if stats.statements is not None:
+                stats.statements.append((statement, seconds))
+
+
+class MetricsMiddleware:
+    """
+    records the count, duration, response size and database queries of the requests by route.
+    Routes are labelled by their path template, e.g. /posts/{post_id}, and the requests matching
+    no route as "unmatched", so the number of series does not grow with the urls requested.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status_code = 500
+        response_size = 0
+        stats = QueryStats()
+        token = request_query_stats.set(stats)
+
+        async def send_with_metrics(message: Message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.labels(method=method).inc()
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            duration = time.perf_counter() - started_at
+            request_query_stats.reset(token)
+            HTTP_REQUESTS_IN_PROGRESS.labels(method=method).dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.labels(method=method, route=route, status=status_code).inc()
+            HTTP_REQUEST_DURATION.labels(method=method, route=route).observe(duration)
+            HTTP_RESPONSE_SIZE.labels(method=method, route=route).observe(response_size)
+            HTTP_REQUEST_DB_QUERIES.labels(method=method, route=route).observe(stats.count)
+            HTTP_REQUEST_DB_DURATION.labels(method=method, route=route).observe(stats.seconds)
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Union
+
+import orjson
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from settings import Settings
+from src.metrics import QueryStats, request_query_stats
+
+
+settings = Settings()
+
+PROFILE_HEADER = "X-Profile"
+
+
+def sign_profile_header(seconds: int = 300) -> str:
+    """ a value of the X-Profile header, valid for {seconds}, that makes the app profile a request """
+    expires_at = str(int(time.time()) + seconds)
+    signature = hmac.new(settings.SECRET_KEY.encode(), expires_at.encode(), hashlib.sha256).hexdigest()
+    return f"{expires_at}.{signature}"
+
+
+def verify_profile_header(value: Union[str, None]) -> bool:
+    if not value:
+        return False
+    expires_at, _, signature = value.partition(".")
+    expected = hmac.new(settings.SECRET_KEY.encode(), expires_at.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        return False
+    return expires_at.isdigit() and int(expires_at) > time.time()
+
+
+def folded_stack(frame) -> str:
+    """ the stack of {frame} in the folded format of flamegraph.pl and speedscope, the outermost call first """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stack of a thread every {interval} seconds, counting how many times each stack is seen.
+    Only the sampled thread is seen: code run on the thread pool, e.g. password hashing, shows up as
+    the event loop waiting for it.
+    """
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[folded_stack(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests when PROFILING_ENABLED is set, or when they carry an X-Profile header
+    signed by sign_profile_header. The requests slower than PROFILING_THRESHOLD_MS are saved to
+    PROFILING_DIR: the sampled stacks to a .folded file, e.g. for flamegraph.pl or speedscope, and
+    the SQL statements executed, with their timings, to a .json file.
+    Other requests only pay for looking up the header.
+    The event loop runs other requests in between, so their code may show up in the samples too.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not (
+                settings.PROFILING_ENABLED or verify_profile_header(Headers(scope=scope).get(PROFILE_HEADER))):
+            return await self.app(scope, receive, send)
+
+        stats = request_query_stats.get()
+        token = None
+        if stats is None:
+            stats = QueryStats()
+            token = request_query_stats.set(stats)
+        stats.statements = []
+        sampler = StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL_MS / 1000)
+        started_at = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            duration = time.perf_counter() - started_at
+            if token is not None:
+                request_query_stats.reset(token)
+            # joining the sampler and writing the files would block the other requests of the worker
+            await asyncio.to_thread(sampler.stop)
+            if duration * 1000 >= settings.PROFILING_THRESHOLD_MS:
+                await asyncio.to_thread(save_profile, scope, duration, sampler.stacks, stats)
+
+
+def save_profile(scope: Scope, duration: float, stacks: Counter, stats: QueryStats):
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    saved_at = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    path = scope["path"].strip("/").replace("/", "_") or "root"
+    name = os.path.join(settings.PROFILING_DIR, f"{saved_at}-{scope['method']}-{path}")
+    with open(f"{name}.folded", "w") as folded:
+        folded.writelines(f"{stack} {count}\n" for stack, count in stacks.items())
+    with open(f"{name}.json", "wb") as breakdown:
+        breakdown.write(orjson.dumps({
+            "method": scope["method"],
+            "path": scope["path"],
+            "query_string": scope["query_string"].decode(),
+            "duration_ms": round(duration * 1000, 3),
+            "sql_count": stats.count,
+            "sql_ms": round(stats.seconds * 1000, 3),
+            "statements": [
+                {"statement": statement, "duration_ms": round(seconds * 1000, 3)}
+                for statement, seconds in stats.statements
+            ],
+        }, option=orjson.OPT_INDENT_2))
@@ -0,0 +1,100 @@
+import time
+
+from fastapi import Request
+from prometheus_client import Counter, Gauge, Histogram
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.exceptions import ConnectionError
+
+from settings import Settings
+from src.metrics import multiprocess_mode
+
+
+settings = Settings()
+
+REDIS_POOL_WAIT = Histogram(
+    "redis_pool_wait_seconds", "Time to get a connection from the redis pool, opening it included",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REDIS_POOL_TIMEOUTS = Counter(
+    "redis_pool_timeouts_total", "Commands that gave up after waiting REDIS_POOL_TIMEOUT seconds for a connection"
+)
+REDIS_POOL_MAX_CONNECTIONS = Gauge(
+    "redis_pool_max_connections", "Maximum number of connections of the redis pool", multiprocess_mode="livesum"
+)
+REDIS_POOL_CONNECTIONS = Gauge(
+    "redis_pool_connections", "Connections opened by the redis pool", multiprocess_mode="livesum"
+)
+REDIS_POOL_IN_USE = Gauge("redis_pool_in_use", "Redis connections currently in use", multiprocess_mode="livesum")
+
+# raised by BlockingConnectionPool when no connection was released within its timeout
+NO_CONNECTION_AVAILABLE = "No connection available."
+
+
+class TimedBlockingConnectionPool(BlockingConnectionPool):
+    """
+    Pool of at most {max_connections} connections: a command waits for one to be released
+    when they are all in use, so the connections to redis stay bounded under load.
+    Measures the waits and counts the connections in use.
+    """
+    def reset(self):
+        super().reset()
+        self.in_use = set()
+
+    async def get_connection(self, command_name, *keys, **options):
+        started_at = time.perf_counter()
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+        except ConnectionError as error:
+            if str(error) == NO_CONNECTION_AVAILABLE:
+                REDIS_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            REDIS_POOL_WAIT.observe(time.perf_counter() - started_at)
+        self.in_use.add(connection)
+        self.update_metrics()
+        return connection
+
+    async def release(self, connection):
+        self.in_use.discard(connection)
+        await super().release(connection)
+        self.update_metrics()
+
+    def update_metrics(self):
+        # written on every change in multiprocess mode only, see multiprocess_mode
+        if multiprocess_mode():
+            REDIS_POOL_MAX_CONNECTIONS.set(self.max_connections)
+            REDIS_POOL_CONNECTIONS.set(len(self._connections))
+            REDIS_POOL_IN_USE.set(len(self.in_use))
+
+
+def create_redis(url: str) -> Redis:
+    """
+    the redis client shared by everything in the app, see get_redis. It connects on its
+    first command, and its pool must be closed with close_redis
+    """
+    pool = TimedBlockingConnectionPool.from_url(
+        url,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        encoding="utf-8",
+    )
+    if multiprocess_mode():
+        pool.update_metrics()
+    else:
+        REDIS_POOL_MAX_CONNECTIONS.set_function(lambda: pool.max_connections)
+        REDIS_POOL_CONNECTIONS.set_function(lambda: len(pool._connections))
+        REDIS_POOL_IN_USE.set_function(lambda: len(pool.in_use))
+    return Redis(connection_pool=pool)
+
+
+async def close_redis(redis: Redis):
+    """ closes the client and every connection of its pool """
+    await redis.close(close_connection_pool=True)
+
+
+def get_redis(request: Request) -> Redis:
+    """ the redis client of the app, created by src.requests_limit.lifespan """
+    return request.app.state.redis
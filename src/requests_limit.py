@@ -1,38 +1,429 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
 from math import ceil
+from typing import Any, Dict, List, Tuple, Union
+from uuid import uuid4
 
 import redis.asyncio as redis
 from contextlib import asynccontextmanager
+from redis.commands.core import AsyncScript
+from redis.exceptions import NoScriptError, RedisError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from settings import Settings
-from fastapi import FastAPI, Request, Response, HTTPException, status
-from fastapi_limiter import FastAPILimiter
+from fastapi import Depends, FastAPI, Request, HTTPException, status
+from src.authentication.oauth2 import get_token_data
+from src.authentication.schemas import TokenData
+from src.cache import TTLCache
+from src.metrics import RATE_LIMIT_REJECTIONS, mark_process_dead
+from src.redis_client import close_redis, create_redis
 
 
 settings = Settings()
 
+logger = logging.getLogger(__name__)
 
-async def custom_callback(_: Request, __: Response, expire: int):
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    # milliseconds until a request is allowed again when it was not,
+    # otherwise until the quota is fully available again
+    reset_ms: int
+    # the cost of the request is over the limit, it is never allowed however long the client waits
+    too_large: bool = False
+
+
+def too_large(limit: int) -> RateLimitResult:
+    """ the result of a request costing more than {limit}, the quota is not looked up nor spent """
+    return RateLimitResult(allowed=False, limit=limit, remaining=limit, reset_ms=0, too_large=True)
+
+
+class MemoryRateLimiter:
+    """
+    Token bucket of each key, kept in the memory of the worker. A bucket holds up to
+    {limit} tokens and gets them back at {limit} per window, so bursts are allowed as long
+    as the average rate is respected. Limits are per worker: with N workers a client gets
+    up to N times the limit.
+    """
+    def __init__(self, maxsize: int):
+        # a bucket left alone for a whole window is full again, so it expires along with the window
+        self.buckets = TTLCache(maxsize=maxsize, ttl=0)
+
+    async def hit(self, key: str, limit: int, window_ms: int, cost: int = 1) -> RateLimitResult:
+        if cost > limit:
+            return too_large(limit)
+        now = time.monotonic()
+        rate = limit / window_ms
+        tokens, updated_at = self.buckets.get(key, (limit, now))
+        tokens = min(limit, tokens + (now - updated_at) * 1000 * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self.buckets.set(key, (tokens, now), ttl=window_ms / 1000)
+        if allowed:
+            reset_ms = (limit - tokens) / rate
+        else:
+            reset_ms = (cost - tokens) / rate
+        return RateLimitResult(allowed=allowed, limit=limit, remaining=int(tokens), reset_ms=ceil(reset_ms))
+
+
+class ScriptBatch:
+    """
+    Runs the calls of a lua script made by concurrent requests together: the calls made while
+    a batch is in flight wait for it, then go to redis in one pipeline of up to {max_size} calls.
+    A worker makes one round trip at a time per script, however many requests it serves.
+    The script must be loaded, see load_script, it is loaded again when redis lost it.
+    """
+    def __init__(self, script: AsyncScript, max_size: int):
+        self.script = script
+        self.max_size = max_size
+        self.queue: List[Tuple[list, list, asyncio.Future]] = []
+        self.flushing: Union[asyncio.Task, None] = None
+
+    async def __call__(self, keys: list, args: list) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((keys, args, future))
+        if self.flushing is None:
+            # runs once the requests of this iteration of the loop have queued their calls too
+            self.flushing = asyncio.create_task(self.flush())
+        return await future
+
+    async def flush(self):
+        batch = []
+        try:
+            while self.queue:
+                batch, self.queue = self.queue[:self.max_size], self.queue[self.max_size:]
+                try:
+                    results = await self.execute(batch)
+                except RedisError as error:
+                    results = [error] * len(batch)
+                for (_, _, future), result in zip(batch, results):
+                    if future.done():
+                        # the request was cancelled
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        except BaseException as error:
+            # the calls in flight and the queued ones would wait forever, no other flush is coming for them
+            for _, _, future in batch + self.queue:
+                if not future.done():
+                    future.set_exception(error)
+            self.queue = []
+            if not isinstance(error, Exception):
+                # e.g. the task was cancelled
+                raise
+        finally:
+            self.flushing = None
+
+    async def execute(self, batch: List[Tuple[list, list, asyncio.Future]]) -> list:
+        """ the result of each call, or its error """
+        for _ in range(2):
+            pipeline = self.script.registered_client.pipeline(transaction=False)
+            for keys, args, _ in batch:
+                pipeline.evalsha(self.script.sha, len(keys), *keys, *args)
+            results = await pipeline.execute(raise_on_error=False)
+            if not any(isinstance(result, NoScriptError) for result in results):
+                break
+            # redis was restarted or its scripts flushed
+            self.script.sha = await self.script.registered_client.script_load(self.script.script)
+        return results
+
+
+class RedisRateLimiter:
+    """
+    Sliding window log shared by every worker: a sorted set per key holds the time of each
+    request of the last window, and a lua script checks and records a request atomically.
+    The calls of concurrent requests are sent together, see ScriptBatch. Once a key is rejected,
+    the worker keeps rejecting it without asking redis until a request is allowed again.
+    While redis cannot be reached, the worker limits the requests on its own, see MemoryRateLimiter.
+    """
+    lua_script = """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local member = ARGV[3]
+local cost = tonumber(ARGV[4])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+
+redis.call("ZREMRANGEBYSCORE", key, "-inf", now - window)
+local count = redis.call("ZCARD", key)
+local allowed = 0
+if count + cost <= limit then
+    for i = 1, cost do
+        redis.call("ZADD", key, now, member .. ":" .. i)
+    end
+    redis.call("PEXPIRE", key, window)
+    count = count + cost
+    allowed = 1
+end
+local oldest = redis.call("ZRANGE", key, 0, 0, "WITHSCORES")
+local reset = window
+if oldest[2] then
+    reset = tonumber(oldest[2]) + window - now
+end
+return {allowed, limit - count, reset}
+"""
+
+    def __init__(self, redis_conn: redis.Redis, prefix: str, maxsize: int, batch_size: int):
+        self.prefix = prefix
+        self.script = redis_conn.register_script(self.lua_script)
+        self.batch = ScriptBatch(self.script, max_size=batch_size)
+        # key: time.monotonic() at which the key is allowed again
+        self.rejected = TTLCache(maxsize=maxsize, ttl=0)
+        self.fallback = MemoryRateLimiter(maxsize=maxsize)
+        self.redis_down = False
+
+    async def hit(self, key: str, limit: int, window_ms: int, cost: int = 1) -> RateLimitResult:
+        if cost > limit:
+            return too_large(limit)
+        allowed_at = self.rejected.get(key)
+        if allowed_at is not None:
+            reset_ms = ceil((allowed_at - time.monotonic()) * 1000)
+            return RateLimitResult(allowed=False, limit=limit, remaining=0, reset_ms=max(reset_ms, 1))
+        try:
+            allowed, remaining, reset_ms = await self.batch(
+                keys=[f"{self.prefix}:{key}"], args=[limit, window_ms, uuid4().hex, cost]
+            )
+        except RedisError as error:
+            if not self.redis_down:
+                logger.warning("rate limits checked by this worker alone, redis cannot be reached: %s", error)
+                self.redis_down = True
+            return await self.fallback.hit(key, limit=limit, window_ms=window_ms, cost=cost)
+        if self.redis_down:
+            logger.warning("rate limits checked in redis again")
+            self.redis_down = False
+        if not allowed and remaining <= 0:
+            # a smaller request may still fit when the quota is not spent, e.g. after a rejected batch
+            self.rejected.set(key, time.monotonic() + reset_ms / 1000, ttl=reset_ms / 1000)
+        return RateLimitResult(allowed=bool(allowed), limit=limit, remaining=remaining, reset_ms=reset_ms)
+
+    async def load_script(self):
+        """ loads the script up front, so the first requests do not get a NOSCRIPT error and retry """
+        self.script.sha = await self.script.registered_client.script_load(self.lua_script)
+
+
+class HybridRateLimiter:
+    """
+    Fixed windows counted by each worker and added up in redis every {sync_interval_ms}.
+    Requests are checked against the last known total plus the requests the worker has
+    not synced yet, so most of them cost no round trip to redis and clients already over
+    the limit are rejected locally. Between syncs the limit may be exceeded by the requests
+    the other workers let through.
     """
-    default callback for handle too many requests
-    :param _: a Request object
-    :param __: a Response object
-    :param expire: the remaining time in milliseconds
-    :return:
+    lua_script = """
+local total = redis.call("INCRBY", KEYS[1], ARGV[1])
+redis.call("PEXPIRE", KEYS[1], ARGV[2])
+return total
+"""
+
+    def __init__(self, redis_conn: redis.Redis, prefix: str, maxsize: int, sync_interval_ms: int, batch_size: int):
+        self.script = redis_conn.register_script(self.lua_script)
+        self.batch = ScriptBatch(self.script, max_size=batch_size)
+        self.prefix = prefix
+        self.sync_interval = sync_interval_ms / 1000
+        # key: (window number, total synced, requests not synced yet, last sync time)
+        self.windows = TTLCache(maxsize=maxsize, ttl=0)
+
+    async def hit(self, key: str, limit: int, window_ms: int, cost: int = 1) -> RateLimitResult:
+        now = time.time()
+        window = int(now * 1000 // window_ms)
+        reset_ms = ceil((window + 1) * window_ms - now * 1000)
+        if cost > limit:
+            return too_large(limit)
+        number, synced, pending, synced_at = self.windows.get(key, (window, 0, 0, 0.0))
+        if number != window:
+            synced, pending, synced_at = 0, 0, 0.0
+        if synced + pending + cost > limit:
+            self.windows.set(key, (window, synced, pending, synced_at), ttl=reset_ms / 1000)
+            return RateLimitResult(allowed=False, limit=limit, remaining=0, reset_ms=reset_ms)
+
+        pending += cost
+        if now - synced_at >= self.sync_interval:
+            try:
+                synced = await self.sync(f"{self.prefix}:{key}:{window}", pending, reset_ms)
+                pending, synced_at = 0, now
+            except RedisError:
+                # keep counting locally until redis is back
+                pass
+        self.windows.set(key, (window, synced, pending, synced_at), ttl=reset_ms / 1000)
+        allowed = synced + pending <= limit
+        remaining = max(limit - synced - pending, 0)
+        return RateLimitResult(allowed=allowed, limit=limit, remaining=remaining, reset_ms=reset_ms)
+
+    async def sync(self, key: str, requests: int, expire_ms: int) -> int:
+        """ adds the requests of the worker to the total of the window, returns the new total """
+        return await self.batch(keys=[key], args=[requests, expire_ms])
+
+    async def load_script(self):
+        """ loads the script up front, so the first syncs do not get a NOSCRIPT error and retry """
+        self.script.sha = await self.script.registered_client.script_load(self.lua_script)
+
+
+RateLimiterBackend = Union[MemoryRateLimiter, RedisRateLimiter, HybridRateLimiter]
+
+
+def get_rate_limiter(redis_conn: redis.Redis) -> Union[RateLimiterBackend, None]:
+    """ the rate limiter selected by the RATE_LIMIT_BACKEND setting """
+    if settings.RATE_LIMIT_BACKEND == "memory":
+        return MemoryRateLimiter(maxsize=settings.RATE_LIMIT_CACHE_SIZE)
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimiter(
+            redis_conn=redis_conn,
+            prefix="rate-limit",
+            maxsize=settings.RATE_LIMIT_CACHE_SIZE,
+            batch_size=settings.RATE_LIMIT_BATCH_SIZE,
+        )
+    if settings.RATE_LIMIT_BACKEND == "hybrid":
+        return HybridRateLimiter(
+            redis_conn=redis_conn,
+            prefix="rate-limit",
+            maxsize=settings.RATE_LIMIT_CACHE_SIZE,
+            sync_interval_ms=settings.RATE_LIMIT_SYNC_INTERVAL_MS,
+            batch_size=settings.RATE_LIMIT_BATCH_SIZE,
+        )
+    return None
+
+
+def client_identifier(request: Request, token_data: Union[TokenData, None]) -> str:
+    """
+    the subject of the token of an authenticated client, otherwise its address, so the users
+    behind a shared address do not take each other's quota
+    """
+    if token_data is not None:
+        return f"user:{token_data.email}"
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return f"ip:{forwarded.split(',')[0]}"
+    return f"ip:{request.client.host}"
+
+
+def rate_limit_headers(times: int, seconds: int, result: RateLimitResult) -> Dict[str, str]:
+    """ the RateLimit-* headers of the IETF draft, describing the quota of the client on the route """
+    return {
+        "RateLimit-Limit": str(result.limit),
+        "RateLimit-Remaining": str(result.remaining),
+        "RateLimit-Reset": str(ceil(result.reset_ms / 1000)),
+        "RateLimit-Policy": f"{times};w={seconds}",
+    }
+
+
+class RateLimit:
     """
-    expire = ceil(expire / 1000)
-    raise HTTPException(
-        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-        detail=f"Too many requests. Try again in {expire} seconds",
-        headers={"Retry-After": f"{expire} seconds"}
-    )
+    Dependency limiting the requests of each client to {times} every {seconds}, e.g. a client
+    may get each post 5 times every 10 seconds. Clients are told apart by their user when they
+    send a valid token and by their address otherwise, and authenticated clients get the
+    {authenticated} quota, the {anonymous} one when it is not given.
+    Each path has its own quota unless {per_path} is False, then the quota covers the whole route.
+    When {per_item} is set, a request whose body is a list spends one unit per item, and a list
+    longer than the limit is rejected with a 413, since waiting would not let it through.
+    The defaults can be overridden by the RATE_LIMITS setting under the limit {name}, and
+    {name}:authenticated for authenticated clients,
+    e.g. RATE_LIMITS='{"list_posts": {"TIMES": 100, "SECONDS": 60}}'.
+    """
+    def __init__(
+            self,
+            name: str,
+            anonymous: Dict[str, int],
+            authenticated: Union[Dict[str, int], None] = None,
+            per_path: bool = True,
+            per_item: bool = False):
+        self.name = name
+        self.per_path = per_path
+        self.per_item = per_item
+        anonymous = {**anonymous, **settings.RATE_LIMITS.get(name, {})}
+        authenticated = {**(authenticated or anonymous), **settings.RATE_LIMITS.get(f"{name}:authenticated", {})}
+        self.times, self.seconds = anonymous["TIMES"], anonymous["SECONDS"]
+        self.authenticated_times, self.authenticated_seconds = authenticated["TIMES"], authenticated["SECONDS"]
+
+    async def __call__(self, request: Request, token_data: Union[TokenData, None] = Depends(get_token_data)):
+        limiter: Union[RateLimiterBackend, None] = request.app.state.rate_limiter
+        if limiter is None:
+            return
+        if token_data is None:
+            times, seconds = self.times, self.seconds
+        else:
+            times, seconds = self.authenticated_times, self.authenticated_seconds
+        key = f"{self.name}:{client_identifier(request, token_data)}"
+        if self.per_path:
+            key = f"{key}:{request.scope['path']}"
+        cost = 1
+        if self.per_item:
+            try:
+                # FastAPI already read the body, request.json() parses it again or returns it
+                body = await request.json()
+            except ValueError:
+                # an empty or malformed body, the validation of the body rejects it with a 422
+                body = None
+            if isinstance(body, list) and len(body) <= settings.BULK_MAX_ITEMS:
+                # longer lists are rejected by the validation of the body, which runs after the rate
+                # limits, so they spend a single unit
+                cost = max(len(body), 1)
+        result = await limiter.hit(key, limit=times, window_ms=seconds * 1000, cost=cost)
+        tier = "anonymous" if token_data is None else "authenticated"
+        if result.too_large:
+            RATE_LIMIT_REJECTIONS.labels(limit=self.name, tier=tier).inc()
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"The request counts as {cost} requests, over the limit of {times} every {seconds} seconds",
+                headers={"RateLimit-Policy": f"{times};w={seconds}"},
+            )
+        headers = rate_limit_headers(times, seconds, result)
+        if not result.allowed:
+            RATE_LIMIT_REJECTIONS.labels(limit=self.name, tier=tier).inc()
+            expire = ceil(result.reset_ms / 1000)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"Too many requests. Try again in {expire} seconds",
+                headers={"Retry-After": f"{expire} seconds", **headers}
+            )
+        request.state.rate_limit_headers = headers
+
+
+class RateLimitHeadersMiddleware:
+    """
+    adds the RateLimit-* headers set by the RateLimit dependency to the response,
+    including the responses the endpoints build on their own
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                headers = scope.get("state", {}).get("rate_limit_headers")
+                if headers:
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        *((name.lower().encode(), value.encode()) for name, value in headers.items()),
+                    ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
 
 
 @asynccontextmanager
-async def lifespan(_: FastAPI):
-    redis_conn = redis.from_url(settings.REDIS_URL, encoding="utf-8")
-    await FastAPILimiter.init(
-        redis=redis_conn,
-        http_callback=custom_callback
-    )
+async def lifespan(app: FastAPI):
+    # the client connects on its first command, the app starts even if redis is not used
+    redis_conn = create_redis(settings.REDIS_URL)
+    app.state.redis = redis_conn
+    app.state.rate_limiter = rate_limiter = get_rate_limiter(redis_conn)
+    if isinstance(rate_limiter, (RedisRateLimiter, HybridRateLimiter)):
+        try:
+            await rate_limiter.load_script()
+        except RedisError:
+            # redis is down, the script is loaded by the first request once it is back
+            pass
     yield
-    await FastAPILimiter.close()
+    await close_redis(redis_conn)
+    mark_process_dead()
@@ -1,24 +1,40 @@
+import os
+import tempfile
+
 import pytest
 
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine, StaticPool
+from sqlalchemy import create_engine, NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 
 from app import app
-from src.db.connection import get_db, Base
+from src.authentication.cache import memory_user_cache
+from src.blog.cache import memory_response_cache
+from src.db.connection import get_async_db, get_async_read_db, get_async_sessionmaker, Base
+from src.metrics import instrument_queries
 
 
-DATABASE_URL = "sqlite:///:memory:"
+# the sync session seeds the database in the tests while the app uses the async one,
+# so both engines must point to the same file instead of an in memory database,
+# in a directory removed at the end of the session
+DATABASE_DIRECTORY = tempfile.TemporaryDirectory()
+DATABASE_PATH = os.path.join(DATABASE_DIRECTORY.name, "test.db")
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
 
 engine = create_engine(
     DATABASE_URL,
-    poolclass=StaticPool,
     connect_args={
         "check_same_thread": False
     },
 )
 TestingSession = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+instrument_queries(async_engine.sync_engine, "async")
+AsyncTestingSession = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 
 def override_get_db():
     db = TestingSession()
@@ -28,11 +44,41 @@ def override_get_db():
         db.close()
 
 
-app.dependency_overrides[get_db] = override_get_db
+async def override_get_async_db():
+    async with AsyncTestingSession() as db:
+        yield db
+
+
+def override_get_async_sessionmaker():
+    return AsyncTestingSession
+
+
+app.dependency_overrides[get_async_db] = override_get_async_db
+app.dependency_overrides[get_async_read_db] = override_get_async_db
+app.dependency_overrides[get_async_sessionmaker] = override_get_async_sessionmaker
 Base.metadata.create_all(bind=engine)
 
 
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: takes long or a lot of disk, deselect it with -m 'not slow'")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    engine.dispose()
+    DATABASE_DIRECTORY.cleanup()
+
+
 @pytest.fixture(scope="module")
 def client():
     with TestClient(app=app) as c:
         yield c
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """
+    the tests write to the database behind the app's back,
+    so nothing cached by a previous test may be served
+    """
+    memory_user_cache.cache.clear()
+    memory_response_cache.backend.cache.clear()
@@ -2,3 +2,102 @@
 #     response = client.get('/auth/login')
 #     breakpoint()
 #     assert response.status_code == 200
+
+import asyncio
+import time
+from datetime import timedelta
+from hashlib import sha256
+
+from passlib.context import CryptContext
+
+from src.authentication.cache import memory_user_cache, token_cache, verify_cached_access_token
+from src.authentication.hashing import pwd_context
+from src.authentication.models import User
+from src.authentication.schemas import UserViewSchema
+from src.authentication.token import create_access_token
+from tests.conftest import override_get_db
+
+
+def test_add_user(client):
+    """
+    given a new user's data
+    when a client posts it to /auth/users
+    then the user must be created with a hashed password that can be verified
+    """
+    data = {"name": "new", "username": "new", "email": "new@example.com", "password": "secret"}
+    response = client.post("/auth/users", json=data)
+    assert response.status_code == 201
+    assert "password" not in response.json()
+    db = next(override_get_db())
+    user = db.query(User).filter(User.email == "new@example.com").first()
+    assert user.password != "secret"
+    assert user.check_password("secret")
+
+
+def test_rehash_password_on_login(client):
+    """
+    given a user whose password was hashed with another bcrypt cost factor
+    when the user logs in
+    then the stored hash must be replaced by one with the current cost factor
+    """
+    old_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+    db = next(override_get_db())
+    user = User(name="old", username="old", email="old@example.com", password=old_context.hash("secret"))
+    db.add(user)
+    db.commit()
+    assert pwd_context.needs_update(user.password)
+
+    response = client.post("/auth/access-token", data={"username": "old@example.com", "password": "secret"})
+    assert response.status_code == 201
+    db.refresh(user)
+    assert not pwd_context.needs_update(user.password)
+    assert user.check_password("secret")
+
+
+def test_login_with_invalid_password(client):
+    """
+    given an existing user
+    when it tries to log in with a wrong password
+    then the api should respond with a 401
+    """
+    response = client.post("/auth/access-token", data={"username": "new@example.com", "password": "wrong"})
+    assert response.status_code == 401
+
+
+def test_current_user_cache_invalidation(client):
+    """
+    given an authenticated user whose record is cached
+    when the user updates or deletes its account
+    then the cached record must be dropped
+    """
+    data = {"name": "cached", "username": "cached", "email": "cached@example.com", "password": "secret"}
+    assert client.post("/auth/users", json=data).status_code == 201
+    response = client.post("/auth/access-token", data={"username": "cached@example.com", "password": "secret"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    assert client.get("/auth/users", headers=headers).status_code == 200
+    assert memory_user_cache.cache.get("cached@example.com") is not None
+
+    update_ = {"name": "cached again", "username": "cached", "email": "cached@example.com"}
+    assert client.put("/auth/users", json=update_, headers=headers).status_code == 200
+    assert memory_user_cache.cache.get("cached@example.com") is None
+
+    assert client.get("/auth/users", headers=headers).status_code == 200
+    assert UserViewSchema.model_validate_json(memory_user_cache.cache.get("cached@example.com")).name == "cached again"
+
+    assert client.delete("/auth/users", headers=headers).status_code == 204
+    assert memory_user_cache.cache.get("cached@example.com") is None
+
+
+def test_token_cache(client):
+    """
+    given a verified token
+    when it is verified again
+    then the cached claims must be used, and they must not outlive the token
+    """
+    token = create_access_token(data={"sub": "someone@example.com"}, expires_delta=timedelta(minutes=1))
+    assert asyncio.run(verify_cached_access_token(token)).email == "someone@example.com"
+    key = sha256(token.encode()).digest()
+    assert token_cache.get(key).email == "someone@example.com"
+    expires_at, _ = token_cache._data[key]
+    assert expires_at <= time.monotonic() + 60
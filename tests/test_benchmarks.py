@@ -0,0 +1,43 @@
+from benchmarks.baseline import compare
+
+BASELINE = {
+    "settings": {"requests": 1000},
+    "endpoints": {"get_post": {"errors": 0, "requests": 1000, "requests_per_second": 100.0, "p99_ms": 50.0}},
+    "microbenchmarks": {"verify_access_token": {"median_us": 60.0}},
+}
+
+
+def test_compare_within_tolerance():
+    """
+    given benchmark results that moved less than the tolerance from the baseline
+    when they are compared
+    then no regression must be reported
+    """
+    results = {
+        "settings": {"requests": 1000},
+        "endpoints": {"get_post": {"errors": 0, "requests": 1000, "requests_per_second": 90.0, "p99_ms": 55.0}},
+        "microbenchmarks": {"verify_access_token": {"median_us": 40.0}, "new_benchmark": {"median_us": 1.0}},
+    }
+    assert compare(results, BASELINE, tolerance=0.25) == []
+
+
+def test_compare_reports_regressions():
+    """
+    given benchmark results with a slower latency, a lower throughput and new errors
+    when they are compared with the baseline
+    then each of them must be reported, but not the request counts
+    """
+    results = {
+        "settings": {"requests": 2000},
+        "endpoints": {"get_post": {"errors": 3, "requests": 2000, "requests_per_second": 70.0, "p99_ms": 50.0}},
+        "microbenchmarks": {"verify_access_token": {"median_us": 90.0}},
+    }
+    regressions = compare(results, BASELINE, tolerance=0.25)
+    assert [regression["metric"] for regression in regressions] == [
+        "endpoints.get_post.errors",
+        "endpoints.get_post.requests_per_second",
+        "microbenchmarks.verify_access_token.median_us",
+    ]
+    assert regressions[2] == {
+        "metric": "microbenchmarks.verify_access_token.median_us", "baseline": 60.0, "value": 90.0, "change": 0.5,
+    }
@@ -2,10 +2,16 @@ from typing import List, Dict, cast
 
 import pytest
 
+from settings import Settings
 from src.blog.models import Post, Comment
+from src.blog.utils import encode_cursor
 from src.authentication.models import User
 from tests.conftest import override_get_db
 
+# GET /posts is rate limited by client ip, so the pagination tests use their own
+# addresses instead of spending the quota checked in tests/test_requests_limits.py
+FORWARDED_FOR = [{"X-Forwarded-For": f"10.0.1.{i}"} for i in range(6)]
+
 
 @pytest.fixture(scope="module")
 def test_users() -> List[Dict[str, str]]:
@@ -223,3 +229,354 @@ def test_delete_comment(client, access_token):
     response = client.delete(f"/comments/{comment.id}", headers={"Authorization": f"Bearer {access_token}"})
     assert response.status_code == 204
     assert db.query(Comment).filter(cast("ColumnElement[bool]", Comment.id == comment.id)).all() == []
+
+
+def test_list_posts_limit(client):
+    """
+    given more saved posts than the requested limit
+    when a client lists the posts
+    then the api should respond with at most "limit" posts and link the next page
+    """
+    db = next(override_get_db())
+    db.add_all([Post(title=f"paginated {i}", body="body", user_id=1) for i in range(25)])
+    db.commit()
+    response = client.get("/posts", params={"limit": 10}, headers=FORWARDED_FOR[0])
+    assert response.status_code == 200
+    assert len(response.json()) == 10
+    assert 'rel="next"' in response.headers["Link"]
+    assert "after=" in response.headers["Link"]
+
+
+def test_list_posts_cursor(client):
+    """
+    given saved posts
+    when a client follows the cursors of the post list
+    then it must get every post once, ordered by id descending
+    """
+    db = next(override_get_db())
+    db.add_all([Post(title=f"cursor {i}", body="body", user_id=1) for i in range(25)])
+    db.commit()
+    expected = [post.id for post in db.query(Post).order_by(Post.id.desc()).all()]
+    assert len(expected) <= 200
+
+    ids, params = [], {"limit": 50, "envelope": True}
+    while True:
+        response = client.get("/posts", params=params, headers=FORWARDED_FOR[1])
+        assert response.status_code == 200
+        data = response.json()
+        ids.extend(post["id"] for post in data["items"])
+        if data["next_cursor"] is None:
+            break
+        params["after"] = data["next_cursor"]
+    assert ids == expected
+    assert "Link" not in response.headers
+
+
+def test_list_comments_pagination(client, access_token):
+    """
+    given a post with 15 comments
+    when an authenticated user lists them 10 by 10
+    then it must get 10 comments, and the remaining 5 through the cursor of the first page
+    """
+    db = next(override_get_db())
+    post = Post(title="title", body="body", user_id=1)
+    post.comments = [Comment(body=f"Comment {i}", user_id=1) for i in range(15)]
+    db.add(post)
+    db.commit()
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = client.get(f"/comments/{post.id}", params={"limit": 10, "envelope": True}, headers=headers)
+    assert response.status_code == 200
+    first_page = response.json()
+    assert [c["body"] for c in first_page["items"]] == [f"Comment {i}" for i in range(10)]
+
+    params = {"limit": 10, "after": first_page["next_cursor"]}
+    response = client.get(f"/comments/{post.id}", params=params, headers=headers)
+    assert response.status_code == 200
+    assert [c["body"] for c in response.json()] == [f"Comment {i}" for i in range(10, 15)]
+    assert "Link" not in response.headers
+
+    response = client.get(f"/comments/{post.id}", params={"limit": 10, "page": 2}, headers=headers)
+    assert [c["body"] for c in response.json()] == [f"Comment {i}" for i in range(10, 15)]
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", encode_cursor(2 ** 63), encode_cursor(-2 ** 63 - 1)])
+def test_invalid_cursor(client, cursor):
+    """
+    given a cursor that was not issued by the api, or one pointing to an id out of the 64 bit range
+    when a client lists the posts after it
+    then the api should respond with a 400
+    """
+    response = client.get("/posts", params={"after": cursor}, headers=FORWARDED_FOR[2])
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_search_posts(client, access_token):
+    """
+    given posts mentioning a word in the title or only in the body
+    when a client searches for that word
+    then the api should respond with the matching posts, title matches first
+    """
+    db = next(override_get_db())
+    owner = db.query(User).filter(cast("ColumnElement[bool]", User.email == "test1@example.com")).first()
+    body_match = Post(title="unrelated", body="a post about the axolotl habitat", creator=owner)
+    title_match = Post(title="Axolotl care", body="water temperature matters", creator=owner)
+    no_match = Post(title="salamanders", body="not the one we are looking for", creator=owner)
+    db.add_all([body_match, title_match, no_match])
+    db.commit()
+
+    response = client.get("/posts", params={"q": "axolotl"}, headers=FORWARDED_FOR[3])
+    assert response.status_code == 200
+    assert [post["id"] for post in response.json()] == [title_match.id, body_match.id]
+
+    # the search index follows updates made through the api
+    update_ = {"title": "salamanders", "body": "now it is about the axolotl too"}
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.put(f"/posts/{no_match.id}", json=update_, headers=headers)
+    assert response.status_code == 200
+    response = client.get("/posts", params={"q": "axolotl salamanders"}, headers=FORWARDED_FOR[3])
+    assert [post["id"] for post in response.json()] == [no_match.id]
+
+
+def test_search_posts_with_cursor(client):
+    """
+    given a search
+    when a client asks for the page after a cursor
+    then the api should respond with a 400, since search results are ranked
+    """
+    params = {"q": "axolotl", "after": "aWQ6MQ"}
+    response = client.get("/posts", params=params, headers=FORWARDED_FOR[4])
+    assert response.status_code == 400
+
+
+def test_comment_count(client, access_token):
+    """
+    given a post
+    when comments are added to it and deleted
+    then the post must count its comments, and comments cannot be added to missing posts
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.post("/posts", json={"title": "counted", "body": "body"}, headers=headers)
+    post_id = response.json()["id"]
+    assert response.json()["comment_count"] == 0
+    comment_ids = []
+    for index in range(3):
+        response = client.post(f"/comments/{post_id}", json={"body": f"comment {index}"}, headers=headers)
+        comment_ids.append(response.json()["id"])
+    response = client.delete(f"/comments/{comment_ids[0]}", headers=headers)
+    assert response.status_code == 204
+
+    response = client.get(f"/posts/{post_id}", headers=FORWARDED_FOR[5])
+    assert response.json()["comment_count"] == len(response.json()["comments"]) == 2
+
+    response = client.post("/comments/10000", json={"body": "lost"}, headers=headers)
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Post not found"
+
+
+def test_list_posts_summary(client, access_token):
+    """
+    given a post with comments
+    when a client lists the posts in the summary view
+    then the posts must carry the number of comments instead of the comments
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.post("/posts", json={"title": "summarized", "body": "body"}, headers=headers)
+    post_id = response.json()["id"]
+    client.post(f"/comments/{post_id}", json={"body": "comment"}, headers=headers)
+
+    response = client.get("/posts", params={"view": "summary", "limit": 10}, headers=FORWARDED_FOR[5])
+    assert response.status_code == 200
+    post = response.json()[0]
+    assert post["id"] == post_id
+    assert post["comment_count"] == 1
+    assert "comments" not in post
+    assert post["creator"]["email"] == "test1@example.com"
+
+
+def test_comments_tree(client, access_token):
+    """
+    given a post with a deep thread and a comment with many responses
+    when an authenticated user gets the thread of the post
+    then the comments must be nested up to max_depth, with at most limit comments per level,
+    and the responses left out must be reachable from their parent
+    """
+    db = next(override_get_db())
+    post = Post(title="thread", body="body", user_id=1)
+    deep = Comment(body="level 1", user_id=1, post=post)
+    parent = deep
+    for depth in range(2, 5):
+        parent.responses = [Comment(body=f"level {depth}", user_id=1, post=post)]
+        parent = parent.responses[0]
+    busy = Comment(body="busy", user_id=1, post=post)
+    busy.responses = [Comment(body=f"response {i}", user_id=1, post=post) for i in range(12)]
+    roots = [Comment(body=f"root {i}", user_id=1, post=post) for i in range(10)]
+    db.add_all([post, deep, busy, *roots])
+    db.commit()
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    params = {"max_depth": 2, "limit": 10, "envelope": True}
+    response = client.get(f"/comments/{post.id}/tree", params=params, headers=headers)
+    assert response.status_code == 200
+    page = response.json()
+    assert [comment["body"] for comment in page["items"]] == ["level 1", "busy"] + [f"root {i}" for i in range(8)]
+    level_1 = page["items"][0]
+    assert [comment["body"] for comment in level_1["responses"]] == ["level 2"]
+    assert level_1["responses"][0]["responses"] == []
+    assert level_1["responses"][0]["response_count"] == 1
+    busy = page["items"][1]
+    assert busy["response_count"] == 12
+    assert [comment["body"] for comment in busy["responses"]] == [f"response {i}" for i in range(10)]
+    assert level_1["responses_next_cursor"] is None and busy["responses_next_cursor"] is not None
+
+    params = {"max_depth": 2, "limit": 10, "after": page["next_cursor"]}
+    response = client.get(f"/comments/{post.id}/tree", params=params, headers=headers)
+    assert [comment["body"] for comment in response.json()] == ["root 8", "root 9"]
+    assert "Link" not in response.headers
+
+    params = {"max_depth": 2, "limit": 10, "parent_id": busy["id"], "after": busy["responses_next_cursor"]}
+    response = client.get(f"/comments/{post.id}/tree", params=params, headers=headers)
+    assert [comment["body"] for comment in response.json()] == ["response 10", "response 11"]
+
+    params = {"max_depth": 2, "limit": 10, "parent_id": level_1["responses"][0]["id"]}
+    response = client.get(f"/comments/{post.id}/tree", params=params, headers=headers)
+    assert [comment["body"] for comment in response.json()] == ["level 3"]
+    assert [comment["body"] for comment in response.json()[0]["responses"]] == ["level 4"]
+
+
+def test_bulk_posts(client, access_token, test_users):
+    """
+    given a batch of posts, some of them invalid
+    when an authenticated user adds them in bulk and then deletes them in bulk
+    then the valid posts must be saved, every item must report its own outcome,
+    and the comments of the deleted posts must be deleted with them
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    batch = [{"title": "bulk 0", "body": "body"}, {"title": "no body"}, "not a post", {"title": "bulk 3", "body": "b"}]
+    response = client.post("/posts/bulk", json=batch, headers=headers)
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert [item["index"] for item in items] == [0, 1, 2, 3]
+    assert items[0]["error"] is None and items[3]["error"] is None
+    assert items[1]["id"] is None and items[1]["error"] == "body: Field required"
+    assert items[2]["id"] is None and items[2]["error"] is not None
+    db = next(override_get_db())
+    saved = db.query(Post).filter(Post.id.in_([items[0]["id"], items[3]["id"]])).order_by(Post.id).all()
+    assert [post.title for post in saved] == ["bulk 0", "bulk 3"]
+
+    response = client.post("/auth/access-token", data=test_users[1])
+    other_post = client.post(
+        "/posts", json={"title": "other", "body": "body"},
+        headers={"Authorization": f"Bearer {response.json()['access_token']}"},
+    ).json()["id"]
+    comment_id = client.post(f"/comments/{items[0]['id']}", json={"body": "comment"}, headers=headers).json()["id"]
+    ids = [items[0]["id"], other_post, 10000, items[3]["id"]]
+    response = client.post("/posts/bulk/delete", json={"ids": ids}, headers=headers)
+    assert response.status_code == 200
+    assert [item["error"] for item in response.json()["items"]] == [
+        None, "You cannot delete someone else's post", "Post not found", None
+    ]
+    assert db.query(Post).filter(Post.id.in_(ids)).count() == 1
+    assert db.get(Comment, comment_id) is None
+
+
+def test_bulk_comments(client, access_token):
+    """
+    given a post
+    when an authenticated user adds comments and responses to it in bulk and then deletes some of them
+    then the comments must be saved, responding to comments of the post only, and the post must count them
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    post_id = client.post("/posts", json={"title": "bulk comments", "body": "body"}, headers=headers).json()["id"]
+    comment_id = client.post(f"/comments/{post_id}", json={"body": "parent"}, headers=headers).json()["id"]
+    batch = [
+        {"body": "response", "parent_id": comment_id},
+        {"body": "comment"},
+        {"body": "lost response", "parent_id": 10000},
+        {"parent_id": comment_id},
+    ]
+    response = client.post(f"/comments/{post_id}/bulk", json=batch, headers=headers)
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert [item["error"] for item in items] == [None, None, "Parent comment not found", "body: Field required"]
+
+    response = client.get(f"/posts/{post_id}", headers=FORWARDED_FOR[5])
+    assert response.json()["comment_count"] == 3
+    parent = next(comment for comment in response.json()["comments"] if comment["id"] == comment_id)
+    assert [comment["body"] for comment in parent["responses"]] == ["response"]
+
+    ids = [items[1]["id"], 10000]
+    response = client.post("/comments/bulk/delete", json={"ids": ids}, headers=headers)
+    assert [item["error"] for item in response.json()["items"]] == [None, "Comment not found"]
+    response = client.get(f"/posts/{post_id}", headers=FORWARDED_FOR[5])
+    assert response.json()["comment_count"] == 2
+
+    response = client.post("/comments/10000/bulk", json=batch, headers=headers)
+    assert response.status_code == 404
+
+
+def test_bulk_delete_others_comments(client, access_token, test_users):
+    """
+    given a comment of another user
+    when an authenticated user deletes it in bulk along with one of their own
+    then only their own comment must be deleted, and the other must be reported as someone else's
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.post("/auth/access-token", data=test_users[1])
+    other_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    post_id = client.post("/posts", json={"title": "owned comments", "body": "body"}, headers=headers).json()["id"]
+    own = client.post(f"/comments/{post_id}", json={"body": "own"}, headers=headers).json()["id"]
+    other = client.post(f"/comments/{post_id}", json={"body": "other"}, headers=other_headers).json()["id"]
+
+    response = client.post("/comments/bulk/delete", json={"ids": [own, other]}, headers=headers)
+    assert response.status_code == 200
+    assert [item["error"] for item in response.json()["items"]] == [None, "You cannot delete someone else's comment"]
+    db = next(override_get_db())
+    assert [comment.id for comment in db.query(Comment).filter(Comment.id.in_([own, other]))] == [other]
+    assert db.get(Post, post_id).comment_count == 1
+
+
+def test_bulk_limit(client, access_token):
+    """
+    given a batch larger than BULK_MAX_ITEMS
+    when an authenticated user adds it in bulk
+    then the whole batch must be rejected
+    """
+    batch = [{"title": "title", "body": "body"}] * (Settings().BULK_MAX_ITEMS + 1)
+    response = client.post("/posts/bulk", json=batch, headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 422
+
+
+def test_update_post_if_match(client, access_token, test_users):
+    """
+    given a post and its ETag
+    when its author updates it sending the ETag in If-Match
+    then the update must succeed once, and writes based on the outdated ETag must fail with a 412
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    post_id = client.post("/posts", json={"title": "versioned", "body": "body"}, headers=headers).json()["id"]
+    etag = client.get(f"/posts/{post_id}", headers=FORWARDED_FOR[5]).headers["ETag"]
+    assert etag.startswith('"1-')
+
+    update_ = {"title": "versioned", "body": "first edit"}
+    response = client.put(f"/posts/{post_id}", json=update_, headers={**headers, "If-Match": etag})
+    assert response.status_code == 200
+    new_etag = response.headers["ETag"]
+    assert new_etag.startswith('"2-')
+    assert client.get(f"/posts/{post_id}", headers=FORWARDED_FOR[5]).headers["ETag"] == new_etag
+
+    update_ = {"title": "versioned", "body": "concurrent edit"}
+    response = client.put(f"/posts/{post_id}", json=update_, headers={**headers, "If-Match": etag})
+    assert response.status_code == 412
+    response = client.delete(f"/posts/{post_id}", headers={**headers, "If-Match": etag})
+    assert response.status_code == 412
+
+    other_token = client.post("/auth/access-token", data=test_users[1]).json()["access_token"]
+    response = client.put(
+        f"/posts/{post_id}", json=update_, headers={"Authorization": f"Bearer {other_token}", "If-Match": new_etag}
+    )
+    assert response.status_code == 403
+
+    response = client.delete(f"/posts/{post_id}", headers={**headers, "If-Match": new_etag})
+    assert response.status_code == 204
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import tempfile
+import time
+from typing import List
+from unittest import mock
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from starlette.requests import Request
+
+from src.authentication.models import User
+from src.db import connection
+from src.db.connection import Base, get_async_db, get_async_read_db, get_async_url
+from src.db.replicas import ReplicaSet, WriteTrackingSession, memory_recent_writes
+
+
+def make_database(email: str) -> str:
+    """ a sqlite file holding a single user, so the tests can tell which database they read """
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'replica.db')}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        db.add(User(name=email, username=email, email=email, password="password"))
+        db.commit()
+    engine.dispose()
+    return url
+
+
+def make_request(address: str) -> Request:
+    return Request({"type": "http", "headers": [(b"x-forwarded-for", address.encode())], "client": ("test", 1)})
+
+
+async def read_emails(request: Request) -> List[str]:
+    dependency = get_async_read_db(request)
+    db = await anext(dependency)
+    emails = (await db.scalars(select(User.email).order_by(User.id))).all()
+    # the response cache is only filled from the sessions of the primary
+    assert db.info["replica"] == (emails[0] == "replica@example.com")
+    await dependency.aclose()
+    return list(emails)
+
+
+async def add_user(request: Request, email: str):
+    dependency = get_async_db(request)
+    db = await anext(dependency)
+    db.add(User(name=email, username=email, email=email, password="password"))
+    await db.commit()
+    await anext(dependency, None)
+
+
+def test_replicas_round_robin():
+    """
+    given two healthy replicas and one whose database cannot be opened
+    when replicas are chosen
+    then the healthy ones must take turns and the other one must be skipped
+    """
+    urls = [
+        make_database("first@example.com"), "sqlite:////nonexistent/replica.db", make_database("second@example.com")
+    ]
+
+    async def choose_4_times():
+        replicas = ReplicaSet(urls=[get_async_url(url) for url in urls], check_interval=60, check_timeout=5)
+        chosen = [await replicas.choose() for _ in range(4)]
+        for replica in replicas.replicas:
+            await replica.engine.dispose()
+        return replicas.replicas, chosen
+
+    replicas, chosen = asyncio.run(choose_4_times())
+    assert [replica.healthy for replica in replicas] == [True, False, True]
+    assert chosen == [replicas[0], replicas[2], replicas[0], replicas[2]]
+
+
+def test_replica_check_timeout():
+    """
+    given a replica that never answers its health check
+    when several requests choose a replica at once
+    then the replica must be checked once, and skipped once the check times out
+    """
+    async def choose_at_once():
+        replicas = ReplicaSet(urls=[get_async_url(make_database("stalled@example.com"))], check_interval=60,
+                              check_timeout=0.1)
+        checks = []
+
+        async def stall(replica):
+            checks.append(replica)
+            await asyncio.sleep(10)
+
+        with mock.patch.object(ReplicaSet, "select_1", staticmethod(stall)):
+            started_at = time.monotonic()
+            await asyncio.gather(*(replicas.choose() for _ in range(5)))
+            elapsed = time.monotonic() - started_at
+            chosen = await replicas.choose()
+        await replicas.replicas[0].engine.dispose()
+        return len(checks), elapsed, chosen
+
+    checks, elapsed, chosen = asyncio.run(choose_at_once())
+    assert checks == 1
+    assert elapsed < 1
+    assert chosen is None
+
+
+def test_read_your_writes():
+    """
+    given a primary and a replica that does not get the writes of the primary
+    when a client reads, writes and reads again
+    then it must read from the replica until it writes, then from the primary,
+    and only the sessions of the replica must be marked as such
+    """
+    primary_url = make_database("primary@example.com")
+    replica_url = make_database("replica@example.com")
+
+    async def read_write_read():
+        primary = create_async_engine(get_async_url(primary_url))
+        replicas = ReplicaSet(urls=[get_async_url(replica_url)], check_interval=60, check_timeout=5)
+        primary_sessions = async_sessionmaker(
+            bind=primary, autoflush=False, expire_on_commit=False, sync_session_class=WriteTrackingSession
+        )
+        writer, reader = make_request("10.0.5.1"), make_request("10.0.5.2")
+        with mock.patch.object(connection, "AsyncSessionLocal", primary_sessions), \
+                mock.patch.object(connection, "read_replicas", replicas):
+            before = await read_emails(writer)
+            await add_user(writer, "written@example.com")
+            after = await read_emails(writer), await read_emails(reader)
+        await primary.dispose()
+        await replicas.replicas[0].engine.dispose()
+        return before, after
+
+    before, (writer_after, reader_after) = asyncio.run(read_write_read())
+    memory_recent_writes.cache.clear()
+    assert before == ["replica@example.com"]
+    assert writer_after == ["primary@example.com", "written@example.com"]
+    assert reader_after == ["replica@example.com"]
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import resource
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from src.blog.models import Post, Comment
+from src.authentication.models import User
+from tests.conftest import DATABASE_DIRECTORY, DATABASE_PATH, engine, override_get_db
+
+# the export is rate limited by client ip, like GET /posts
+HEADERS = {"X-Forwarded-For": "10.0.3.1"}
+EXPORTED_ROWS = 500_000
+# growth of the peak resident memory allowed while exporting EXPORTED_ROWS posts,
+# the whole export is over 100MB of json
+PEAK_RSS_BOUND_MB = 64
+
+
+def seed_posts(number_of_posts: int):
+    """ inserts the posts straight through sqlite, the ORM would take longer than the export """
+    conn = sqlite3.connect(DATABASE_PATH)
+    # the export does not use the search index of this throwaway database, skip indexing the posts
+    conn.execute("DROP TRIGGER posts_fts_insert")
+    user_id = conn.execute(
+        "INSERT INTO users (name, username, email, password, is_active) "
+        "VALUES ('exporter', 'exporter', 'exporter@example.com', 'not-a-hash', 1)"
+    ).lastrowid
+    conn.executemany(
+        "INSERT INTO posts (title, body, user_id, comment_count) VALUES (?, ?, ?, 0)",
+        ((f"exported post {i}", "lorem ipsum dolor sit amet " * 8, user_id) for i in range(number_of_posts)),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def export_posts() -> int:
+    """
+    requests GET /posts/export straight through the ASGI interface and discards the body as it
+    arrives, test clients would keep the whole body in memory
+    :return: the number of exported lines
+    """
+    from app import app
+    from src.requests_limit import lifespan
+
+    lines = 0
+    requested = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal lines
+        if message["type"] == "http.response.body":
+            lines += message.get("body", b"").count(b"\n")
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/posts/export", "raw_path": b"/posts/export", "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"testserver"), (b"x-forwarded-for", b"10.0.3.2")],
+        "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+    }
+    async with lifespan(app):
+        await app(scope, receive, send)
+    return lines
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def test_export_posts(client):
+    """
+    given saved posts
+    when a client exports the posts
+    then every post must be streamed as a line of json, ordered by id
+    """
+    db = next(override_get_db())
+    owner = User(name="export", username="export", email="export@example.com", password="not-a-hash")
+    db.add_all([Post(title=f"export {i}", body="body", creator=owner) for i in range(3)])
+    db.commit()
+    response = client.get("/posts/export", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    posts = [json.loads(line) for line in response.text.splitlines()]
+    assert len(posts) == db.query(Post).count()
+    assert [post["id"] for post in posts] == sorted(post["id"] for post in posts)
+    assert posts[-1]["title"] == "export 2"
+    assert posts[-1]["creator"]["email"] == "export@example.com"
+
+
+def test_export_comments(client):
+    """
+    given a post with comments and responses
+    when an authenticated user exports its comments
+    then every comment of the post must be streamed, along with the comment it responds to
+    """
+    db = next(override_get_db())
+    owner = User(name="export", username="export-comments", email="export-comments@example.com")
+    owner.set_password("export")
+    post = Post(title="exported comments", body="body", creator=owner)
+    comment = Comment(body="comment", creator=owner, post=post)
+    comment.responses = [Comment(body="response", creator=owner, post=post)]
+    db.add_all([post, comment])
+    db.commit()
+    response = client.post(
+        "/auth/access-token", data={"username": "export-comments@example.com", "password": "export"}
+    )
+    headers = {**HEADERS, "Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = client.get(f"/comments/{post.id}/export", headers=headers)
+    assert response.status_code == 200
+    comments = [json.loads(line) for line in response.text.splitlines()]
+    assert [(c["body"], c["parent_id"]) for c in comments] == [("comment", None), ("response", comment.id)]
+
+
+@pytest.mark.slow
+def test_export_memory():
+    """
+    given half a million posts
+    when they are exported
+    then the peak memory of the app must stay under a fixed bound
+    """
+    # a process of its own, so the peak memory of the other tests does not hide the export's
+    result = subprocess.run(
+        [sys.executable, "-m", "tests.test_export", str(EXPORTED_ROWS)], capture_output=True, text=True, timeout=600
+    )
+    assert result.returncode == 0, result.stderr
+    lines, growth = result.stdout.split()
+    assert int(lines) == EXPORTED_ROWS
+    assert float(growth) < PEAK_RSS_BOUND_MB
+
+
+if __name__ == "__main__":
+    # the posts fill the database of this process, over 100MB, remove it even when the export fails
+    try:
+        seed_posts(int(sys.argv[1]))
+        rss_before = peak_rss_mb()
+        exported_lines = asyncio.run(export_posts())
+        print(exported_lines, peak_rss_mb() - rss_before)
+    finally:
+        engine.dispose()
+        DATABASE_DIRECTORY.cleanup()
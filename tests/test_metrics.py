@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from prometheus_client import REGISTRY
+
+from src.blog.models import Post
+from src.constants import REQUESTS_LIMIT_GET_POSTS
+from tests.conftest import override_get_db
+
+HEADERS = {"X-Forwarded-For": "10.0.6.1"}
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_request_metrics(client):
+    """
+    given a saved post
+    when a client gets it and a post that does not exist
+    then the requests must be counted under the route template, along with their queries and response sizes
+    """
+    db = next(override_get_db())
+    post = Post(title="measured", body="body", user_id=1)
+    db.add(post)
+    db.commit()
+    route = {"method": "GET", "route": "/posts/{post_id}"}
+    found = sample("http_requests_total", **route, status="200")
+    not_found = sample("http_requests_total", **route, status="404")
+    queries = sample("http_request_db_queries_sum", **route)
+    sizes = sample("http_response_size_bytes_sum", **route)
+
+    response = client.get(f"/posts/{post.id}", headers=HEADERS)
+    client.get("/posts/100000", headers=HEADERS)
+    assert sample("http_requests_total", **route, status="200") == found + 1
+    assert sample("http_requests_total", **route, status="404") == not_found + 1
+    assert sample("http_request_db_queries_sum", **route) > queries
+    assert sample("http_response_size_bytes_sum", **route) >= sizes + len(response.content)
+    assert sample("http_requests_in_progress", method="GET") == 0
+
+
+def test_rate_limit_rejection_metrics(client):
+    """
+    given an anonymous client that spent its quota on GET /posts
+    when it requests the posts again
+    then the rejection must be counted for the limit and tier
+    """
+    headers = {"X-Forwarded-For": "10.0.6.2"}
+    rejections = sample("rate_limit_rejections_total", limit="list_posts", tier="anonymous")
+    for _ in range(REQUESTS_LIMIT_GET_POSTS["TIMES"]):
+        client.get("/posts", headers=headers)
+    assert client.get("/posts", headers=headers).status_code == 429
+    assert sample("rate_limit_rejections_total", limit="list_posts", tier="anonymous") == rejections + 1
+
+
+MULTIPROCESS_WORKER = """
+from src.metrics import HTTP_REQUESTS
+HTTP_REQUESTS.labels(method="GET", route="/posts", status="200").inc()
+"""
+
+MULTIPROCESS_SCRAPE = """
+from prometheus_client import generate_latest
+from src.metrics import metrics_registry
+print(generate_latest(metrics_registry()).decode())
+"""
+
+
+def test_multiprocess_metrics():
+    """
+    given two workers sharing a PROMETHEUS_MULTIPROC_DIR
+    when each one serves a request
+    then the metrics scraped from any worker must add up the requests of both
+    """
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": tempfile.mkdtemp()}
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", MULTIPROCESS_WORKER], env=env, check=True)
+    scraped = subprocess.run(
+        [sys.executable, "-c", MULTIPROCESS_SCRAPE], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    assert 'http_requests_total{method="GET",route="/posts",status="200"} 2.0' in scraped
@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect, select, text
+
+from src.authentication.models import User
+from src.blog.models import Post, Comment
+from tests.conftest import engine
+
+
+def explain(statement) -> str:
+    """ sqlite's plan for the statement, one step per line """
+    compiled = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        return "\n".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+
+
+def test_migrations_match_models():
+    """
+    given an empty database
+    when every migration is applied
+    then the schema must match the models, and every migration must be reversible
+    """
+    database = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'migrations.db')}")
+    config = Config("alembic.ini")
+    with database.begin() as conn:
+        config.attributes["connection"] = conn
+        command.upgrade(config, "head")
+        # autogenerate through alembic/env.py, it raises AutogenerateDiffsDetected when the schema differs
+        command.check(config)
+        assert "ix_comments_post_id_id" in {index["name"] for index in inspect(conn).get_indexes("comments")}
+
+        command.downgrade(config, "base")
+        assert inspect(conn).get_table_names() == ["alembic_version"]
+
+
+def test_list_comments_uses_index():
+    """
+    given the query of a page of comments of a post after a cursor
+    when sqlite plans it
+    then it must seek the composite index instead of scanning the comments
+    """
+    statement = select(Comment).where(Comment.post_id == 1, Comment.id > 10).order_by(Comment.id).limit(21)
+    plan = explain(statement)
+    assert "USING INDEX ix_comments_post_id_id (post_id=? AND id>?)" in plan
+    assert "SCAN comments" not in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_foreign_key_lookups_use_indexes():
+    """
+    given the lookups made to load the posts of a user, the comments of a user and the responses of comments
+    when sqlite plans them
+    then each one must search an index
+    """
+    plans = [
+        explain(select(Post).where(Post.user_id == 1)),
+        explain(select(Comment).where(Comment.user_id == 1)),
+        explain(select(Comment).where(Comment.parent_id.in_([1, 2, 3]))),
+        explain(select(User).where(User.is_active.is_(False))),
+    ]
+    for plan, index in zip(plans, ["ix_posts_user_id", "ix_comments_user_id", "ix_comments_parent_id",
+                                   "ix_users_is_active"]):
+        assert f"USING INDEX {index}" in plan or f"USING COVERING INDEX {index}" in plan, plan
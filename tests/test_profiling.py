@@ -0,0 +1,49 @@
+import glob
+import json
+import os
+import tempfile
+from unittest import mock
+
+from src.profiling import PROFILE_HEADER, settings, sign_profile_header
+
+
+def profiles(directory: str):
+    return sorted(glob.glob(os.path.join(directory, "*")))
+
+
+def test_profiling_enabled(client):
+    """
+    given profiling enabled for every request, without threshold
+    when a client lists the posts
+    then the sampled stacks and the SQL statements of the request must be saved
+    """
+    directory = tempfile.mkdtemp()
+    with mock.patch.multiple(settings, PROFILING_ENABLED=True, PROFILING_THRESHOLD_MS=0, PROFILING_DIR=directory):
+        response = client.get("/posts", params={"limit": 10, "page": 2}, headers={"X-Forwarded-For": "10.0.7.1"})
+    assert response.status_code == 200
+    folded, breakdown = profiles(directory)
+    assert folded.endswith("-GET-posts.folded")
+    with open(folded) as lines:
+        assert all(line.rsplit(" ", 1)[1].strip().isdigit() for line in lines)
+    with open(breakdown) as data:
+        breakdown = json.load(data)
+    assert breakdown["path"] == "/posts"
+    assert breakdown["sql_count"] == len(breakdown["statements"]) >= 1
+    assert breakdown["statements"][0]["statement"].startswith("SELECT")
+
+
+def test_profiling_signed_header(client):
+    """
+    given profiling disabled
+    when requests carry a signed, a forged and an expired X-Profile header
+    then only the request with the signed one must be profiled
+    """
+    directory = tempfile.mkdtemp()
+    headers = {"X-Forwarded-For": "10.0.7.2"}
+    expires_at, _, signature = sign_profile_header().partition(".")
+    with mock.patch.multiple(settings, PROFILING_ENABLED=False, PROFILING_THRESHOLD_MS=0, PROFILING_DIR=directory):
+        client.get("/posts", headers={**headers, PROFILE_HEADER: f"{int(expires_at) + 1}.{signature}"})
+        client.get("/posts", headers={**headers, PROFILE_HEADER: sign_profile_header(seconds=-1)})
+        assert profiles(directory) == []
+        client.get("/posts", headers={**headers, PROFILE_HEADER: f"{expires_at}.{signature}"})
+    assert len(profiles(directory)) == 2
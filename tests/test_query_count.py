@@ -0,0 +1,199 @@
+from contextlib import contextmanager
+from itertools import count
+from typing import List
+
+import pytest
+from sqlalchemy import event
+
+from src.blog.models import Post, Comment
+from src.authentication.models import User
+from tests.conftest import async_engine, override_get_db
+
+# the requests limit buckets are keyed by client ip, so these requests must not
+# spend the quota checked in tests/test_requests_limits.py
+HEADERS = {"X-Forwarded-For": "10.0.0.2"}
+USERS_SEQUENCE = count()
+
+
+@contextmanager
+def count_queries():
+    """
+    counts the statements sent to the database by the app while the block runs
+    """
+    statements: List[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+def add_posts(number_of_posts: int) -> List[int]:
+    """
+    creates posts written by different users, each one with comments and responses
+    written by different users as well
+    :return: the ids of the created posts
+    """
+    db = next(override_get_db())
+    users = []
+    for _ in range(3):
+        number = next(USERS_SEQUENCE)
+        users.append(User(
+            name=f"qc{number}", username=f"qc{number}", email=f"qc{number}@example.com", password="not-a-hash"
+        ))
+    db.add_all(users)
+    db.commit()
+    post_ids = []
+    for index in range(number_of_posts):
+        post = Post(title="title", body="body", creator=users[index % 3])
+        for comment_index in range(3):
+            comment = Comment(body="comment", creator=users[comment_index], post=post)
+            comment.responses = [Comment(body="response", creator=users[comment_index - 1], post=post)]
+        db.add(post)
+        db.commit()
+        post_ids.append(post.id)
+    return post_ids
+
+
+@pytest.fixture(scope="module")
+def access_token(client):
+    db = next(override_get_db())
+    user = User(name="qc", username="qc-reader", email="qc-reader@example.com")
+    user.set_password("qc")
+    db.add(user)
+    db.commit()
+    response = client.post("/auth/access-token", data={"username": "qc-reader@example.com", "password": "qc"})
+    return response.json()["access_token"]
+
+
+def test_list_posts_query_count(client):
+    """
+    given pages with a different number of posts, comments and authors
+    when a client lists the posts
+    then the number of queries must be the same for any page
+    """
+    add_posts(2)
+    with count_queries() as small_page:
+        response = client.get("/posts", params={"limit": 10}, headers=HEADERS)
+    assert response.status_code == 200
+
+    add_posts(10)
+    with count_queries() as big_page:
+        response = client.get("/posts", params={"limit": 20}, headers=HEADERS)
+    assert response.status_code == 200
+    assert len(response.json()) >= 12
+
+    # posts with their creators, then the comments of the page with their creators and the comments responses
+    assert len(small_page) == len(big_page) == 2
+    assert not any("password" in statement for statement in big_page)
+
+
+def test_list_posts_matches_get_post(client):
+    """
+    given a post with comments and responses
+    when a client lists the posts and gets the post
+    then both must render the post the same way, though the list selects columns instead of models
+    """
+    post_id = add_posts(1)[0]
+    listed = client.get("/posts", params={"limit": 10}, headers=HEADERS).json()
+    post = client.get(f"/posts/{post_id}", headers=HEADERS).json()
+    assert next(item for item in listed if item["id"] == post_id) == post
+
+
+def test_list_users_query(client, access_token):
+    """
+    given active users
+    when a client lists them
+    then neither the users nor the authenticated one must be loaded with their password hashes
+    """
+    with count_queries() as statements:
+        response = client.get("/auth/users", headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    assert {"id", "name", "username", "email", "is_active"} == set(response.json()[0])
+    assert not any("password" in statement for statement in statements)
+
+
+def test_list_posts_summary_query_count(client):
+    """
+    given posts with comments
+    when a client lists them in the summary view
+    then the posts and their creators must be loaded with a single query
+    """
+    add_posts(3)
+    with count_queries() as statements:
+        response = client.get("/posts", params={"limit": 10, "view": "summary"}, headers=HEADERS)
+    assert response.status_code == 200
+    assert len(statements) == 1
+
+
+def test_get_post_query_count(client):
+    """
+    given a post with comments and responses from different users
+    when a client gets it
+    then the post, its comments and their responses must be loaded with 3 queries
+    """
+    post_id = add_posts(1)[0]
+    with count_queries() as statements:
+        response = client.get(f"/posts/{post_id}", headers=HEADERS)
+    assert response.status_code == 200
+    assert len(response.json()["comments"]) == 6
+    assert len(statements) == 3
+
+
+def test_list_comments_query_count(client, access_token):
+    """
+    given a post with comments and responses from different users
+    when an authenticated user lists its comments
+    then the comments must be loaded with 2 queries, the user comes from the cache
+    """
+    post_id = add_posts(1)[0]
+    headers = {"Authorization": f"Bearer {access_token}"}
+    # the first authenticated request caches the current user
+    client.get(f"/comments/{post_id}", headers=headers)
+    with count_queries() as statements:
+        response = client.get(f"/comments/{post_id}", headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()) == 6
+    # comments with their creators and the comments responses
+    assert len(statements) == 2
+
+
+def test_comments_tree_query_count(client, access_token):
+    """
+    given a post with comments and responses from different users
+    when an authenticated user gets its thread
+    then the whole thread must be loaded with a single query
+    """
+    post_id = add_posts(1)[0]
+    headers = {"Authorization": f"Bearer {access_token}"}
+    client.get(f"/comments/{post_id}/tree", headers=headers)
+    with count_queries() as statements:
+        response = client.get(f"/comments/{post_id}/tree", headers=headers)
+    assert response.status_code == 200
+    assert sum(len(comment["responses"]) for comment in response.json()) == 3
+    assert len(statements) == 1
+
+
+def test_write_post_query_count(client, access_token):
+    """
+    given a post of the authenticated user
+    when the user updates it and then deletes it
+    then the ownership check must be part of the UPDATE and DELETE statements
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    post_id = client.post("/posts", json={"title": "title", "body": "body"}, headers=headers).json()["id"]
+    with count_queries() as statements:
+        response = client.put(f"/posts/{post_id}", json={"title": "new title", "body": "body"}, headers=headers)
+    assert response.status_code == 200
+    # the updated post, its creator and its comments, there are no responses to load
+    assert len(statements) == 3
+    assert statements[0].startswith("UPDATE posts")
+
+    with count_queries() as statements:
+        response = client.delete(f"/posts/{post_id}", headers=headers)
+    assert response.status_code == 204
+    assert len(statements) == 1
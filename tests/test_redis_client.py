@@ -0,0 +1,57 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from redis.exceptions import ConnectionError
+
+from app import app
+from src.redis_client import TimedBlockingConnectionPool, create_redis, close_redis, settings
+
+
+def sample(name: str) -> float:
+    return REGISTRY.get_sample_value(name) or 0
+
+
+def test_redis_pool_is_bounded():
+    """
+    given a redis client with a pool of two connections
+    when many commands run at once, and a third connection is requested while two are in use
+    then the pool must never open more than two connections, and the request must time out
+    """
+    async def use_pool():
+        with mock.patch.multiple(settings, REDIS_MAX_CONNECTIONS=2):
+            redis = create_redis(settings.REDIS_URL)
+        pool = redis.connection_pool
+        assert isinstance(pool, TimedBlockingConnectionPool)
+        assert all(await asyncio.gather(*(redis.ping() for _ in range(20))))
+        assert len(pool._connections) <= 2
+
+        pool.timeout = 0.05
+        timeouts = sample("redis_pool_timeouts_total")
+        connections = [await pool.get_connection("PING") for _ in range(2)]
+        assert sample("redis_pool_in_use") == 2
+        assert sample("redis_pool_max_connections") == 2
+        with pytest.raises(ConnectionError):
+            await pool.get_connection("PING")
+        assert sample("redis_pool_timeouts_total") == timeouts + 1
+        for connection in connections:
+            await pool.release(connection)
+        assert sample("redis_pool_in_use") == 0
+        await close_redis(redis)
+
+    asyncio.run(use_pool())
+
+
+def test_lifespan_closes_redis_pool():
+    """
+    given the app started with its shared redis client
+    when a rate limited request used the pool and the app shuts down
+    then every connection of the pool must be closed
+    """
+    with TestClient(app=app) as client:
+        client.get("/posts", headers={"X-Forwarded-For": "10.0.7.1"})
+        pool = app.state.redis.connection_pool
+        assert pool._connections
+    assert not any(connection.is_connected for connection in pool._connections)
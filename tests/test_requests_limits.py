@@ -1,4 +1,39 @@
-from src.constants import REQUESTS_LIMIT_GET_POSTS
+import asyncio
+from typing import List
+from unittest import mock
+from uuid import uuid4
+
+import pytest
+import redis.asyncio as redis
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from src.authentication import oauth2
+from src.authentication.models import User
+from src.blog.models import Post
+from src.constants import (
+    REQUESTS_LIMIT_GET_POSTS, REQUESTS_LIMIT_GET_POSTS_AUTHENTICATED, REQUESTS_LIMIT_ADD_COMMENT,
+    REQUESTS_LIMIT_ADD_POST, REQUESTS_LIMIT_ADD_POSTS_BULK,
+)
+from src.requests_limit import HybridRateLimiter, MemoryRateLimiter, RateLimit, RedisRateLimiter, settings
+from tests.conftest import override_get_db
+
+
+@pytest.fixture(scope="module")
+def access_tokens(client):
+    """ tokens of two users sharing the address 10.0.4.2 """
+    db = next(override_get_db())
+    tokens = []
+    for index in range(2):
+        user = User(name=f"limited{index}", username=f"limited{index}", email=f"limited{index}@example.com")
+        user.set_password("limited")
+        db.add(user)
+        db.commit()
+        response = client.post(
+            "/auth/access-token", data={"username": f"limited{index}@example.com", "password": "limited"}
+        )
+        tokens.append(response.json()["access_token"])
+    return tokens
 
 
 def test_requests_limits_get_posts(client):
@@ -19,3 +54,290 @@ def test_requests_limits_get_post(client):
     assert resp.status_code == 429
     seconds = REQUESTS_LIMIT_GET_POSTS.get('SECONDS')
     assert resp.headers["Retry-After"] == f"{seconds} seconds"
+
+
+def test_rate_limit_headers(client):
+    """
+    given a rate limited route
+    when a client requests it
+    then the response must describe the remaining quota with the RateLimit headers
+    """
+    headers = {"X-Forwarded-For": "10.0.4.1"}
+    client.get("/posts", headers=headers)
+    resp = client.get("/posts", headers=headers)
+    assert resp.headers["RateLimit-Limit"] == str(REQUESTS_LIMIT_GET_POSTS["TIMES"])
+    assert resp.headers["RateLimit-Remaining"] == str(REQUESTS_LIMIT_GET_POSTS["TIMES"] - 2)
+    assert resp.headers["RateLimit-Policy"] == "{TIMES};w={SECONDS}".format(**REQUESTS_LIMIT_GET_POSTS)
+    assert 0 < int(resp.headers["RateLimit-Reset"]) <= REQUESTS_LIMIT_GET_POSTS["SECONDS"]
+
+
+def test_rate_limits_override():
+    """
+    given a limit overridden by the RATE_LIMITS setting
+    when the limit is created
+    then the setting must take precedence over the default of the route
+    """
+    overrides = {"list_posts": {"TIMES": 100}, "list_posts:authenticated": {"SECONDS": 1}}
+    with mock.patch.object(settings, "RATE_LIMITS", overrides):
+        limit = RateLimit("list_posts", REQUESTS_LIMIT_GET_POSTS, REQUESTS_LIMIT_GET_POSTS_AUTHENTICATED)
+    assert (limit.times, limit.seconds) == (100, REQUESTS_LIMIT_GET_POSTS["SECONDS"])
+    authenticated_times = REQUESTS_LIMIT_GET_POSTS_AUTHENTICATED["TIMES"]
+    assert (limit.authenticated_times, limit.authenticated_seconds) == (authenticated_times, 1)
+
+
+def test_rate_limits_per_user(client, access_tokens):
+    """
+    given two users and an anonymous client behind the same address
+    when one of the users spends the quota of authenticated clients
+    then the other user and the anonymous client must keep their own quotas
+    """
+    address = {"X-Forwarded-For": "10.0.4.2"}
+    first, second = ({**address, "Authorization": f"Bearer {token}"} for token in access_tokens)
+    for _ in range(REQUESTS_LIMIT_GET_POSTS_AUTHENTICATED["TIMES"]):
+        assert client.get("/posts", headers=first).status_code == 200
+    assert client.get("/posts", headers=first).status_code == 429
+
+    response = client.get("/posts", headers=second)
+    assert response.status_code == 200
+    assert response.headers["RateLimit-Limit"] == str(REQUESTS_LIMIT_GET_POSTS_AUTHENTICATED["TIMES"])
+    response = client.get("/posts", headers=address)
+    assert response.status_code == 200
+    assert response.headers["RateLimit-Limit"] == str(REQUESTS_LIMIT_GET_POSTS["TIMES"])
+
+
+def test_add_comment_rate_limit(client, access_tokens):
+    """
+    given a user commenting on two posts
+    when the comments are added
+    then they must spend the same quota, verifying the token once per request
+    """
+    db = next(override_get_db())
+    posts = [Post(title=f"limited {index}", body="body", user_id=1) for index in range(2)]
+    db.add_all(posts)
+    db.commit()
+    headers = {"Authorization": f"Bearer {access_tokens[1]}"}
+    with mock.patch.object(
+            oauth2, "verify_cached_access_token", wraps=oauth2.verify_cached_access_token
+    ) as verify:
+        responses = [client.post(f"/comments/{post.id}", json={"body": "comment"}, headers=headers) for post in posts]
+    assert [response.status_code for response in responses] == [201, 201]
+    assert verify.call_count == 2
+    times = REQUESTS_LIMIT_ADD_COMMENT["TIMES"]
+    assert [response.headers["RateLimit-Remaining"] for response in responses] == [str(times - 1), str(times - 2)]
+
+
+def test_bulk_rate_limit_per_item(client, access_tokens):
+    """
+    given a user adding posts in bulk
+    when the user sends a batch of more posts than POST /posts allows per window
+    then the batch must spend its own quota, one unit per post, and leave the quota of POST /posts alone,
+    and empty or malformed bodies must be rejected by the validation of the body
+    """
+    headers = {"Authorization": f"Bearer {access_tokens[0]}"}
+    size = REQUESTS_LIMIT_ADD_POST["TIMES"] + 1
+    batch = [{"title": f"limited bulk {index}", "body": "body"} for index in range(size)]
+    response = client.post("/posts/bulk", json=batch, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["RateLimit-Remaining"] == str(REQUESTS_LIMIT_ADD_POSTS_BULK["TIMES"] - size)
+    response = client.post("/posts", json={"title": "limited", "body": "body"}, headers=headers)
+    assert response.headers["RateLimit-Remaining"] == str(REQUESTS_LIMIT_ADD_POST["TIMES"] - 1)
+
+    for content in (b"", b"not json"):
+        response = client.post(
+            "/posts/bulk", content=content, headers={**headers, "Content-Type": "application/json"}
+        )
+        assert response.status_code == 422
+
+
+def test_per_item_rate_limit_too_large():
+    """
+    given a route limited to 3 items every minute
+    when a client sends 4 items, then 3, then 1
+    then the first request must be rejected for good with a 413, the second allowed and the third
+    rejected with a 429 until the window moves on
+    """
+    limited_app = FastAPI()
+    limited_app.state.rate_limiter = MemoryRateLimiter(maxsize=10)
+
+    @limited_app.post("/items", dependencies=[Depends(RateLimit("items", {"TIMES": 3, "SECONDS": 60}, per_item=True))])
+    async def add_items(items: List[int]):
+        return {"added": len(items)}
+
+    with TestClient(limited_app) as limited_client:
+        responses = [limited_client.post("/items", json=items) for items in ([1, 2, 3, 4], [1, 2, 3], [1])]
+    assert [response.status_code for response in responses] == [413, 200, 429]
+    assert "Retry-After" not in responses[0].headers
+    assert "Retry-After" in responses[2].headers
+
+
+def test_memory_rate_limiter():
+    """
+    given the token bucket of a client with 2 requests per second
+    when the client makes a burst of 3 requests
+    then the third must be rejected until a token is back, half a second later
+    """
+    limiter = MemoryRateLimiter(maxsize=10)
+    results = [asyncio.run(limiter.hit("client", limit=2, window_ms=1000)) for _ in range(3)]
+    assert [result.allowed for result in results] == [True, True, False]
+    assert [result.remaining for result in results] == [1, 0, 0]
+    assert 0 < results[2].reset_ms <= 500
+
+
+def test_redis_rate_limiter():
+    """
+    given a sliding window of 3 requests every 10 seconds shared through redis
+    when a client makes 4 requests
+    then the fourth must be rejected until the first one leaves the window
+    """
+    async def hit_4_times():
+        redis_conn = redis.from_url(settings.REDIS_URL)
+        limiter = RedisRateLimiter(redis_conn=redis_conn, prefix=f"test-{uuid4().hex}", maxsize=10, batch_size=10)
+        await limiter.load_script()
+        results = [await limiter.hit("client", limit=3, window_ms=10000) for _ in range(4)]
+        await redis_conn.close()
+        return results
+
+    results = asyncio.run(hit_4_times())
+    assert [result.allowed for result in results] == [True, True, True, False]
+    assert [result.remaining for result in results] == [2, 1, 0, 0]
+    assert 9000 < results[3].reset_ms <= 10000
+
+
+def test_rate_limiters_too_large_cost():
+    """
+    given each rate limiter with a limit of 3 requests
+    when a client makes a request costing 4
+    then it must be told the request is too large, without a retry time and without spending the quota
+    """
+    async def hit_too_large():
+        redis_conn = redis.from_url(settings.REDIS_URL)
+        prefix = f"test-{uuid4().hex}"
+        limiters = [
+            MemoryRateLimiter(maxsize=10),
+            RedisRateLimiter(redis_conn=redis_conn, prefix=prefix, maxsize=10, batch_size=10),
+            HybridRateLimiter(redis_conn=redis_conn, prefix=prefix, maxsize=10, sync_interval_ms=0, batch_size=10),
+        ]
+        results = []
+        for limiter in limiters:
+            results.append((
+                await limiter.hit("client", limit=3, window_ms=10000, cost=4),
+                await limiter.hit("client", limit=3, window_ms=10000, cost=3),
+            ))
+        await redis_conn.close()
+        return results
+
+    for too_large, full in asyncio.run(hit_too_large()):
+        assert too_large.too_large and not too_large.allowed and too_large.reset_ms == 0
+        assert full.allowed and not full.too_large
+
+
+def test_redis_rate_limiter_without_redis():
+    """
+    given the redis rate limiter with a limit of 2 requests, and redis unreachable
+    when a client makes 3 requests
+    then the worker must limit them on its own instead of failing
+    """
+    async def hit_without_redis():
+        redis_conn = redis.from_url("redis://127.0.0.1:1")
+        limiter = RedisRateLimiter(redis_conn=redis_conn, prefix=f"test-{uuid4().hex}", maxsize=10, batch_size=10)
+        results = [await limiter.hit("client", limit=2, window_ms=10000) for _ in range(3)]
+        await redis_conn.close()
+        return results
+
+    results = asyncio.run(hit_without_redis())
+    assert [result.allowed for result in results] == [True, True, False]
+
+
+def test_redis_rate_limiter_rejects_locally():
+    """
+    given a client rejected by the redis rate limiter
+    when its window is cleared in redis behind the worker's back
+    then the worker must keep rejecting it until the rejection expires, without asking redis
+    """
+    async def hit_after_clearing():
+        redis_conn = redis.from_url(settings.REDIS_URL)
+        prefix = f"test-{uuid4().hex}"
+        limiter = RedisRateLimiter(redis_conn=redis_conn, prefix=prefix, maxsize=10, batch_size=10)
+        await limiter.load_script()
+        results = [await limiter.hit("client", limit=1, window_ms=300) for _ in range(2)]
+        await redis_conn.delete(f"{prefix}:client")
+        with mock.patch.object(limiter.batch, "execute", wraps=limiter.batch.execute) as execute:
+            results.append(await limiter.hit("client", limit=1, window_ms=300))
+            assert execute.call_count == 0
+            await asyncio.sleep(0.35)
+            results.append(await limiter.hit("client", limit=1, window_ms=300))
+            assert execute.call_count == 1
+        await redis_conn.close()
+        return results
+
+    results = asyncio.run(hit_after_clearing())
+    assert [result.allowed for result in results] == [True, False, False, True]
+    assert 0 < results[2].reset_ms <= results[1].reset_ms
+
+
+def test_redis_rate_limiter_batches_concurrent_requests():
+    """
+    given the redis rate limiter with a limit of 5 requests
+    when a client makes 12 requests at once
+    then their checks must be sent in one pipeline, and only 5 of them allowed
+    """
+    async def hit_at_once():
+        redis_conn = redis.from_url(settings.REDIS_URL)
+        limiter = RedisRateLimiter(redis_conn=redis_conn, prefix=f"test-{uuid4().hex}", maxsize=10, batch_size=100)
+        await limiter.load_script()
+        with mock.patch.object(limiter.batch, "execute", wraps=limiter.batch.execute) as execute:
+            results = await asyncio.gather(*(limiter.hit("client", limit=5, window_ms=10000) for _ in range(12)))
+        await redis_conn.close()
+        return results, execute.call_count
+
+    results, pipelines = asyncio.run(hit_at_once())
+    assert pipelines == 1
+    assert [result.allowed for result in results] == [True] * 5 + [False] * 7
+
+
+@pytest.mark.parametrize("error", [ValueError("not a redis error"), asyncio.CancelledError()])
+def test_script_batch_failure(error):
+    """
+    given concurrent requests checking the redis rate limit
+    when their pipeline fails with an error that is not a RedisError, or is cancelled
+    then every request must get the error instead of waiting forever, and the next batch must run
+    """
+    async def hit_failing_batch():
+        redis_conn = redis.from_url(settings.REDIS_URL)
+        limiter = RedisRateLimiter(redis_conn=redis_conn, prefix=f"test-{uuid4().hex}", maxsize=10, batch_size=100)
+        await limiter.load_script()
+        with mock.patch.object(limiter.batch, "execute", side_effect=error):
+            failures = await asyncio.wait_for(asyncio.gather(
+                *(limiter.hit(f"client{index}", limit=5, window_ms=10000) for index in range(3)),
+                return_exceptions=True,
+            ), timeout=5)
+        result = await limiter.hit("client", limit=5, window_ms=10000)
+        await redis_conn.close()
+        return failures, result
+
+    failures, result = asyncio.run(hit_failing_batch())
+    assert [type(failure) for failure in failures] == [type(error)] * 3
+    assert result.allowed
+
+
+def test_hybrid_rate_limiter():
+    """
+    given two workers counting the requests of a client and syncing them through redis
+    when the client spreads 4 requests over them, with a limit of 3
+    then the workers must reject the requests over the limit once they synced
+    """
+    async def hit_both_workers():
+        redis_conn = redis.from_url(settings.REDIS_URL)
+        prefix = f"test-{uuid4().hex}"
+        workers = [
+            HybridRateLimiter(redis_conn=redis_conn, prefix=prefix, maxsize=10, sync_interval_ms=0, batch_size=10)
+            for _ in range(2)
+        ]
+        for worker in workers:
+            await worker.load_script()
+        results = [await workers[index % 2].hit("client", limit=3, window_ms=60000) for index in range(4)]
+        await redis_conn.close()
+        return results
+
+    results = asyncio.run(hit_both_workers())
+    assert [result.allowed for result in results] == [True, True, True, False]
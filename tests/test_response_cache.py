@@ -0,0 +1,82 @@
+from src.blog.models import Post
+from tests.conftest import override_get_db
+
+# the requests limit buckets are keyed by client ip, so these requests must not
+# spend the quota checked in tests/test_requests_limits.py
+HEADERS = [{"X-Forwarded-For": f"10.0.2.{i}"} for i in range(4)]
+
+
+def login(client) -> dict:
+    data = {"name": "cache", "username": "cache", "email": "cache@example.com", "password": "secret"}
+    client.post("/auth/users", json=data)
+    response = client.post("/auth/access-token", data={"username": "cache@example.com", "password": "secret"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_get_post_not_modified(client):
+    """
+    given a post fetched once
+    when a client fetches it again sending the ETag it got
+    then the api should respond with a 304 and no body
+    """
+    db = next(override_get_db())
+    post = Post(title="cached", body="body", user_id=1)
+    db.add(post)
+    db.commit()
+
+    response = client.get(f"/posts/{post.id}", headers=HEADERS[0])
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    response = client.get(f"/posts/{post.id}", headers={**HEADERS[0], "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+
+def test_cached_post_invalidation(client):
+    """
+    given a cached post
+    when it gets a new comment or it is updated
+    then the next request should get the new version, with a new ETag
+    """
+    headers = login(client)
+    post_id = client.post("/posts", json={"title": "cached", "body": "body"}, headers=headers).json()["id"]
+
+    response = client.get(f"/posts/{post_id}", headers=HEADERS[1])
+    etag = response.headers["ETag"]
+    assert response.json()["comments"] == []
+
+    client.post(f"/comments/{post_id}", json={"body": "new comment"}, headers=headers)
+    response = client.get(f"/posts/{post_id}", headers={**HEADERS[1], "If-None-Match": etag})
+    assert response.status_code == 200
+    assert [comment["body"] for comment in response.json()["comments"]] == ["new comment"]
+    assert response.headers["ETag"] != etag
+
+    client.put(f"/posts/{post_id}", json={"title": "updated", "body": "body"}, headers=headers)
+    response = client.get(f"/posts/{post_id}", headers=HEADERS[1])
+    assert response.json()["title"] == "updated"
+
+
+def test_cached_posts_list_invalidation(client):
+    """
+    given a cached page of posts
+    when a post is added, changed behind the api's back, or deleted
+    then the page must be refreshed only by the changes made through the api
+    """
+    headers = login(client)
+    post_id = client.post("/posts", json={"title": "first", "body": "body"}, headers=headers).json()["id"]
+    response = client.get("/posts", params={"limit": 10}, headers=HEADERS[2])
+    assert response.json()[0]["id"] == post_id
+
+    # a change that skips the api is not seen while the page is cached
+    db = next(override_get_db())
+    db.query(Post).filter(Post.id == post_id).update({"title": "changed behind the api"})
+    db.commit()
+    response = client.get("/posts", params={"limit": 10}, headers=HEADERS[2])
+    assert response.json()[0]["title"] == "first"
+
+    client.delete(f"/posts/{post_id}", headers=headers)
+    response = client.get("/posts", params={"limit": 10}, headers=HEADERS[3])
+    assert post_id not in [post["id"] for post in response.json()]
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from fastapi import HTTPException
+from jwt.algorithms import OKPAlgorithm
+
+from src.authentication.token import JWKSCache, TokenVerifier
+
+
+def claims(**overrides) -> dict:
+    return {"sub": "someone@example.com", "exp": int(time.time()) + 60, **overrides}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def jwks_server():
+    """ a directory served over http, and its url """
+    directory = tempfile.mkdtemp()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield directory, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def verify(verifier: TokenVerifier, token: str):
+    """ verifies {token} the way verify_access_token does, fetching the JWKS when needed """
+    asyncio.run(verifier.fetch_keys(token))
+    return verifier.verify(token)
+
+
+def write_jwks(path: str, keys: dict):
+    """ publishes the public keys of {keys}, by kid, as a JWKS file """
+    with open(path, "w") as jwks_file:
+        json.dump({"keys": [
+            {**json.loads(OKPAlgorithm.to_jwk(key.public_key())), "kid": kid, "alg": "EdDSA"}
+            for kid, key in keys.items()
+        ]}, jwks_file)
+
+
+@pytest.mark.parametrize("algorithm, generate_key", [
+    ("RS256", lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+    ("EdDSA", ed25519.Ed25519PrivateKey.generate),
+])
+def test_asymmetric_tokens(algorithm, generate_key):
+    """
+    given a verifier of tokens signed with a private key
+    when it verifies a token signed with that key, and one signed with another key
+    then the first must be accepted and the second rejected
+    """
+    private_key = generate_key()
+    verifier = TokenVerifier(algorithm=algorithm, key=private_key.public_key())
+    token = jwt.encode(claims(), private_key, algorithm=algorithm)
+    assert verifier.verify(token).email == "someone@example.com"
+
+    with pytest.raises(HTTPException):
+        verifier.verify(jwt.encode(claims(), generate_key(), algorithm=algorithm))
+
+
+def test_key_rotation(jwks_server):
+    """
+    given a verifier whose app key is "2024-02", with the previous key "2024-01" still in its JWKS
+    when tokens signed with each key are verified, and then with a key added to the JWKS later
+    then all of them must be accepted, and tokens of a kid the JWKS does not have rejected
+    """
+    keys = {kid: ed25519.Ed25519PrivateKey.generate() for kid in ("2024-01", "2024-02", "2024-03")}
+    directory, url = jwks_server
+    path = os.path.join(directory, "rotation.json")
+    write_jwks(path, {"2024-01": keys["2024-01"]})
+    jwks = JWKSCache(url=f"{url}/rotation.json", ttl=300, refresh_interval=0, timeout=1)
+    verifier = TokenVerifier(algorithm="EdDSA", key=keys["2024-02"].public_key(), key_id="2024-02", jwks=jwks)
+
+    for kid in ("2024-01", "2024-02"):
+        token = jwt.encode(claims(), keys[kid], algorithm="EdDSA", headers={"kid": kid})
+        assert verify(verifier, token).email == "someone@example.com"
+    newer_token = jwt.encode(claims(), keys["2024-03"], algorithm="EdDSA", headers={"kid": "2024-03"})
+    with pytest.raises(HTTPException):
+        verify(verifier, newer_token)
+
+    write_jwks(path, keys)
+    assert verify(verifier, newer_token).email == "someone@example.com"
+
+
+def test_concurrent_misses_share_one_fetch(jwks_server):
+    """
+    given a verifier whose JWKS was never fetched
+    when tokens of several kids are verified concurrently
+    then the JWKS must be fetched once, in a thread, and all of them accepted
+    """
+    keys = {f"concurrent-{index}": ed25519.Ed25519PrivateKey.generate() for index in range(5)}
+    directory, url = jwks_server
+    write_jwks(os.path.join(directory, "concurrent.json"), keys)
+    jwks = JWKSCache(url=f"{url}/concurrent.json", ttl=300, refresh_interval=0, timeout=1)
+    verifier = TokenVerifier(algorithm="EdDSA", key=None, jwks=jwks)
+    tokens = [jwt.encode(claims(), key, algorithm="EdDSA", headers={"kid": kid}) for kid, key in keys.items()]
+    loop_thread = threading.get_ident()
+    fetch_threads = []
+    client_get_jwk_set = jwks.client.get_jwk_set
+
+    def get_jwk_set():
+        fetch_threads.append(threading.get_ident())
+        return client_get_jwk_set()
+
+    async def verify_concurrently():
+        await asyncio.gather(*(verifier.fetch_keys(token) for token in tokens))
+        return [verifier.verify(token).email for token in tokens]
+
+    with mock.patch.object(jwks.client, "get_jwk_set", side_effect=get_jwk_set):
+        emails = asyncio.run(verify_concurrently())
+    assert emails == ["someone@example.com"] * len(tokens)
+    assert len(fetch_threads) == 1 and fetch_threads[0] != loop_thread
+
+
+def test_unknown_kids_do_not_refetch_jwks(jwks_server):
+    """
+    given a verifier that fetched its JWKS recently
+    when it verifies tokens of kids the JWKS does not have
+    then it must reject them without fetching the JWKS again before its refresh interval
+    """
+    key = ed25519.Ed25519PrivateKey.generate()
+    directory, url = jwks_server
+    write_jwks(os.path.join(directory, "known.json"), {"known": key})
+    jwks = JWKSCache(url=f"{url}/known.json", ttl=300, refresh_interval=60, timeout=1)
+    verifier = TokenVerifier(algorithm="EdDSA", key=None, jwks=jwks)
+    assert verify(verifier, jwt.encode(claims(), key, algorithm="EdDSA", headers={"kid": "known"}))
+
+    with mock.patch.object(jwks.client, "get_jwk_set", wraps=jwks.client.get_jwk_set) as get_jwk_set:
+        for index in range(5):
+            with pytest.raises(HTTPException):
+                verify(verifier, jwt.encode(claims(), key, algorithm="EdDSA", headers={"kid": f"made-up-{index}"}))
+    assert get_jwk_set.call_count == 0
+
+
+@pytest.mark.parametrize("token", [
+    "not-a-token",
+    "a.b.c.d",
+    "eyJhbGciOiJFZERTQSJ9.bm90IGpzb24.c2ln",
+    jwt.encode(claims(exp=int(time.time()) - 1), "secret", algorithm="HS256"),
+    jwt.encode(claims(sub=None), "secret", algorithm="HS256"),
+    jwt.encode(claims(nbf=int(time.time()) + 60), "secret", algorithm="HS256"),
+])
+def test_invalid_tokens_rejected_before_crypto(token):
+    """
+    given a verifier of HS256 tokens
+    when it verifies a malformed, expired, anonymous or not yet valid token
+    then it must reject it without checking the signature
+    """
+    verifier = TokenVerifier(algorithm="HS256", key="secret")
+    with mock.patch.object(verifier.algorithm, "verify") as verify:
+        with pytest.raises(HTTPException) as error:
+            verifier.verify(token)
+    assert error.value.status_code == 401
+    verify.assert_not_called()
+
+
+def test_algorithm_is_pinned():
+    """
+    given a verifier of RS256 tokens
+    when it gets a token signed with HS256 using its public key as the secret, or an unsigned one
+    then it must reject both
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    verifier = TokenVerifier(algorithm="RS256", key=private_key.public_key())
+    unsigned = jwt.encode(claims(), None, algorithm="none")
+    with pytest.raises(HTTPException):
+        verifier.verify(unsigned)
+    forged = jwt.encode(claims(), "public key as a secret", algorithm="HS256")
+    with pytest.raises(HTTPException):
+        verifier.verify(forged)